@@ -0,0 +1,82 @@
+"""
+Time to solve the awswaf proof-of-work challenges by difficulty: the single-process search `pytr.awswaf.verify` did
+before `pytr.awswaf.solver`, which hashed the whole prefix for every nonce, against the solver with one worker and
+with one worker per CPU.
+
+Challenges are random, so every difficulty is solved for several of them and the mean counts. A search that does not
+finish within the deadline counts as the deadline.
+
+    python benchmarks/awswaf_pow.py [--kind sha256|scrypt] [--difficulties 12,16,20] [--challenges N] [--workers N]
+"""
+
+import argparse
+import hashlib
+import itertools
+import os
+import random
+import time
+
+from pytr.awswaf import solver
+
+SCRYPT_PARAMS = {"n": 128, "r": 8, "p": 1, "dklen": 16}
+
+
+def legacy_search(kind, prefix, salt, difficulty, seconds):
+    deadline = time.monotonic() + seconds
+    for nonce in itertools.count():
+        if kind == "sha256":
+            digest = hashlib.sha256((prefix + str(nonce)).encode()).digest()
+        else:
+            digest = hashlib.scrypt(password=f"{prefix}{nonce}".encode(), salt=salt.encode(), **SCRYPT_PARAMS)
+        if solver._check(digest, difficulty):
+            return str(nonce)
+        if nonce % 4096 == 0 and time.monotonic() > deadline:
+            return None
+
+
+def measure(search, challenges, difficulty, seconds):
+    total, solved = 0.0, 0
+    for prefix, salt in challenges:
+        start = time.perf_counter()
+        if search(prefix, salt, difficulty, seconds) is not None:
+            solved += 1
+        total += time.perf_counter() - start
+    return total / len(challenges), solved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=("sha256", "scrypt"), default="sha256")
+    parser.add_argument("--difficulties", default=None, help="comma separated, default depends on --kind")
+    parser.add_argument("--challenges", type=int, default=5, help="challenges per difficulty")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="workers of the parallel search")
+    parser.add_argument("--deadline", type=float, default=30.0, help="seconds before a search gives up")
+    args = parser.parse_args()
+
+    default = "12,16,18,20,22" if args.kind == "sha256" else "4,6,8,10"
+    difficulties = [int(d) for d in (args.difficulties or default).split(",")]
+    rng = random.Random(1)
+    workers = args.workers
+    kind = args.kind
+    params = SCRYPT_PARAMS if kind == "scrypt" else {}
+
+    implementations = {
+        "legacy": lambda prefix, salt, d, s: legacy_search(kind, prefix, salt, d, s),
+        "1 worker": lambda prefix, salt, d, s: solver.solve(kind, prefix, salt, d, s, params, workers=1),
+        f"{workers} workers": lambda prefix, salt, d, s: solver.solve(
+            kind, prefix, salt, d, s, params, workers=workers
+        ),
+    }
+    print(f"{kind}, mean of {args.challenges} challenges, deadline {args.deadline:.0f} s")
+    print(f"{'difficulty':>10}" + "".join(f"{name:>20}" for name in implementations))
+    for difficulty in difficulties:
+        challenges = [(f"{rng.getrandbits(128):032x}salt", "salt") for _ in range(args.challenges)]
+        row = f"{difficulty:>10}"
+        for search in implementations.values():
+            seconds, solved = measure(search, challenges, difficulty, args.deadline)
+            row += f"{seconds * 1000:>11.1f} ms ({solved}/{len(challenges)})"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
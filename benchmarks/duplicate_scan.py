@@ -0,0 +1,108 @@
+"""
+Time of merging the event database with a sync's events while scanning for duplicates (`--scan-for-duplicates`): the
+scan of every merged event for every event that pytr did before `DuplicateIndex`, against the current merge.
+
+The events are synthetic: savings plans and limit orders for a few instruments, among interest payouts and
+deposits, some of them a second copy of an order a few hundred milliseconds later, as the timeline shows them when
+an order changes. The new events are the newest part of the database again, with some changed copies.
+
+    python benchmarks/duplicate_scan.py [--events N ...] [--skip-scan-above N]
+"""
+
+import argparse
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from pytr.timeline import is_likely_same_but_newer, merge_events
+
+TITLES = ["Apple", "Microsoft", "MSCI World", "S&P 500", "Gold", "Bitcoin", "Siemens", "SAP"]
+SUBTITLES = ["Sparplan ausgeführt", "Limit-Buy-Order", "Limit-Sell-Order", "Zinszahlung", "Fertig"]
+
+
+def build_events(count, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    events = []
+    for i in range(count):
+        if events and rng.random() < 0.05:
+            # a second copy of an earlier event, within the duplicate window or just outside
+            event = dict(rng.choice(events[-20:]))
+            date = datetime.strptime(event["timestamp"], "%Y-%m-%dT%H:%M:%S.%f%z")
+            date += timedelta(milliseconds=rng.randint(0, 800))
+        else:
+            event = {"title": rng.choice(TITLES), "subtitle": rng.choice(SUBTITLES)}
+            date = start + timedelta(seconds=i * 3600 + rng.randint(0, 3000))
+        event["id"] = f"event-{i:07d}"
+        event["timestamp"] = date.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+0000"
+        events.append(event)
+    return events
+
+
+def merge_events_by_scan(old_events, new_events):
+    """The merge before `DuplicateIndex`: every event is compared with every merged one."""
+    cur_events = {}
+    for event in old_events:
+        idtodel = None
+        for id in cur_events:
+            if is_likely_same_but_newer(event, cur_events[id]):
+                idtodel = id
+                break
+        if idtodel is not None:
+            cur_events.pop(idtodel)
+        cur_events[event["id"]] = event
+    for event in new_events:
+        idtodel = None
+        for id in cur_events:
+            if event["id"] != id and is_likely_same_but_newer(event, cur_events[id]):
+                idtodel = id
+                break
+        if idtodel is not None:
+            cur_events.pop(idtodel)
+        cur_events[event["id"]] = event
+    return list(cur_events.values())
+
+
+def _split(events, seed=2):
+    # The newest tenth is synced again, some of it changed.
+    rng = random.Random(seed)
+    new_events = [dict(event) for event in events[-len(events) // 10 :]]
+    for event in new_events:
+        if rng.random() < 0.2:
+            event["status"] = "CANCELED"
+    return events, new_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[1000, 5000, 20000, 100000])
+    parser.add_argument(
+        "--skip-scan-above", type=int, default=5000, help="Only time the scan for up to this many events"
+    )
+    args = parser.parse_args()
+
+    log = logging.getLogger("benchmark")
+    log.disabled = True
+
+    print(f"{'events':>8} {'scan':>10} {'index':>10} {'speedup':>8}")
+    for count in args.events:
+        old_events, new_events = _split(build_events(count))
+
+        started = time.perf_counter()
+        merged = merge_events(old_events, new_events, log, scan_for_duplicates=True)
+        indexed = time.perf_counter() - started
+
+        if count > args.skip_scan_above:
+            print(f"{count:>8} {'-':>10} {indexed:>9.3f}s {'-':>8}")
+            continue
+        started = time.perf_counter()
+        expected = merge_events_by_scan(old_events, new_events)
+        scanned = time.perf_counter() - started
+        if merged != expected:
+            raise SystemExit(f"The merges differ for {count} events")
+        print(f"{count:>8} {scanned:>9.3f}s {indexed:>9.3f}s {scanned / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
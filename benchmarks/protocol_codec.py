@@ -0,0 +1,135 @@
+"""
+Throughput of the websocket frame codec: the per-frame work TradeRepublicApi did before `pytr.protocol`, including
+its debug logging, against the current one.
+
+The frames are modelled on what a timeline sync and a ticker subscription receive: a full `A` frame for every event
+fixture in tests/events (the timelineDetailV2 payloads recorded from real accounts) followed by a stream of `D`
+frames for ticker updates, encoded with `pytr.protocol.encode_delta`.
+
+    python benchmarks/protocol_codec.py [--repeat N]
+"""
+
+import argparse
+import json
+import logging
+import random
+import time
+import urllib.parse
+from pathlib import Path
+
+from pytr.protocol import apply_delta, encode_delta, parse_frame
+from pytr.utils import debug_enabled
+
+EVENTS_DIR = Path(__file__).parent.parent / "tests" / "events"
+
+
+def build_frames(ticker_updates=5000, seed=1):
+    frames = []
+    for i, path in enumerate(sorted(EVENTS_DIR.glob("*.json")), 1):
+        frames.append(f"{i} A {json.dumps(json.loads(path.read_text(encoding='utf-8')))}")
+
+    rng = random.Random(seed)
+    price = 101.23
+    previous = None
+    for n in range(ticker_updates):
+        price = round(price * (1 + rng.uniform(-0.001, 0.001)), 2)
+        ticker = {
+            "bid": {"time": 1700000000000 + n * 250, "price": f"{price - 0.01:.2f}", "size": rng.randint(1, 5000)},
+            "ask": {"time": 1700000000000 + n * 250, "price": f"{price + 0.01:.2f}", "size": rng.randint(1, 5000)},
+            "last": {"time": 1700000000000 + n * 250, "price": f"{price:.2f}", "size": rng.randint(1, 5000)},
+            "pre": {"time": 1699999000000, "price": "100.00", "size": 0},
+            "open": {"time": 1699990000000, "price": "100.50", "size": 0},
+            "qualityId": "realtime",
+            "leverage": None,
+            "delta": None,
+        }
+        current = json.dumps(ticker, separators=(",", ":"))
+        frames.append(f"1000 A {current}" if previous is None else f"1000 D {encode_delta(previous, current)}")
+        previous = current
+    return frames
+
+
+def _logger():
+    # Like pytr's loggers: the logger lets debug records through, its handler drops them.
+    log = logging.getLogger("benchmark")
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    log.addHandler(handler)
+    return log
+
+
+def legacy_handle(frames, log):
+    previous_responses = {}
+    for response in frames:
+        log.debug(f"Received message: {response!r}")
+        subscription_id = response[: response.find(" ")]
+        code = response[response.find(" ") + 1 : response.find(" ") + 2]
+        payload_str = response[response.find(" ") + 2 :].lstrip()
+        if code == "A":
+            previous_responses[subscription_id] = payload_str
+        elif code == "D":
+            previous = previous_responses[subscription_id]
+            i, result = 0, []
+            for diff in payload_str.split("\t"):
+                sign = diff[0]
+                if sign == "+":
+                    result.append(urllib.parse.unquote_plus(diff).strip())
+                elif sign == "-" or sign == "=":
+                    if sign == "=":
+                        result.append(previous[i : i + int(diff[1:])])
+                    i += int(diff[1:])
+            response = "".join(result)
+            log.debug(f"Payload is {response}")
+            previous_responses[subscription_id] = response
+    return previous_responses
+
+
+def codec_handle(frames, log):
+    previous_responses = {}
+    for response in frames:
+        log_frames = debug_enabled(log)
+        if log_frames:
+            log.debug(f"Received message: {response!r}")
+        subscription_id, code, payload_str = parse_frame(response)
+        if code == "A":
+            previous_responses[subscription_id] = payload_str
+        elif code == "D":
+            response = apply_delta(previous_responses[subscription_id], payload_str)
+            if log_frames:
+                log.debug(f"Payload is {response}")
+            previous_responses[subscription_id] = response
+    return previous_responses
+
+
+def measure(handle, frames, log, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        handle(frames, log)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7, help="runs per implementation, the best one counts")
+    args = parser.parse_args()
+
+    frames = build_frames()
+    log = _logger()
+    assert legacy_handle(frames, log) == codec_handle(frames, log), "implementations disagree"
+
+    deltas = sum(1 for frame in frames if parse_frame(frame)[1] == "D")
+    megabytes = sum(len(frame) for frame in frames) / 1e6
+    print(f"{len(frames)} frames ({deltas} deltas, {megabytes:.1f} MB), best of {args.repeat} runs")
+    legacy = measure(legacy_handle, frames, log, args.repeat)
+    codec = measure(codec_handle, frames, log, args.repeat)
+    for name, seconds in (("legacy", legacy), ("pytr.protocol", codec)):
+        print(f"{name:>14}: {seconds * 1000:8.1f} ms  {len(frames) / seconds:>10,.0f} frames/s")
+    print(f"{'speedup':>14}: {legacy / codec:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
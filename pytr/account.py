@@ -1,3 +1,4 @@
+import atexit
 import json
 import os
 import sys
@@ -7,7 +8,8 @@ from getpass import getpass
 from pygments import formatters, highlight, lexers
 
 from .api import BASE_DIR, CREDENTIALS_FILE, TradeRepublicApi
-from .utils import get_logger
+from .replay import replay_api
+from .utils import debug_enabled, get_logger
 
 
 def get_settings(tr):
@@ -19,12 +21,44 @@ def get_settings(tr):
         return formatted_json
 
 
-def login(phone_no=None, pin=None, store_credentials=False, waf_token="playwright", v2=False):
+def login(
+    phone_no=None,
+    pin=None,
+    store_credentials=False,
+    waf_token="playwright",
+    v2=False,
+    record_session=None,
+    replay_session=None,
+    replay_realtime=False,
+    api_url=None,
+    metrics_file=None,
+):
     """
     Handle credentials parameters and store to credentials file if requested.
-    If no parameters are set but are needed then ask for input
+    If no parameters are set but are needed then ask for input.
+    With `replay_session`, skip all of it and return an api object that replays that recorded session instead.
+    With `api_url`, skip it as well and talk to the server at that URL, e.g. a `pytr simulate` one.
+    With `metrics_file`, write the websocket metrics of the api object to that file at exit.
     """
+    tr = _login(
+        phone_no, pin, store_credentials, waf_token, v2, record_session, replay_session, replay_realtime, api_url
+    )
+    if metrics_file is not None:
+        atexit.register(tr.metrics.dump, metrics_file)
+    return tr
+
+
+def _login(phone_no, pin, store_credentials, waf_token, v2, record_session, replay_session, replay_realtime, api_url):
     log = get_logger(__name__)
+    if replay_session is not None:
+        log.info(f"Replaying the websocket session recorded in {replay_session}.")
+        return replay_api(replay_session, replay_realtime)
+    if api_url is not None:
+        log.info(f"Using the server at {api_url} without logging in.")
+        tr = TradeRepublicApi(phone_no="simulator", pin="simulator", waf_token=None, record_session=record_session)
+        tr._host = api_url.rstrip("/")
+        tr._ws_url = "ws" + tr._host.removeprefix("http")
+        return tr
     save_cookies = True
 
     if phone_no is None and CREDENTIALS_FILE.is_file():
@@ -54,39 +88,62 @@ def login(phone_no=None, pin=None, store_credentials=False, waf_token="playwrigh
         else:
             save_cookies = False
 
-    tr = TradeRepublicApi(phone_no=phone_no, pin=pin, save_cookies=save_cookies, waf_token=waf_token, use_v2_login=v2)
+    tr = TradeRepublicApi(
+        phone_no=phone_no,
+        pin=pin,
+        save_cookies=save_cookies,
+        waf_token=waf_token,
+        use_v2_login=v2,
+        record_session=record_session,
+    )
+    return weblogin(tr, v2)
+
+
+def weblogin(tr, v2=False):
+    """
+    Resume the saved web session of `tr` or, if there is none, walk the user through a fresh web login.
+    """
+    log = get_logger(__name__)
 
-    # Use same login as app.traderepublic.com
+    # Use same login as app.traderepublic.com. A resumed session that turns out to be invalid later, when it was
+    # resumed without checking it, ends up here again.
+    tr._relogin = lambda: _fresh_weblogin(tr, v2)
     if not tr.resume_websession():
-        try:
-            countdown = tr.initiate_weblogin()
-        except ValueError as e:
-            log.fatal(str(e))
-            sys.exit(1)
-        request_time = time.time()
-        if v2:
-            if tr.weblogin_needs_authenticator:
-                code = input("Enter the code from your authenticator app: ")
-            else:
-                print(f"Confirm the login in your Trade Republic app. (Countdown: {countdown})")
-                code = None
-        else:
-            print("Enter the code you received to your mobile app as a notification.")
-            print(f"Enter nothing if you want to receive the (same) code as SMS. (Countdown: {countdown})")
-            code = input("Code: ")
-            if code == "":
-                countdown = countdown - (time.time() - request_time)
-                for remaining in range(int(countdown)):
-                    print(
-                        f"Need to wait {int(countdown - remaining)} seconds before requesting SMS...",
-                        end="\r",
-                    )
-                    time.sleep(1)
-                print()
-                tr.resend_weblogin()
-                code = input("SMS requested. Enter the confirmation code:")
-        tr.complete_weblogin(code)
-        log.info("Logged in.")
-
-    log.debug(get_settings(tr))
+        _fresh_weblogin(tr, v2)
+
+    if debug_enabled(log):
+        log.debug(get_settings(tr))
     return tr
+
+
+def _fresh_weblogin(tr, v2):
+    log = get_logger(__name__)
+    try:
+        countdown = tr.initiate_weblogin()
+    except ValueError as e:
+        log.fatal(str(e))
+        sys.exit(1)
+    request_time = time.time()
+    if v2:
+        if tr.weblogin_needs_authenticator:
+            code = input("Enter the code from your authenticator app: ")
+        else:
+            print(f"Confirm the login in your Trade Republic app. (Countdown: {countdown})")
+            code = None
+    else:
+        print("Enter the code you received to your mobile app as a notification.")
+        print(f"Enter nothing if you want to receive the (same) code as SMS. (Countdown: {countdown})")
+        code = input("Code: ")
+        if code == "":
+            countdown = countdown - (time.time() - request_time)
+            for remaining in range(int(countdown)):
+                print(
+                    f"Need to wait {int(countdown - remaining)} seconds before requesting SMS...",
+                    end="\r",
+                )
+                time.sleep(1)
+            print()
+            tr.resend_weblogin()
+            code = input("SMS requested. Enter the confirmation code:")
+    tr.complete_weblogin(code)
+    log.info("Logged in.")
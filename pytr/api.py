@@ -22,13 +22,18 @@
 
 import asyncio
 import base64
+import contextlib
+import contextvars
 import hashlib
 import json
 import os
 import pathlib
 import platform
+import queue
 import re
 import ssl
+import tempfile
+import threading
 import time
 import urllib.parse
 import uuid
@@ -40,8 +45,12 @@ import certifi
 import requests
 import websockets
 from curl_cffi import requests as cffi_requests
+from requests.adapters import HTTPAdapter
 
-from pytr.utils import get_logger
+from pytr import jsonio
+from pytr.metrics import WebsocketMetrics
+from pytr.protocol import apply_delta, parse_frame
+from pytr.utils import debug_enabled, get_logger
 
 # `playwright` and `pytr.awswaf` are imported lazily inside the two
 # `_fetch_waf_token_*` methods, not here. Both are only reachable when the
@@ -79,6 +88,24 @@ LOGIN_ERRORS = {
     "VALIDATION_CODE_ALREADY_USED": "That authenticator code was already used.",
 }
 
+# Subscription types that act on the account instead of reading data. Every one of them has to reach the server, so
+# they never share a subscription with an identical one, see `_subscribe`.
+ACTION_TYPES = frozenset(
+    {
+        "addToWatchlist",
+        "cancelOrder",
+        "cancelPriceAlarm",
+        "cancelSavingsPlan",
+        "changeSavingsPlan",
+        "createPriceAlarm",
+        "createSavingsPlan",
+        "removeFromWatchlist",
+        "simpleCreateOrder",
+        "subscribeNews",
+        "unsubscribeNews",
+    }
+)
+
 # Build version of the web frontend. Sent on every api/v2 login call.
 # Moves with each frontend deployment; bump when TR starts rejecting stale versions.
 APP_VERSION = "2.2631.13"
@@ -98,12 +125,35 @@ class TradeRepublicApi:
     _required_action = None
     _device_info = None
     _session_expires_at = 0
-
-    _ws = None
-    _lock = asyncio.Lock()
-    _subscription_id_counter = 1
-    _previous_responses: Dict[str, str] = {}
-    subscriptions: Dict[str, Dict[str, Any]] = {}
+    _session_refresh_timer = None
+    _last_web_request = 0.0
+
+    # The web session has to be refreshed every five minutes. `_web_request` does so inline when it has expired,
+    # and while requests keep coming a timer does it in the background shortly before that.
+    _session_lifetime = 290
+    _session_refresh_margin = 30
+    # Set when `resume_websession` trusted a recent validation instead of checking the session. An auth error then
+    # makes `_revalidate_session` refresh it. If that fails too, it calls `_relogin` where the user can be asked for
+    # a code and raises `SessionExpiredError` elsewhere.
+    _session_unverified = False
+    _relogin = None
+
+    # Connections kept alive per host for the REST calls, enough for the parallel document downloads of `DL`.
+    _http_pool_size = 16
+
+    # How `_reconnect` replaces a dropped websocket: attempts, and the first and the longest wait between them.
+    _reconnect_attempts = 5
+    _reconnect_backoff = 1.0
+    _reconnect_backoff_max = 30.0
+
+    _ws_url = "wss://api.traderepublic.com"
+
+    # WAF tokens are kept in `waf_tokens.json` next to the cookie file, if cookies are saved, and reused by later
+    # logins until shortly before this many seconds have passed.
+    _waf_token_ttl = 3600
+    _waf_token_min_validity = 60
+    # With `--waf-token race`, seconds to give awswaf before starting Playwright as well.
+    _waf_race_hedge_delay = 3.0
 
     _credentials_file = CREDENTIALS_FILE
     _cookies_file = COOKIES_FILE
@@ -118,6 +168,7 @@ class TradeRepublicApi:
         cookies_file=None,
         use_v2_login=False,
         waf_token="default",
+        record_session=None,
     ):
         self.log = get_logger(__name__)
         self._locale = locale
@@ -145,13 +196,55 @@ class TradeRepublicApi:
 
         self._websession = requests.Session()
         self._websession.headers = self._default_headers
+        self._websession.mount("https://", HTTPAdapter(pool_maxsize=self._http_pool_size))
         if self._save_cookies:
             self._websession.cookies = MozillaCookieJar(self._cookies_file)
+        # Web requests come from worker threads and the refresh timer. This lock keeps them from refreshing the
+        # session, replacing the timer or saving the cookies at the same time. Reentrant, since a refresh saves.
+        self._session_lock = threading.RLock()
         self._sec_acc_no: str | None = None
 
-    def _fetch_waf_token_awswaf(self):
+        # Connection state is per instance, so that several accounts can share one process and event loop
+        # without seeing each other's subscriptions or delta baselines.
+        self._ws = None
+        self._lock = asyncio.Lock()
+        self._subscription_id_counter = 1
+        self._previous_responses: Dict[str, str] = {}
+        self.subscriptions: Dict[str, Dict[str, Any]] = {}
+
+        # Filled by the reader task started in `_get_ws`. Frames of subscriptions opened through `stream()` go to
+        # their own queue, everything else to the shared one that `recv()` drains.
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._reader_task: asyncio.Task | None = None
+        self._recv_queue: asyncio.Queue | None = None
+
+        # How `_connect` opens the websocket, `websockets.connect` unless replaced, e.g. by `pytr.replay`.
+        self._ws_connect = None
+        self._session_recorder = None
+        if record_session is not None:
+            from pytr.replay import SessionRecorder
+
+            self._session_recorder = SessionRecorder(record_session)
+
+        # Started by the first `blocking_*` call, see `_blocking_event_loop`.
+        self._blocking_loop: asyncio.AbstractEventLoop | None = None
+        self._blocking_lock = threading.Lock()
+
+        # Identical payloads, other than actions, share one server-side subscription. `subscriptions` and `_previous_responses` are keyed
+        # by the id the server knows, which is the id of the listener that opened it. Every `subscribe()` gets an
+        # id of its own though: `_listeners` maps a server-side id to the queues of its listeners by listener id
+        # (None for the `recv()` queue), `_routes` maps a listener id back to the server-side id.
+        self._listeners: Dict[str, Dict[str, asyncio.Queue | None]] = {}
+        self._routes: Dict[str, str] = {}
+        self._shared: Dict[str, str] = {}
+
+        # Traffic counters per subscription type, and when each server-side subscription without a frame yet was made.
+        self.metrics = WebsocketMetrics()
+        self._subscribed_at: Dict[str, float] = {}
+
+    def _fetch_waf_token_awswaf(self, stop=None):
         """
-        Get the AWS WAF token, using the awswaf library.
+        Get the AWS WAF token, using the awswaf library. Gives up early once the `stop` event is set.
         """
 
         from pytr.awswaf.aws import AwsWaf
@@ -177,7 +270,7 @@ class TradeRepublicApi:
                 return None
             waf_endpoint = challenge_js_url.split("https://", 1)[1].rsplit("/challenge.js", 1)[0]
             challenge_js = session.get(challenge_js_url).text
-            token = AwsWaf(waf_endpoint, "app.traderepublic.com", challenge_js)()
+            token = AwsWaf(waf_endpoint, "app.traderepublic.com", challenge_js, stop=stop)()
         except Exception:
             self.log.error("Failed to get AWS WAF token.")
             raise
@@ -186,9 +279,50 @@ class TradeRepublicApi:
             self.log.warning("AWS WAF token not acquired. Value is None.")
         return token
 
-    def _fetch_waf_token_playwright(self, timeout_ms: int = 30000):
+    def _fetch_waf_token_race(self):
+        """
+        Get the AWS WAF token with awswaf and, unless that has succeeded within `_waf_race_hedge_delay` seconds, with
+        Playwright as well. The first token wins and the other strategy is told to stop.
+        """
+        self.log.info("Racing awswaf and Playwright for an AWS WAF token...")
+        results: queue.Queue = queue.Queue()
+        stop = threading.Event()
+
+        def run(name, fetch):
+            try:
+                results.put((name, fetch(stop=stop), None))
+            except Exception as e:
+                results.put((name, None, e))
+
+        def start(name, fetch):
+            # Daemon threads: a loser that does not notice `stop` right away must not keep pytr from exiting.
+            threading.Thread(target=run, args=(name, fetch), name=f"waf-{name}", daemon=True).start()
+
+        start("awswaf", self._fetch_waf_token_awswaf)
+        racing, hedged = 1, False
+        try:
+            while racing:
+                try:
+                    name, token, error = results.get(timeout=None if hedged else self._waf_race_hedge_delay)
+                except queue.Empty:
+                    name = None
+                else:
+                    racing -= 1
+                    if token:
+                        self.log.info(f"AWS WAF token acquired with {name}.")
+                        return token
+                    self.log.warning(f"{name} did not get an AWS WAF token{f': {error}' if error else ''}.")
+                if not hedged:
+                    # awswaf is slow or has failed already, start Playwright.
+                    start("playwright", self._fetch_waf_token_playwright)
+                    racing, hedged = racing + 1, True
+            return None
+        finally:
+            stop.set()
+
+    def _fetch_waf_token_playwright(self, timeout_ms: int = 30000, stop=None):
         """
-        Get the AWS WAF token, using a Playwright browser session.
+        Get the AWS WAF token, using a Playwright browser session. Stops waiting for it once the `stop` event is set.
 
         Requires the optional `playwright` extra plus its browser binary:
             pip install 'pytr[playwright]' && playwright install chromium
@@ -230,7 +364,7 @@ class TradeRepublicApi:
                 )
                 deadline = time.time() + timeout_ms / 1000
                 token = None
-                while time.time() < deadline:
+                while time.time() < deadline and not (stop is not None and stop.is_set()):
                     for c in context.cookies():
                         if c["name"] == "aws-waf-token":
                             token = c["value"]
@@ -329,8 +463,16 @@ class TradeRepublicApi:
             "Accept-Language": self._locale,
         }
 
-    def initiate_weblogin(self):
-        self.log.info("Initiating web login...")
+    def _obtain_waf_token(self, use_cache=True):
+        """
+        Replace a strategy in `_waf_token` with a token and set it as cookie. Return the strategy, if any, and whether
+        the token came from the cache.
+        """
+        strategy = self._waf_token if self._waf_token in ("awswaf", "playwright", "race") else None
+        cached = strategy is not None and use_cache and self._cached_waf_token(strategy)
+        if cached:
+            self.log.info(f"Using cached WAF token ({strategy}).")
+            self._waf_token = cached
 
         if self._waf_token == "awswaf":
             self._waf_token = self._fetch_waf_token_awswaf()
@@ -340,23 +482,81 @@ class TradeRepublicApi:
             self._waf_token = self._fetch_waf_token_playwright()
             if not self._waf_token:
                 self.log.warning("No WAF token available.")
-        elif self._waf_token:
+        elif self._waf_token == "race":
+            self._waf_token = self._fetch_waf_token_race()
+            if not self._waf_token:
+                self.log.warning("No WAF token available.")
+        elif strategy is None and self._waf_token:
             self.log.info("Using WAF token from arguments.")
-        else:
+        elif strategy is None:
             self.log.info("WAF token skipped.")
 
         if self._waf_token:
             self.log.debug(f"WAF Token: {self._waf_token}")
             self._set_waf_cookie(self._waf_token)
+        if strategy is not None and self._waf_token and not cached:
+            self._store_waf_token(strategy, self._waf_token)
+        return strategy, bool(cached)
 
+    @property
+    def _waf_tokens_file(self):
+        return self._cookies_file.parent / "waf_tokens.json"
+
+    def _read_waf_tokens(self):
+        try:
+            tokens = jsonio.read_file(self._waf_tokens_file)
+        except (OSError, ValueError):
+            return {}
+        return _unexpired_waf_tokens(tokens)
+
+    def _cached_waf_token(self, strategy):
+        """A token obtained with `strategy` for this phone number that is still valid for a while, or None."""
+        if not self._save_cookies:
+            return None
+        entry = self._read_waf_tokens().get(f"{self.phone_no}:{strategy}")
+        if entry is None or entry["expires"] < time.time() + self._waf_token_min_validity:
+            return None
+        return entry["token"]
+
+    def _store_waf_token(self, strategy, token):
+        if not self._save_cookies:
+            return
+        key = f"{self.phone_no}:{strategy}"
+
+        def update(tokens):
+            unexpired = _unexpired_waf_tokens(tokens)
+            tokens.clear()
+            tokens.update(unexpired)
+            if token is None:
+                tokens.pop(key, None)
+            else:
+                tokens[key] = {"token": token, "expires": time.time() + self._waf_token_ttl}
+
+        _update_state_file(self._waf_tokens_file, update)
+
+    def _post_weblogin(self):
         extra_headers = self._login_headers() if self._use_v2_login else None
         login_path = "/api/v2/auth/web/login" if self._use_v2_login else "/api/v1/auth/web/login"
-        r = self._websession.post(
+        return self._websession.post(
             f"{self._host}{login_path}",
             json={"phoneNumber": self.phone_no, "pin": self.pin},
             headers=extra_headers,
         )
+
+    def initiate_weblogin(self):
+        self.log.info("Initiating web login...")
+
+        strategy, cached = self._obtain_waf_token()
+
+        r = self._post_weblogin()
         self.log.debug(f"Web login returned: {r.status_code}")
+        if cached and r.status_code == 405 and "awselb" in r.headers.get("server", "").lower():
+            self.log.info("The cached WAF token was rejected, obtaining a new one...")
+            self._store_waf_token(strategy, None)
+            self._waf_token = strategy
+            self._obtain_waf_token(use_cache=False)
+            r = self._post_weblogin()
+            self.log.debug(f"Web login returned: {r.status_code}")
         if r.status_code == 405 and "awselb" in r.headers.get("server", "").lower():
             hint = (
                 f"The request was blocked by the AWS load balancer before reaching Trade Republic "
@@ -482,8 +682,39 @@ class TradeRepublicApi:
 
     def save_websession(self):
         if self._save_cookies:
-            # Saves session cookies too (expirydate=0).
-            self._websession.cookies.save(ignore_discard=True)
+            with self._session_lock:
+                # Saves session cookies too (expirydate=0).
+                self._websession.cookies.save(ignore_discard=True)
+                self._store_session_validation(time.time())
+
+    @property
+    def _sessions_file(self):
+        return self._cookies_file.parent / "sessions.json"
+
+    def _store_session_validation(self, validated):
+        """
+        Record that the saved cookies were accepted at `validated`, so that the next `resume_websession` within
+        `_session_lifetime`, and before any of the cookies expires, can skip checking them. None forgets it.
+        """
+        if validated is None:
+            _update_state_file(self._sessions_file, lambda sessions: sessions.pop(self.phone_no, None))
+            return
+        expires = validated + self._session_lifetime
+        for cookie in self._websession.cookies:
+            if cookie.domain.endswith("traderepublic.com") and cookie.expires:
+                expires = min(expires, cookie.expires)
+        entry = {"validated": validated, "expires": expires}
+        _update_state_file(self._sessions_file, lambda sessions: sessions.update({self.phone_no: entry}))
+
+    def _validated_session_expiry(self):
+        """Until when the saved cookies can be used without checking them, 0 if they have to be checked."""
+        try:
+            session = jsonio.read_file(self._sessions_file).get(self.phone_no)
+        except (OSError, ValueError, AttributeError):
+            return 0
+        if not session or session.get("expires", 0) < time.time() + self._session_refresh_margin:
+            return 0
+        return session["expires"]
 
     def resume_websession(self):
         """
@@ -501,6 +732,14 @@ class TradeRepublicApi:
         # Loads session cookies too (expirydate=0).
         self._websession.cookies.load(ignore_discard=True)
 
+        expires = self._validated_session_expiry()
+        if expires:
+            # Checked a moment ago by an earlier run: skip the round trips, an auth error falls back to them.
+            self.log.info("Websession resumed, validated recently.")
+            self._session_expires_at = expires
+            self._session_unverified = True
+            return True
+
         try:
             self.log.debug("Calling settings...")
             self.settings()
@@ -512,19 +751,107 @@ class TradeRepublicApi:
             return False
 
         self.log.info("Websession resumed.")
+        self.save_websession()
         return True
 
+    def _revalidate_session(self):
+        """Recover from an auth error with a session that `resume_websession` did not check."""
+        self._session_unverified = False
+        self.log.info("The resumed websession was rejected, refreshing it...")
+        if self._save_cookies:
+            self._store_session_validation(None)
+        try:
+            self._refresh_websession()
+        except requests.exceptions.HTTPError as e:
+            self._websession.cookies.clear()
+            # Logging in again may ask for a code. That is only possible from the main thread outside of an event
+            # loop, not from a worker thread, the websocket reader or the refresh timer, where the prompts of
+            # several accounts could get mixed up.
+            if self._relogin is None or not _can_prompt():
+                raise SessionExpiredError(
+                    f"The saved web session of {self.phone_no} was rejected. Run pytr again to log in."
+                ) from e
+            self.log.info("Refreshing the websession failed, logging in again.")
+            self._relogin()
+
     def _web_request(self, url_path, payload=None, method="GET"):
+        self._last_web_request = time.time()
         if self._session_expires_at < time.time():
+            with self._session_lock:
+                # Another thread may have refreshed it while this one waited for the lock.
+                if self._session_expires_at < time.time():
+                    self._refresh_websession()
+        r = self._websession.request(method=method, url=f"{self._host}{url_path}", data=payload)
+        if r.status_code in (401, 403) and self._session_unverified:
+            self._revalidate_session()
+            r = self._websession.request(method=method, url=f"{self._host}{url_path}", data=payload)
+        return r
+
+    async def _web_request_async(self, url_path, payload=None, method="GET"):
+        """`_web_request` on a worker thread, so that many requests can share the connection pool concurrently."""
+        return await asyncio.to_thread(self._web_request, url_path, payload, method)
+
+    def _refresh_websession(self):
+        with self._session_lock:
             r = self._websession.get(f"{self._host}/api/v1/auth/web/session")
             r.raise_for_status()
-            self._session_expires_at = time.time() + 290
-        return self._websession.request(method=method, url=f"{self._host}{url_path}", data=payload)
+            self._session_expires_at = time.time() + self._session_lifetime
+            # The refreshed session cookie is what the next run resumes with.
+            self.save_websession()
+
+            if self._session_refresh_timer is not None:
+                self._session_refresh_timer.cancel()
+            self._session_refresh_timer = threading.Timer(
+                self._session_lifetime - self._session_refresh_margin, self._refresh_websession_in_background
+            )
+            self._session_refresh_timer.daemon = True
+            self._session_refresh_timer.start()
+
+    def _refresh_websession_in_background(self):
+        with self._session_lock:
+            self._session_refresh_timer = None
+            # Only keep the session alive while it is used. Otherwise the next request refreshes it inline.
+            if time.time() - self._last_web_request > self._session_lifetime:
+                return
+            try:
+                self._refresh_websession()
+            except requests.RequestException:
+                self.log.debug("Refreshing the web session in the background failed.", exc_info=True)
+
+    def _bind_to_running_loop(self):
+        """Forget connection state that belongs to an event loop other than the running one.
+
+        The same instance may be used from several loops one after the other, e.g. by `asyncio.run()` calls and
+        the background loop of the `blocking_*` calls. The websocket, the reader task and the queues of one loop
+        cannot be used from another, and the subscriptions made on that websocket do not exist on the next one.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._ws = None
+        self._lock = asyncio.Lock()
+        self._reader_task = None
+        self._recv_queue = asyncio.Queue()
+        self._listeners = {}
+        self._routes = {}
+        self._shared = {}
+        self._subscribed_at = {}
+        self.subscriptions = {}
+        self._previous_responses = {}
 
     async def _get_ws(self):
-        if self._ws and self._ws.close_code is None:
+        self._bind_to_running_loop()
+        # While the reader task runs, it owns the connection: it either reads from it or is busy replacing it.
+        if self._reader_task is not None and not self._reader_task.done():
             return self._ws
 
+        self._ws = await self._connect()
+        self._reader_task = asyncio.create_task(self._read_frames())
+
+        return self._ws
+
+    async def _connect(self):
         self.log.info("Connecting to websocket...")
         ssl_context = ssl.create_default_context(cafile=certifi.where())
         extra_headers = None
@@ -547,21 +874,66 @@ class TradeRepublicApi:
         }
         connect_id = 31
 
-        self._ws = await websockets.connect(
-            "wss://api.traderepublic.com", ssl=ssl_context, additional_headers=extra_headers
+        connect = self._ws_connect or websockets.connect
+        ws = await connect(
+            self._ws_url, ssl=ssl_context if self._ws_url.startswith("wss:") else None, additional_headers=extra_headers
         )
-        await self._ws.send(f"connect {connect_id} {json.dumps(connection_message)}")
-        response = await self._ws.recv()
+        if self._session_recorder is not None:
+            ws = self._session_recorder.wrap(ws)
+        await ws.send(f"connect {connect_id} {json.dumps(connection_message)}")
+        response = await ws.recv()
 
         if not response == "connected":
             raise ValueError(f"Connection Error: {response}")
 
         self.log.info("Connected.")
+        self.metrics.connects += 1
 
-        return self._ws
+        return ws
+
+    async def _reconnect(self, error):
+        """Replace a dropped connection and subscribe again to everything that is still subscribed.
+
+        Gives up after `_reconnect_attempts` attempts with exponential backoff and raises `error`, the reason the
+        connection dropped, to everyone waiting for a frame.
+        """
+        delay = self._reconnect_backoff
+        for attempt in range(1, self._reconnect_attempts + 1):
+            self.log.warning(
+                f"Websocket connection lost ({error}), reconnecting in {delay:.1f}s "
+                f"(attempt {attempt}/{self._reconnect_attempts})..."
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self._reconnect_backoff_max)
+            try:
+                ws = await self._connect()
+            except (OSError, ValueError, websockets.WebSocketException) as e:
+                self.log.warning(f"Reconnecting failed: {e!r}")
+                continue
+
+            self.metrics.reconnects += 1
+            await self._resubscribe(ws)
+            self.log.info(f"Reconnected, resubscribed to {len(self.subscriptions)} subscriptions.")
+            return
+
+        raise error
+
+    async def _resubscribe(self, ws):
+        """Make `ws` the connection and subscribe on it to everything that is still subscribed."""
+        self._ws = ws
+        # The server starts every subscription of the new connection with a full frame. Until then there is no
+        # base a delta could safely be applied to, the last payload of the old connection may be outdated.
+        self._previous_responses.clear()
+        for subscription_id, payload in list(self.subscriptions.items()):
+            await ws.send(f"sub {subscription_id} {json.dumps(payload)}")
 
     async def close(self):
         """Close the websocket connection gracefully."""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader_task
+            self._reader_task = None
         if self._ws is not None:
             self.log.info("Closing websocket connection...")
             await self._ws.close()
@@ -574,92 +946,257 @@ class TradeRepublicApi:
             return str(subscription_id)
 
     async def subscribe(self, payload):
+        return await self._subscribe(payload)
+
+    async def _subscribe(self, payload, queue=None):
+        if queue is None:
+            queue = _receive_into.get()
         subscription_id = await self._next_subscription_id()
         ws = await self._get_ws()
+
+        key = None if payload.get("type") in ACTION_TYPES else json.dumps(payload, sort_keys=True)
+        shared_id = self._shared.get(key) if key is not None else None
+        if shared_id is not None:
+            self.log.debug(f"Subscribing: {subscription_id} shares subscription {shared_id} for {key}")
+            self._routes[subscription_id] = shared_id
+            self._listeners[shared_id][subscription_id] = queue
+            self.metrics[payload.get("type", "")].shared += 1
+            # The server only sends deltas from here on, start the new listener off with the current state.
+            previous = self._previous_responses.get(shared_id)
+            if previous is not None:
+                (queue or self._recv_queue).put_nowait(
+                    (subscription_id, payload, jsonio.loads(previous) if previous else {})
+                )
+            return subscription_id
+
         self.log.debug(f"Subscribing: 'sub {subscription_id} {json.dumps(payload)}'")
         self.subscriptions[subscription_id] = payload
-        await ws.send(f"sub {subscription_id} {json.dumps(payload)}")
+        # Register the listener before sending, the reader may see the answer before `send` returns.
+        self._listeners[subscription_id] = {subscription_id: queue}
+        self._routes[subscription_id] = subscription_id
+        if key is not None:
+            self._shared[key] = subscription_id
+        self.metrics[payload.get("type", "")].subscriptions += 1
+        self._subscribed_at[subscription_id] = time.monotonic()
+        try:
+            await ws.send(f"sub {subscription_id} {json.dumps(payload)}")
+        except websockets.ConnectionClosed:
+            # Already in `subscriptions`, so the reader sends it again once it has reconnected.
+            self.log.debug(f"Connection lost while subscribing {subscription_id}, deferring until reconnected.")
         return subscription_id
 
     async def unsubscribe(self, subscription_id):
         ws = await self._get_ws()
 
-        self.log.debug(f"Unsubscribing: {subscription_id}")
-        await ws.send(f"unsub {subscription_id}")
+        shared_id = self._routes.pop(subscription_id, None)
+        if shared_id is None:
+            # Already completed or failed, the server has forgotten it as well.
+            return
+        listeners = self._listeners[shared_id]
+        del listeners[subscription_id]
+        if listeners:
+            self.log.debug(f"Unsubscribing: {subscription_id}, {len(listeners)} listeners left on {shared_id}")
+            return
 
-        self.subscriptions.pop(subscription_id, None)
-        self._previous_responses.pop(subscription_id, None)
+        self.log.debug(f"Unsubscribing: {shared_id}")
+        self._forget(shared_id)
+        try:
+            await ws.send(f"unsub {shared_id}")
+        except websockets.ConnectionClosed:
+            # Subscriptions do not outlive their connection, and this one is no longer resubscribed on reconnect.
+            pass
+
+    def _forget(self, shared_id):
+        """Drop a server-side subscription and all of its listeners, return the listeners."""
+        payload = self.subscriptions.pop(shared_id, None)
+        self._previous_responses.pop(shared_id, None)
+        self._subscribed_at.pop(shared_id, None)
+        listeners = self._listeners.pop(shared_id, {})
+        for subscription_id in listeners:
+            self._routes.pop(subscription_id, None)
+        if payload is not None:
+            self._shared.pop(json.dumps(payload, sort_keys=True), None)
+        return listeners
+
+    @contextlib.asynccontextmanager
+    async def stream(self, payload):
+        """Subscribe to `payload` and receive its frames through a queue of its own.
+
+        Unlike `recv()`, which hands out the frames of every subscription in arrival order, the returned
+        `Subscription` only yields frames of this one, so independent coroutines can each consume their own
+        subscriptions on the shared websocket::
+
+            async with tr.stream({"type": "ticker", "id": "DE0007164600.LSX"}) as ticker:
+                async for response in ticker:
+                    ...
+
+        The subscription is cancelled when the block is left.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        subscription_id = await self._subscribe(payload, queue)
+        try:
+            yield Subscription(subscription_id, payload, queue)
+        finally:
+            if subscription_id in self._routes:
+                await self.unsubscribe(subscription_id)
 
     async def recv(self):
-        ws = await self._get_ws()
-        while True:
-            response = await ws.recv()
+        """Return the next frame of any subscription not opened through `stream()`."""
+        self._bind_to_running_loop()
+        # Hand out what the reader already queued, including the error that ended the last connection, before
+        # `_get_ws` gets a chance to replace that connection.
+        if self._recv_queue.empty():
+            await self._get_ws()
+        item = await self._recv_queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    async def _read_frames(self):
+        """Read frames off the websocket and route each one to the queue of its subscription.
+
+        A dropped connection is replaced by `_reconnect`, transparently to the consumers of the queues.
+        """
+        try:
+            while True:
+                try:
+                    response = await self._ws.recv()
+                except websockets.ConnectionClosed as e:
+                    await self._reconnect(e)
+                    continue
+                await self._dispatch(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Nobody awaits this task. Hand the error to everyone waiting for a frame instead.
+            if not isinstance(e, websockets.ConnectionClosed):
+                self.log.error("Websocket reader failed.", exc_info=True)
+            self._reader_task = None
+            self._recv_queue.put_nowait(e)
+            for listeners in self._listeners.values():
+                for queue in listeners.values():
+                    if queue is not None:
+                        queue.put_nowait(e)
+
+    async def _dispatch(self, response):
+        # Runs for every frame. Building a log record, let alone a repr of the frame, only to have every handler
+        # drop it is a noticeable part of the cost of a long sync.
+        log_frames = debug_enabled(self.log)
+        if log_frames:
             self.log.debug(f"Received message: {response!r}")
 
-            subscription_id = response[: response.find(" ")]
-            code = response[response.find(" ") + 1 : response.find(" ") + 2]
-            payload_str = response[response.find(" ") + 2 :].lstrip()
+        subscription_id, code, payload_str = parse_frame(response)
 
-            if subscription_id not in self.subscriptions:
-                if code != "C":
+        if subscription_id not in self.subscriptions:
+            # The server completes a subscription with a C frame after it was unsubscribed, which is expected.
+            if code != "C":
+                self.metrics.dropped_frames += 1
+                if log_frames:
                     self.log.debug(f"No active subscription for id {subscription_id}, dropping message")
-                continue
-            subscription = self.subscriptions[subscription_id]
-
-            if code == "A":
-                self._previous_responses[subscription_id] = payload_str
-                payload = json.loads(payload_str) if payload_str else {}
-                return subscription_id, subscription, payload
-
-            elif code == "D":
-                response = self._calculate_delta(subscription_id, payload_str)
-                self.log.debug(f"Payload is {response}")
-
-                self._previous_responses[subscription_id] = response
-                return subscription_id, subscription, json.loads(response)
-
-            if code == "C":
-                self.subscriptions.pop(subscription_id, None)
-                self._previous_responses.pop(subscription_id, None)
-                continue
-
-            elif code == "E":
-                self.log.error(f"Received error message: {response!r}")
+            return
+        subscription = self.subscriptions[subscription_id]
+
+        kind = subscription.get("type", "")
+        # Frames arrive decoded, the size on the wire is that of their UTF-8 encoding.
+        self.metrics.frame(kind, code, len(response.encode()))
+        subscribed_at = self._subscribed_at.pop(subscription_id, None)
+        if subscribed_at is not None:
+            self.metrics[kind].first_frame_latency.add(time.monotonic() - subscribed_at)
+
+        if code == "A" or code == "D":
+            if code == "D":
+                payload_str = self._calculate_delta(subscription_id, payload_str)
+                if log_frames:
+                    self.log.debug(f"Payload is {payload_str}")
+            self._previous_responses[subscription_id] = payload_str
+            for listener_id, queue in self._listeners[subscription_id].items():
+                # Parsed per listener, so that no listener sees another one's changes to the payload.
+                payload = jsonio.loads(payload_str) if payload_str else {}
+                (queue or self._recv_queue).put_nowait((listener_id, subscription, payload))
+
+        elif code == "C":
+            for queue in self._forget(subscription_id).values():
+                if queue is not None:
+                    queue.put_nowait(_COMPLETED)
+
+        elif code == "E":
+            if self._session_unverified and _is_auth_error(payload_str):
+                # The session resumed without a check is no longer valid. Revalidate it and connect again with the
+                # new cookies, the subscriptions carry on as if nothing happened.
+                await asyncio.to_thread(self._revalidate_session)
+                old_ws = self._ws
+                await self._resubscribe(await self._connect())
+                with contextlib.suppress(websockets.ConnectionClosed):
+                    await old_ws.close()
+                return
+            self.log.error(f"Received error message: {response!r}")
 
-                await self.unsubscribe(subscription_id)
+            listeners = self._forget(subscription_id)
+            with contextlib.suppress(websockets.ConnectionClosed):
+                await self._ws.send(f"unsub {subscription_id}")
 
-                payload = json.loads(payload_str) if payload_str else {}
-                raise TradeRepublicError(subscription_id, subscription, payload)
+            payload = jsonio.loads(payload_str) if payload_str else {}
+            for listener_id, queue in listeners.items():
+                (queue or self._recv_queue).put_nowait(TradeRepublicError(listener_id, subscription, payload))
 
     def _calculate_delta(self, subscription_id, delta_payload):
-        previous_response = self._previous_responses[subscription_id]
-        i, result = 0, []
-        for diff in delta_payload.split("\t"):
-            sign = diff[0]
-            if sign == "+":
-                result.append(urllib.parse.unquote_plus(diff).strip())
-            elif sign == "-" or sign == "=":
-                if sign == "=":
-                    result.append(previous_response[i : i + int(diff[1:])])
-                i += int(diff[1:])
-        return "".join(result)
-
-    async def _recv_subscription(self, subscription_id):
-        while True:
-            response_subscription_id, _, response = await self.recv()
-            if response_subscription_id == subscription_id:
-                return response
+        return apply_delta(self._previous_responses[subscription_id], delta_payload)
 
     async def _receive_one(self, fut, timeout):
-        subscription_id = await fut
+        # Have the subscription that `fut` makes deliver to a queue of its own rather than to `recv()`, so that
+        # concurrent calls cannot take each other's frames.
+        queue: asyncio.Queue = asyncio.Queue()
+        token = _receive_into.set(queue)
+        try:
+            subscription_id = await fut
+        finally:
+            _receive_into.reset(token)
 
         try:
-            return await asyncio.wait_for(self._recv_subscription(subscription_id), timeout)
+            return await asyncio.wait_for(Subscription(subscription_id, None, queue).get(), timeout)
         finally:
             await self.unsubscribe(subscription_id)
 
+    def _blocking_event_loop(self):
+        """The event loop the `blocking_*` calls run on, started on a daemon thread by the first of them.
+
+        It outlives the calls, and with it the websocket, so a script making many calls connects only once.
+        """
+        with self._blocking_lock:
+            if self._blocking_loop is None:
+                self._blocking_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._blocking_loop.run_forever, name="pytr-blocking", daemon=True).start()
+            return self._blocking_loop
+
     def run_blocking(self, fut, timeout=5.0):
-        return asyncio.run(self._receive_one(fut, timeout=timeout))
+        return asyncio.run_coroutine_threadsafe(
+            self._receive_one(fut, timeout=timeout), self._blocking_event_loop()
+        ).result()
+
+    def blocking_gather(self, futs, timeout=5.0, return_exceptions=False):
+        """Make all subscriptions in `futs` at once and return their first responses, in the same order::
+
+            tr.blocking_gather([tr.ticker(isin) for isin in isins])
+
+        With `return_exceptions`, a failed subscription returns its exception instead of raising it.
+        """
+
+        async def gather():
+            return await asyncio.gather(
+                *(self._receive_one(fut, timeout=timeout) for fut in futs), return_exceptions=return_exceptions
+            )
+
+        return asyncio.run_coroutine_threadsafe(gather(), self._blocking_event_loop()).result()
+
+    def close_blocking(self):
+        """Close the connection of the `blocking_*` calls and stop their event loop."""
+        with self._blocking_lock:
+            loop, self._blocking_loop = self._blocking_loop, None
+        if loop is None:
+            return
+        if self._loop is loop:
+            asyncio.run_coroutine_threadsafe(self.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
 
     async def portfolio(self):
         return await self.subscribe({"type": "portfolio"})
@@ -999,20 +1536,10 @@ class TradeRepublicApi:
         return await self.subscribe({"type": "unsubscribeNews", "instrumentId": isin})
 
     def payout(self, amount):
-        return requests.request(
-            method="POST",
-            url=f"{self._host}/api/v1/payout",
-            data={"amount": amount},
-            headers=self._default_headers,
-        ).json()
+        return self._web_request("/api/v1/payout", {"amount": amount}, method="POST").json()
 
     def confirm_payout(self, process_id, code):
-        r = requests.request(
-            method="POST",
-            url=f"{self._host}/api/v1/payout/{process_id}/code",
-            data={"code": code},
-            headers=self._default_headers,
-        )
+        r = self._web_request(f"/api/v1/payout/{process_id}/code", {"code": code}, method="POST")
 
         if r.status_code != 200:
             raise ValueError(f"Payout failed with response {r.text!r}")
@@ -1026,20 +1553,28 @@ class TradeRepublicApi:
         return data
 
     def order_cost(self, isin, exchange, order_mode, order_type, size, sell_fractions):
-        return requests.request(
-            method="GET",
-            url=f"{self._host}/api/v1/user/costtransparency?instrumentId={isin}&exchangeId={exchange}&mode={order_mode}&type={order_type}&size={size}&sellFractions={sell_fractions}",
-            data=None,
-            headers=self._default_headers,
+        return self._web_request(
+            self._order_cost_path(isin, exchange, order_mode, order_type, size, sell_fractions)
         ).text
 
+    async def order_cost_async(self, isin, exchange, order_mode, order_type, size, sell_fractions):
+        r = await self._web_request_async(
+            self._order_cost_path(isin, exchange, order_mode, order_type, size, sell_fractions)
+        )
+        return r.text
+
+    def _order_cost_path(self, isin, exchange, order_mode, order_type, size, sell_fractions):
+        return f"/api/v1/user/costtransparency?instrumentId={isin}&exchangeId={exchange}&mode={order_mode}&type={order_type}&size={size}&sellFractions={sell_fractions}"
+
     def savings_plan_cost(self, isin, amount, interval):
-        return requests.request(
-            method="GET",
-            url=f"{self._host}/api/v1/user/savingsplancosttransparency?instrumentId={isin}&amount={amount}&interval={interval}",
-            data=None,
-            headers=self._default_headers,
-        ).text
+        return self._web_request(self._savings_plan_cost_path(isin, amount, interval)).text
+
+    async def savings_plan_cost_async(self, isin, amount, interval):
+        r = await self._web_request_async(self._savings_plan_cost_path(isin, amount, interval))
+        return r.text
+
+    def _savings_plan_cost_path(self, isin, amount, interval):
+        return f"/api/v1/user/savingsplancosttransparency?instrumentId={isin}&amount={amount}&interval={interval}"
 
     def __getattr__(self, name):
         if name[:9] == "blocking_":
@@ -1051,6 +1586,108 @@ class TradeRepublicApi:
         return object.__getattribute__(self, name)
 
 
+# Put on a stream's queue when the server completes its subscription.
+_COMPLETED = object()
+
+# errorCodes of `E` frames that mean the session cookies were not accepted.
+AUTH_ERROR_CODES = {"AUTHENTICATION_ERROR", "UNAUTHORIZED"}
+
+
+def _is_auth_error(payload_str):
+    try:
+        errors = jsonio.loads(payload_str).get("errors") or []
+    except (ValueError, AttributeError):
+        return False
+    return any(isinstance(error, dict) and error.get("errorCode") in AUTH_ERROR_CODES for error in errors)
+
+
+def _can_prompt():
+    """Whether the user can be asked for input here: on the main thread and outside of an event loop."""
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return True
+    return False
+
+
+def _unexpired_waf_tokens(tokens):
+    now = time.time()
+    return {key: entry for key, entry in tokens.items() if entry.get("expires", 0) > now}
+
+
+# Serializes the updates of the files in BASE_DIR that all instances share, see `_update_state_file`.
+_state_files_lock = threading.Lock()
+
+
+def _update_state_file(path, update):
+    """
+    Call `update` with the dict in the JSON file at `path`, an empty one if there is none, and write the dict back.
+
+    Several instances may update a file at the same time, e.g. the refresh timers of `dl_docs --accounts`: the
+    update is made under a lock, so that none loses another's entry, and the file is replaced by a complete new
+    one, so that nothing ever reads a half-written file. It is only readable by the user.
+    """
+    with _state_files_lock:
+        try:
+            data = jsonio.read_file(path)
+        except (OSError, ValueError):
+            data = {}
+        update(data)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # mkstemp creates the file readable by the user only
+        fd, temporary = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(jsonio.dumps(data, indent=True))
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+# The queue for the subscriptions made by the current task, instead of the one `recv()` drains. See `_receive_one`.
+_receive_into: contextvars.ContextVar[asyncio.Queue | None] = contextvars.ContextVar("_receive_into", default=None)
+
+
+class Subscription:
+    """The frames of one subscription opened with `TradeRepublicApi.stream()`.
+
+    `get()` returns the next payload. Iterating with `async for` does the same until the server completes the
+    subscription. Error frames are raised as `TradeRepublicError`.
+    """
+
+    def __init__(self, subscription_id, payload, queue):
+        self.id = subscription_id
+        self.payload = payload
+        self._queue = queue
+
+    async def get(self):
+        item = await self._queue.get()
+        if item is _COMPLETED:
+            raise EOFError(f"Subscription {self.id} was completed by the server.")
+        if isinstance(item, BaseException):
+            raise item
+        return item[2]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.get()
+        except EOFError:
+            raise StopAsyncIteration from None
+
+
+class SessionExpiredError(Exception):
+    """
+    The web session was rejected and could not be refreshed, and no new login could be asked for where that was
+    noticed. The saved cookies are forgotten, so that the next run logs in afresh.
+    """
+
+
 class TradeRepublicError(ValueError):
     def __init__(self, subscription_id, subscription, error_message):
         self.subscription_id = subscription_id
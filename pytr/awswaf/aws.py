@@ -105,6 +105,7 @@ class AwsWaf:
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
             " (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
         ),
+        stop=None,
     ):
         self.session: requests.Session = requests.Session(impersonate="chrome")
         self.session.headers.update(
@@ -125,6 +126,8 @@ class AwsWaf:
         self.user_agent = user_agent
         self.domain = domain
         self.endpoint = endpoint
+        # A threading.Event that makes the proof-of-work search give up early.
+        self.stop = stop
 
         # Parse constants from challenge.js
         self._js_config = parse_challenge_js(challenge_js_text)
@@ -146,7 +149,13 @@ class AwsWaf:
 
         checksum, fp = get_fp(self.user_agent)
         bandwidth_sizes = self._js_config.get("bandwidth_sizes", {})
-        solution = solver(inputs["challenge"]["input"], checksum, inputs["difficulty"], bandwidth_sizes=bandwidth_sizes)
+        solution = solver(
+            inputs["challenge"]["input"],
+            checksum,
+            inputs["difficulty"],
+            bandwidth_sizes=bandwidth_sizes,
+            stop=self.stop,
+        )
         if solution is None:
             # The proof-of-work solvers give up instead of spinning forever on a
             # difficulty the server picked (see verify.py). Stop here rather than
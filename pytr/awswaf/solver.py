@@ -0,0 +1,148 @@
+"""
+Nonce search for the proof-of-work challenges in `verify.py`, spread over several processes.
+
+Each worker searches its own share of the nonce space: worker `i` of `n` tries `i`, `i + n`, `i + 2n`, ... The first
+worker to find a nonce sets a shared event, on which the others stop at their next check. A nonce is only valid for
+the challenge, not necessarily the smallest one, so the first hit wins.
+
+Starting processes costs more than the few thousand hashes that easy challenges take, so those are solved in this
+process; see `_INLINE_WORK`.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Optional
+
+# How often the workers look at the clock and the stop event, in nonces. Checking either costs more than a sha256.
+_SHA256_CHECK_INTERVAL = 4096
+_SCRYPT_CHECK_INTERVAL = 16
+
+# Challenges that take fewer nonces than this on average, 2**difficulty, are not worth starting processes for.
+_INLINE_WORK = {"sha256": 2**17, "scrypt": 2**7}
+
+# How often `solve` looks at its `stop` event while the workers search.
+_STOP_POLL_SECONDS = 0.1
+
+# Set by `_init_worker` in every worker process.
+_found = None
+
+
+def _check(digest: bytes, difficulty: int) -> bool:
+    full, rem = divmod(difficulty, 8)
+    if digest[:full] != b"\x00" * full:
+        return False
+    if rem and (digest[full] >> (8 - rem)):
+        return False
+    return True
+
+
+def search(
+    kind: str,
+    prefix: str,
+    salt: str,
+    difficulty: int,
+    scrypt_params: dict,
+    start: int,
+    step: int,
+    seconds: float,
+    stop=None,
+) -> Optional[str]:
+    """
+    Try the nonces `start`, `start + step`, ... for `seconds`. Return the first that solves the challenge, None if
+    there is none in time or `stop` (an event) is set.
+    """
+    deadline = time.monotonic() + seconds
+    nonce = start
+    if kind == "sha256":
+        # The prefix is the same for every nonce: hash it once and continue from a copy of that state.
+        hashed_prefix = hashlib.sha256(prefix.encode())
+        while True:
+            for nonce in range(nonce, nonce + step * _SHA256_CHECK_INTERVAL, step):
+                h = hashed_prefix.copy()
+                h.update(str(nonce).encode())
+                if _check(h.digest(), difficulty):
+                    return str(nonce)
+            nonce += step
+            if time.monotonic() > deadline or (stop is not None and stop.is_set()):
+                return None
+    # scrypt has no incremental interface, every nonce hashes the whole password.
+    salt_bytes = salt.encode()
+    while True:
+        for nonce in range(nonce, nonce + step * _SCRYPT_CHECK_INTERVAL, step):
+            digest = hashlib.scrypt(password=f"{prefix}{nonce}".encode(), salt=salt_bytes, **scrypt_params)
+            if _check(digest, difficulty):
+                return str(nonce)
+        nonce += step
+        if time.monotonic() > deadline or (stop is not None and stop.is_set()):
+            return None
+
+
+def _init_worker(found) -> None:
+    global _found
+    _found = found
+
+
+def _search_in_worker(
+    kind: str,
+    prefix: str,
+    salt: str,
+    difficulty: int,
+    scrypt_params: dict,
+    start: int,
+    step: int,
+    seconds: float,
+) -> Optional[str]:
+    assert _found is not None, "_init_worker has not run"
+    nonce = search(kind, prefix, salt, difficulty, scrypt_params, start, step, seconds, stop=_found)
+    if nonce is not None:
+        _found.set()
+    return nonce
+
+
+def solve(
+    kind: str,
+    prefix: str,
+    salt: str,
+    difficulty: int,
+    seconds: float,
+    scrypt_params: Optional[dict] = None,
+    workers: Optional[int] = None,
+    stop=None,
+) -> Optional[str]:
+    """
+    A nonce for which the `kind` ("sha256" or "scrypt") hash of `prefix` and the nonce starts with `difficulty` zero
+    bits, None if none is found within `seconds` or `stop` (a `threading.Event`) is set first. `workers` defaults to
+    the number of CPUs.
+    """
+    scrypt_params = scrypt_params or {}
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or 2**difficulty <= _INLINE_WORK[kind]:
+        return search(kind, prefix, salt, difficulty, scrypt_params, 0, 1, seconds, stop)
+
+    deadline = time.monotonic() + seconds
+    # Spawned rather than forked workers: by the time of a login, the process may run threads of its own.
+    context = multiprocessing.get_context("spawn")
+    found = context.Event()
+    pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(found,))
+    try:
+        # The workers get the time left after the pool has started, so that they all give up by the deadline.
+        remaining = deadline - time.monotonic()
+        pending = {
+            pool.submit(_search_in_worker, kind, prefix, salt, difficulty, scrypt_params, i, workers, remaining)
+            for i in range(workers)
+        }
+        while pending:
+            done, pending = wait(pending, timeout=_STOP_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            if stop is not None and stop.is_set():
+                return None
+            for future in done:
+                nonce = future.result()
+                if nonce is not None:
+                    return nonce
+        return None
+    finally:
+        found.set()
+        pool.shutdown(wait=True, cancel_futures=True)
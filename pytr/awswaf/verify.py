@@ -27,17 +27,17 @@
 
 import binascii
 import hashlib
-import itertools
-import time
 from typing import Any, Callable, Optional
 
+from .solver import solve
+
 # Bounds for the two proof-of-work solvers below.
 #
 # Both used to loop over `itertools.count()` with no exit other than success,
 # while `difficulty` arrives from the WAF's own `/inputs` response — so the
 # server on the other end decided how long this process would spin. Two ways
 # that ends badly: a difficulty above 256 can never be satisfied at all
-# (`_check` compares a 32-byte digest against a longer all-zero prefix, which
+# (`solver._check` compares a 32-byte digest against a longer all-zero prefix, which
 # is false for every possible digest), and values below that are already
 # computationally out of reach while still looking like a legitimate
 # challenge. Either way a login someone is waiting on hangs forever.
@@ -45,35 +45,24 @@ from typing import Any, Callable, Optional
 # Giving up returns `None`, which `build_payload` turns into a clean error.
 # A WAF token that takes longer than the deadline is worthless anyway: the
 # caller is a synchronous login request.
+#
+# The search itself is in `solver.py`, which spreads it over all CPUs.
 _MAX_SOLVABLE_DIFFICULTY = 256
 _POW_DEADLINE_SECONDS = 30.0
-# The deadline is only consulted every N nonces — a `time.monotonic()` call per
-# sha256 would cost more than the hash it is guarding. scrypt is expensive
-# enough per iteration to check every time.
-_POW_TIME_CHECK_INTERVAL = 4096
-
-
-def _check(digest: bytes, difficulty: int) -> bool:
-    full, rem = divmod(difficulty, 8)
-    if digest[:full] != b"\x00" * full:
-        return False
-    if rem and (digest[full] >> (8 - rem)):
-        return False
-    return True
 
 
 def hash_pow(challenge: str, salt: str, difficulty: int, **kwargs) -> Optional[str]:
     if difficulty > _MAX_SOLVABLE_DIFFICULTY:
         return None
-    prefix = (challenge + salt).encode()
-    deadline = time.monotonic() + _POW_DEADLINE_SECONDS
-    for nonce in itertools.count():
-        digest = hashlib.sha256(prefix + str(nonce).encode()).digest()
-        if _check(digest, difficulty):
-            return str(nonce)
-        if nonce % _POW_TIME_CHECK_INTERVAL == 0 and time.monotonic() > deadline:
-            return None
-    return None
+    return solve(
+        "sha256",
+        challenge + salt,
+        salt,
+        difficulty,
+        _POW_DEADLINE_SECONDS,
+        workers=kwargs.get("workers"),
+        stop=kwargs.get("stop"),
+    )
 
 
 def scrypt_func(input_str: str, salt: str, n: int = 128, r: int = 8, p: int = 1, dklen: int = 16) -> str:
@@ -93,22 +82,16 @@ def compute_scrypt_nonce(
 ) -> Optional[str]:
     if difficulty > _MAX_SOLVABLE_DIFFICULTY:
         return None
-    prefix = challenge + salt
-    deadline = time.monotonic() + _POW_DEADLINE_SECONDS
-    for nonce in itertools.count():
-        digest = hashlib.scrypt(
-            password=f"{prefix}{nonce}".encode(),
-            salt=salt.encode(),
-            n=n,
-            r=r,
-            p=p,
-            dklen=dklen,
-        )
-        if _check(digest, difficulty):
-            return str(nonce)
-        if time.monotonic() > deadline:
-            return None
-    return None
+    return solve(
+        "scrypt",
+        challenge + salt,
+        salt,
+        difficulty,
+        _POW_DEADLINE_SECONDS,
+        scrypt_params={"n": n, "r": r, "p": p, "dklen": dklen},
+        workers=kwargs.get("workers"),
+        stop=kwargs.get("stop"),
+    )
 
 
 _DEFAULT_BANDWIDTH_SIZES = {1: 0x400, 2: 0xA * 0x400, 3: 0x64 * 0x400, 4: 0x100000, 5: 0xA * 0x100000}
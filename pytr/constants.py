@@ -0,0 +1,45 @@
+"""
+Values that the command line parser needs, kept apart from the modules that use them so that building the parser
+does not import those modules and their dependencies.
+"""
+
+SUPPORTED_LANGUAGES = {
+    "cs",
+    "da",
+    "de",
+    "en",
+    "es",
+    "fr",
+    "it",
+    "nl",
+    "pl",
+    "pt",
+    "ru",
+    "zh",
+}
+
+PORTFOLIO_COLUMNS = [
+    "Name",
+    "ISIN",
+    "quantity",
+    "price",
+    "avgCost",
+    "netValue",
+]
+
+RATE_COLUMNS = [
+    "Name",
+    "ISIN",
+    "price",
+    "ask",
+]
+
+MIN_INFLIGHT_DETAILS = 10
+MAX_INFLIGHT_DETAILS = 1000
+
+# With an incremental sync, the number of events from the event database a timeline is fetched into, to pick up
+# changes to the most recent known events, before the sync stops paging.
+INCREMENTAL_SAFETY_MARGIN = 20
+
+# Shells that `pytr completion` can print a script for, i.e. `shtab.SUPPORTED_SHELLS`.
+COMPLETION_SHELLS = ["bash", "zsh", "tcsh", "fish", "powershell"]
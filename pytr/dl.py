@@ -9,6 +9,8 @@ from pathvalidate import sanitize_filepath
 from requests import Response
 from requests_futures.sessions import FuturesSession  # type: ignore[import-untyped]
 
+from . import timestamps
+from .constants import INCREMENTAL_SAFETY_MARGIN, MAX_INFLIGHT_DETAILS, MIN_INFLIGHT_DETAILS
 from .event import Event
 from .timeline import Timeline
 from .transactions import TransactionExporter
@@ -184,6 +186,13 @@ class DL:
         flat=False,
         load_event_database=None,
         dry_run=False,
+        compact_event_database=False,
+        min_inflight_details=MIN_INFLIGHT_DETAILS,
+        max_inflight_details=MAX_INFLIGHT_DETAILS,
+        incremental=False,
+        incremental_margin=INCREMENTAL_SAFETY_MARGIN,
+        reuse_details=False,
+        event_database=None,
     ):
         """
         tr: api object
@@ -214,6 +223,13 @@ class DL:
             dump_raw_data,
             self.dl_callback,
             load_event_database=load_event_database,
+            compact_event_database=compact_event_database,
+            min_inflight_details=min_inflight_details,
+            max_inflight_details=max_inflight_details,
+            incremental=incremental,
+            incremental_margin=incremental_margin,
+            reuse_details=reuse_details,
+            event_database=event_database,
         )
 
         self.session = (
@@ -236,7 +252,12 @@ class DL:
 
     def do_dl(self):
         asyncio.run(self.tl.tl_loop())
+        self.export_and_download()
 
+    def export_and_download(self):
+        """
+        Write the exports of the events received by `tl_loop` and wait for their documents to download.
+        """
         if self.dump_raw_data:
             with open(self.output_path / "events_with_documents.json", "w", encoding="utf-8") as f:
                 json.dump(self.events_with_docs, f, ensure_ascii=False, indent=2)
@@ -252,7 +273,7 @@ class DL:
                     decimal_localization=self.decimal_localization,
                 ).export(
                     f,
-                    [Event.from_dict(ev) for ev in self.tl.events],
+                    (Event.from_dict(ev) for ev in self.tl.events),
                     sort=self.sort_export,
                     format=self.format_export,
                 )
@@ -263,7 +284,7 @@ class DL:
         if hasattr(self, "tl") and not self.tl.fetch_from_tr:
             self.events_processed += 1
             if self.events_processed % 1000 == 0:
-                self.log.info(f"Processing events: {self.events_processed}/{self.tl.all_detail}")
+                self.log.info(f"Processing events: {self.events_processed}...")
         has_docs = False
         for section in event["details"]["sections"]:
             if section["type"] != "documents":
@@ -327,13 +348,10 @@ class DL:
                     # )
                     continue
                 has_docs = True
-                timestamp_str = event["timestamp"]
-                if timestamp_str[-3] != ":":
-                    timestamp_str = timestamp_str[:-2] + ":" + timestamp_str[-2:]
                 try:
-                    docdate = datetime.fromisoformat(timestamp_str)
+                    docdate = timestamps.parse(event["timestamp"])
                 except ValueError:
-                    self.log.warning(f"no timestamp parseable from {timestamp_str}")
+                    self.log.warning(f"no timestamp parseable from {event['timestamp']}")
                     docdate = datetime.now()
 
                 t = doc["title"].rsplit(" ")
@@ -8,6 +8,7 @@ from typing import Any, Dict, Optional
 
 from babel.numbers import NumberFormatError, parse_decimal
 
+from . import timestamps
 from .utils import get_logger
 
 
@@ -348,9 +349,7 @@ class Event:
             Event: Event object
         """
         event_type: Optional[EventType] = None
-        ts = event_dict["timestamp"]
-        ts = ts[:-2] + ":" + ts[-2:]
-        date: datetime = datetime.fromisoformat(ts)
+        date: datetime = timestamps.parse(event_dict["timestamp"])
         title: str = event_dict["title"]
         isin: Optional[str] = cls._parse_isin(event_dict)
         isin2: Optional[str] = None
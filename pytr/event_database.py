@@ -0,0 +1,336 @@
+"""
+The event database: the timeline events pytr has received, with their details, kept from one run to the next.
+
+By default it is the JSON file all_events.json in the output directory, which every run reads and rewrites as a
+whole. `--event-database sqlite:PATH` keeps it in an SQLite database instead, with a row per event: a run only
+writes the events that are new or changed and deletes the ones that are gone, and ranges of events are read with
+an index. `--event-database ndjson:PATH` keeps it in a log of JSON lines to which a run only appends the events
+that are new or changed. All of them hold the events exactly as the timeline sent them.
+
+A sync reads the whole database with `read()` to merge into it. Replaying one, which only needs the events of a
+time range, uses `stream()` instead: it returns the events in time order one after the other, skipping the ones
+outside the range as it goes, so that they are never all held in memory.
+
+`compact()` rewrites a database without the space superseded events take up, see `pytr compact_db`.
+"""
+
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+from . import jsonio, timestamps
+from .event import Event
+
+SQLITE_PREFIX = "sqlite:"
+NDJSON_PREFIX = "ndjson:"
+
+# The share of superseded records in an NDJSON log above which a write compacts it.
+NDJSON_MAX_WASTE = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    epoch REAL NOT NULL,
+    event_type TEXT,
+    title TEXT,
+    subtitle TEXT,
+    isin TEXT,
+    event BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_epoch ON events (epoch);
+CREATE INDEX IF NOT EXISTS events_event_type ON events (event_type);
+CREATE INDEX IF NOT EXISTS events_title ON events (title, subtitle);
+CREATE INDEX IF NOT EXISTS events_isin ON events (isin);
+"""
+
+
+def open_event_database(location, compact=False):
+    """
+    The event database at `location`: the path of a JSON file, or "sqlite:" or "ndjson:" followed by the path of
+    an SQLite database or an NDJSON log. `compact` writes the JSON file without indentation.
+    """
+    location = str(location)
+    if location.startswith(SQLITE_PREFIX):
+        return SqliteEventDatabase(Path(location[len(SQLITE_PREFIX) :]))
+    if location.startswith(NDJSON_PREFIX):
+        return NdjsonEventDatabase(Path(location[len(NDJSON_PREFIX) :]))
+    return JsonEventDatabase(Path(location), compact)
+
+
+def _digest(event):
+    """What `write` compares to tell whether an event changed since it was read: a hash of its JSON."""
+    return hashlib.blake2b(jsonio.dumps(event).encode(), digest_size=16).digest()
+
+
+def _in_range(event, not_before, not_after):
+    return not_before <= timestamps.event_epoch(event) <= not_after
+
+
+class JsonEventDatabase:
+    def __init__(self, path, compact=False):
+        self.path = path
+        self.indent = not compact
+
+    def __str__(self):
+        return str(self.path)
+
+    def exists(self):
+        return self.path.exists()
+
+    def read(self):
+        """All events. Raises ValueError if the file is no event database."""
+        return jsonio.read_file(self.path)
+
+    def stream(self, not_before=float(0), not_after=float("inf")):
+        """
+        The events between `not_before` and `not_after` (seconds since the epoch, see `timestamps.epoch`), in time
+        order and parsed one at a time. Raises ValueError while iterating if the file is no event database.
+
+        The file is read twice: first to check that the events are in time order, as pytr writes them, then for the
+        events. Only the events in the range of a file that is not in order are held in memory, to sort them.
+        """
+        in_order = True
+        last = float("-inf")
+        for event in jsonio.iter_array(self.path):
+            epoch = timestamps.event_epoch(event)
+            if not_before <= epoch <= not_after:
+                if epoch < last:
+                    in_order = False
+                    break
+                last = epoch
+        events = (event for event in jsonio.iter_array(self.path) if _in_range(event, not_before, not_after))
+        if in_order:
+            yield from events
+        else:
+            yield from sorted(events, key=timestamps.event_epoch)
+
+    def write(self, events):
+        """Replace the events in the database with `events`."""
+        jsonio.write_file(self.path, events, compact=not self.indent)
+
+    def compact(self):
+        """Rewrite the file sorted by time and without indentation."""
+        events = jsonio.read_file(self.path)
+        events.sort(key=timestamps.event_epoch)
+        jsonio.write_file(self.path, events, compact=True)
+
+
+class SqliteEventDatabase:
+    """
+    `write` only writes the events that differ from the ones the last `read` of the whole database returned, and
+    deletes the ones of those that are missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Event id -> `_digest` of the event, as returned by the last read of the whole database or written since.
+        self._read_events = {}
+
+    def __str__(self):
+        return f"{SQLITE_PREFIX}{self.path}"
+
+    def exists(self):
+        return self.path.exists()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def read(self):
+        """All events, in time order. Raises ValueError if the file is no event database."""
+        events = list(self.stream())
+        self._read_events = {event["id"]: _digest(event) for event in events}
+        return events
+
+    def stream(self, not_before=float(0), not_after=float("inf")):
+        """
+        The events between `not_before` and `not_after` (seconds since the epoch, see `timestamps.epoch`), in time
+        order and parsed one at a time. Raises ValueError while iterating if the file is no event database.
+        """
+        try:
+            with closing(self._connect()) as connection:
+                rows = connection.execute(
+                    "SELECT event FROM events WHERE epoch >= ? AND epoch <= ? ORDER BY epoch, id",
+                    (not_before, not_after),
+                )
+                for (event,) in rows:
+                    yield jsonio.loads(event)
+        except sqlite3.DatabaseError as e:
+            raise ValueError(f"Invalid event database {self}: {e}") from e
+
+    def write(self, events):
+        """Replace the events in the database with `events`."""
+        digests = {}
+        changed = []
+        for event in events:
+            digest = digests[event["id"]] = _digest(event)
+            if self._read_events.get(event["id"]) != digest:
+                changed.append(
+                    (
+                        event["id"],
+                        event["timestamp"],
+                        timestamps.event_epoch(event),
+                        event.get("eventType"),
+                        event.get("title"),
+                        event.get("subtitle"),
+                        Event._parse_isin(event),
+                        jsonio.dumps(event).encode(),
+                    )
+                )
+        removed = [(event_id,) for event_id in self._read_events if event_id not in digests]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", changed)
+            connection.executemany("DELETE FROM events WHERE id = ?", removed)
+        self._read_events = digests
+
+    def compact(self):
+        """Give the space of deleted and replaced rows back."""
+        with closing(self._connect()) as connection:
+            connection.execute("VACUUM")
+
+
+class NdjsonEventDatabase:
+    """
+    A log with a JSON record per line: `{"seq": n, "id": id, "event": event}` for an event that is new or changed
+    and `{"seq": n, "id": id, "deleted": true}` for one that is gone, `seq` increasing with every record. The last
+    record of an id is the one that counts.
+
+    Like `SqliteEventDatabase`, `write` only appends records for the events that differ from the ones the last
+    `read` of the whole database returned. A crash while appending can only cut off the last line, which is ignored
+    and overwritten by the next write. Once more than `NDJSON_MAX_WASTE` of the records are superseded, `write`
+    compacts the log.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Event id -> `_digest` of the event, as returned by the last read of the whole database or written since.
+        self._read_events = {}
+        self._next_sequence = 0
+        self._record_count = 0
+        # The size of the log up to its last complete record, None before it has been read.
+        self._size = None
+
+    def __str__(self):
+        return f"{NDJSON_PREFIX}{self.path}"
+
+    def exists(self):
+        return self.path.exists()
+
+    def _records(self):
+        """
+        The offset, sequence number, id and record of every complete record in the log, parsed one at a time. Once
+        all are returned, the size and record count of the log are known for `write`.
+        """
+        count = 0
+        size = 0
+        next_sequence = 0
+        with self.path.open("rb") as f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith(b"\n"):
+                    # cut off while appending, even if only its newline is missing
+                    break
+                try:
+                    record = jsonio.loads(line)
+                    sequence, event_id = record["seq"], record["id"]
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"Invalid record in line {number} of {self}: {e}") from e
+                count += 1
+                offset = size
+                size += len(line)
+                next_sequence = max(next_sequence, sequence + 1)
+                yield offset, sequence, event_id, record
+        self._record_count = count
+        self._size = size
+        self._next_sequence = next_sequence
+
+    def _read_log(self):
+        """Event id -> (sequence number, event or None if deleted) of the last record of every id in the log."""
+        latest = {}
+        for _, sequence, event_id, record in self._records():
+            known = latest.get(event_id)
+            if known is None or sequence > known[0]:
+                latest[event_id] = (sequence, record.get("event"))
+        return latest
+
+    def read(self):
+        """All events. Raises ValueError if the file is no event log."""
+        events = [event for _, event in self._read_log().values() if event is not None]
+        self._read_events = {event["id"]: _digest(event) for event in events}
+        return events
+
+    def stream(self, not_before=float(0), not_after=float("inf")):
+        """
+        The events between `not_before` and `not_after` (seconds since the epoch, see `timestamps.epoch`), in time
+        order and parsed one at a time. Raises ValueError while iterating if the file is no event log.
+
+        The log is read twice: first for the offset and time of the last record of every id, then those records are
+        read again in time order, so that only offsets and times are held in memory besides the events returned.
+        """
+        # Event id -> (sequence number, time, offset) of its last record, offset None unless it is one to return.
+        latest = {}
+        for offset, sequence, event_id, record in self._records():
+            if sequence > latest.get(event_id, (-1,))[0]:
+                event = record.get("event")
+                if event is not None and _in_range(event, not_before, not_after):
+                    latest[event_id] = (sequence, timestamps.event_epoch(event), offset)
+                else:
+                    latest[event_id] = (sequence, None, None)
+        wanted = sorted((epoch, offset) for _, epoch, offset in latest.values() if offset is not None)
+        with self.path.open("rb") as f:
+            for _, offset in wanted:
+                f.seek(offset)
+                yield jsonio.loads(f.readline())["event"]
+
+    def _record(self, event_id, event):
+        record = {"seq": self._next_sequence, "id": event_id}
+        if event is None:
+            record["deleted"] = True
+        else:
+            record["event"] = event
+        self._next_sequence += 1
+        return (jsonio.dumps(record) + "\n").encode()
+
+    def write(self, events):
+        """Replace the events in the database with `events`."""
+        if self._size is None and self.exists():
+            self.read()
+        digests = {}
+        lines = []
+        for event in events:
+            digest = digests[event["id"]] = _digest(event)
+            if self._read_events.get(event["id"]) != digest:
+                lines.append(self._record(event["id"], event))
+        lines.extend(self._record(event_id, None) for event_id in self._read_events if event_id not in digests)
+        with self.path.open("r+b" if self._size is not None else "wb") as f:
+            # drop a line cut off by a crash
+            f.seek(self._size or 0)
+            f.truncate()
+            f.write(b"".join(lines))
+            self._size = f.tell()
+        self._record_count += len(lines)
+        self._read_events = digests
+        if self._record_count - len(events) > NDJSON_MAX_WASTE * self._record_count:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the log with only the last record of every event that is not deleted, sorted by time."""
+        latest = self._read_log()
+        live = sorted(
+            ((sequence, event) for sequence, event in latest.values() if event is not None),
+            key=lambda record: timestamps.event_epoch(record[1]),
+        )
+        compacted = self.path.with_name(self.path.name + ".compacting")
+        with compacted.open("wb") as f:
+            for sequence, event in live:
+                f.write((jsonio.dumps({"seq": sequence, "id": event["id"], "event": event}) + "\n").encode())
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        # replacing the log is atomic, a crash leaves either the old or the compacted one
+        os.replace(compacted, self.path)
+        self._record_count = len(live)
+        self._size = size
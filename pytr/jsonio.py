@@ -0,0 +1,144 @@
+"""
+JSON encoding and decoding for pytr, backed by the fastest library that is installed.
+
+Every websocket frame is parsed and every event database is read and written as JSON, which dominates the run time of
+large syncs. orjson and msgspec do this several times faster than the standard library, so they are used when
+available (`pip install pytr[fast]` installs orjson). Without them the standard library is used. The backends produce
+the same JSON apart from insignificant whitespace; non-ASCII characters are never escaped and values JSON cannot
+represent are written as `str(value)`.
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+BACKEND: str
+_loads: Callable[[Any], Any]
+_dumps: Callable[[Any, bool], bytes]
+
+
+def _stdlib_dumps(obj: Any, indent: bool) -> bytes:
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2, default=str).encode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+
+
+try:
+    import orjson
+
+    def _orjson_dumps(obj: Any, indent: bool) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(obj, default=str, option=option)
+        except TypeError:
+            # orjson is stricter than the standard library, e.g. about integers beyond 64 bit.
+            return _stdlib_dumps(obj, indent)
+
+    BACKEND = "orjson"
+    _loads = orjson.loads  # raises orjson.JSONDecodeError, a subclass of json.JSONDecodeError
+    _dumps = _orjson_dumps
+except ImportError:
+    try:
+        import msgspec  # type: ignore[import-not-found]
+
+        _msgspec_encoder = msgspec.json.Encoder(enc_hook=str)
+        _msgspec_decoder = msgspec.json.Decoder()
+
+        def _msgspec_loads(data: Any) -> Any:
+            try:
+                return _msgspec_decoder.decode(data)
+            except msgspec.DecodeError as e:
+                raise json.JSONDecodeError(str(e), data if isinstance(data, str) else "", 0) from e
+
+        def _msgspec_dumps(obj: Any, indent: bool) -> bytes:
+            try:
+                encoded = _msgspec_encoder.encode(obj)
+            except (TypeError, msgspec.EncodeError):
+                return _stdlib_dumps(obj, indent)
+            return msgspec.json.format(encoded, indent=2) if indent else encoded
+
+        BACKEND = "msgspec"
+        _loads = _msgspec_loads
+        _dumps = _msgspec_dumps
+    except ImportError:
+        BACKEND = "json"
+        _loads = json.loads
+        _dumps = _stdlib_dumps
+
+
+def loads(data: str | bytes) -> Any:
+    """Parse a JSON document. Invalid input raises `json.JSONDecodeError` with every backend."""
+    return _loads(data)
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize `obj` to a JSON string, compact unless `indent` is set."""
+    return _dumps(obj, indent).decode()
+
+
+def read_file(path: Path) -> Any:
+    """Parse the JSON document in the file at `path`."""
+    return _loads(Path(path).read_bytes())
+
+
+def write_file(path: Path, obj: Any, compact: bool = False) -> None:
+    """Write `obj` to the file at `path` as UTF-8 JSON, indented by two spaces unless `compact` is set."""
+    Path(path).write_bytes(_dumps(obj, not compact))
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def iter_array(path: Path, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """
+    The elements of the JSON array in the file at `path`, parsed one after the other while reading the file in chunks
+    of `chunk_size` characters. Only the element being parsed and a chunk of the file are held in memory, not the
+    whole document. Invalid input raises `json.JSONDecodeError`, possibly after some elements have been returned.
+    """
+    decoder = json.JSONDecoder()
+    with Path(path).open(encoding="utf-8") as f:
+        buffer = ""
+        position = 0
+        end_of_file = False
+        # What comes next: "[", then "first" (an element or "]"), "," (or "]") after an element, "element" after ","
+        expect = "["
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()  # type: ignore[union-attr]
+            if position == len(buffer):
+                if end_of_file:
+                    raise json.JSONDecodeError("Unterminated array", buffer, position)
+                chunk = f.read(chunk_size)
+                buffer, position, end_of_file = buffer[position:] + chunk, 0, not chunk
+                continue
+            char = buffer[position]
+            if expect == "[":
+                if char != "[":
+                    raise json.JSONDecodeError("Expecting an array", buffer, position)
+                position += 1
+                expect = "first"
+            elif expect == "," or (expect == "first" and char == "]"):
+                if char == "]":
+                    return
+                if char != ",":
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+                position += 1
+                expect = "element"
+            else:
+                try:
+                    element, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if end_of_file:
+                        raise
+                    incomplete = True
+                else:
+                    # Unless it is followed by a delimiter, the element may continue in the next chunk, like a number.
+                    following = _WHITESPACE.match(buffer, end).end()  # type: ignore[union-attr]
+                    incomplete = not end_of_file and buffer[following : following + 1] not in (",", "]")
+                if incomplete:
+                    chunk = f.read(chunk_size)
+                    buffer, position, end_of_file = buffer[position:] + chunk, 0, not chunk
+                    continue
+                yield element
+                position = end
+                expect = ","
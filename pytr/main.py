@@ -1,28 +1,25 @@
 #!/usr/bin/env python
 
+# Only what building the parser needs is imported here. Every command imports its modules when it runs, so that
+# `pytr --help`, `pytr --version` and shell completion do not load the API client and its dependencies.
+
 import argparse
-import asyncio
 import re
 import shutil
 import signal
 import sys
 from datetime import datetime, timedelta
-from importlib.metadata import version
 from pathlib import Path
 
-import shtab
-
-from pytr.account import login
-from pytr.alarms import Alarms
-from pytr.details import Details
-from pytr.dl import DL
-from pytr.event import Event
-from pytr.portfolio import PORTFOLIO_COLUMNS, Portfolio
-from pytr.rates import RATE_COLUMNS, Rates, parse_isin_input
-from pytr.savings_plans import SavingsPlans
-from pytr.timeline import Timeline
-from pytr.transactions import SUPPORTED_LANGUAGES, TransactionExporter
-from pytr.utils import check_version, get_logger
+from pytr.constants import (
+    COMPLETION_SHELLS,
+    INCREMENTAL_SAFETY_MARGIN,
+    MAX_INFLIGHT_DETAILS,
+    MIN_INFLIGHT_DETAILS,
+    PORTFOLIO_COLUMNS,
+    RATE_COLUMNS,
+    SUPPORTED_LANGUAGES,
+)
 
 
 def get_main_parser():
@@ -87,6 +84,7 @@ def get_main_parser():
             "AWS WAF token string or the method to obtain it. Possible values: "
             "\"playwright\" (to use playwright to obtain a token, needs the optional extra: pip install 'pytr[playwright]' && playwright install chromium), "
             '"awswaf" (to use a pure Python implementation to obtain a token, no browser), '
+            '"race" (to try awswaf first and playwright as well if awswaf is slow or fails, the first token wins), '
             '"default" (let pytr determine what to do, e.g. by login method used.), '
             "or a token string, e.g. captured from a browser session."
         ),
@@ -106,6 +104,45 @@ def get_main_parser():
         action="store_true",
         default=False,
     )
+    parser_login_args.add_argument(
+        "--record-session",
+        help=(
+            "Record every websocket frame sent and received to FILE (one JSON object per line) for a later "
+            "--replay-session. The recording contains your account data."
+        ),
+        metavar="FILE",
+        type=Path,
+        default=None,
+    )
+    parser_login_args.add_argument(
+        "--replay-session",
+        help=(
+            "Do not log in, replay the websocket frames recorded with --record-session instead. "
+            "REST calls such as document downloads are not replayed, combine with --dry-run where available."
+        ),
+        metavar="FILE",
+        type=Path,
+        default=None,
+    )
+    parser_login_args.add_argument(
+        "--replay-realtime",
+        help="Replay frames with their recorded delays instead of as fast as possible",
+        action="store_true",
+        default=False,
+    )
+    parser_login_args.add_argument(
+        "--api-url",
+        help="Do not log in, use the Trade Republic stand-in at URL instead, e.g. one started with 'pytr simulate'",
+        metavar="URL",
+        default=None,
+    )
+    parser_login_args.add_argument(
+        "--metrics-file",
+        help="Write latency and traffic counters per websocket subscription type to FILE as JSON at exit",
+        metavar="FILE",
+        type=Path,
+        default=None,
+    )
     parser_login_args.add_argument(
         "--v2",
         help=(
@@ -311,6 +348,53 @@ def get_main_parser():
         help="Write and maintain an event database file (all_events.json)",
         action=argparse.BooleanOptionalAction,
     )
+    parser_dl_docs.add_argument(
+        "--event-database",
+        help="Keep the event database here instead of in all_events.json in the output directory: a JSON file, "
+        "sqlite:PATH for an SQLite database or ndjson:PATH for a log of JSON lines, both only updated where events "
+        "changed",
+        metavar="LOCATION",
+        default=None,
+    )
+    parser_dl_docs.add_argument(
+        "--compact-event-database",
+        default=False,
+        help="Write the event database without indentation, which is smaller and faster to read and write",
+        action=argparse.BooleanOptionalAction,
+    )
+    parser_dl_docs.add_argument(
+        "--min-inflight-details",
+        help="Lower bound of the adaptive number of timeline detail requests awaiting a response",
+        metavar="N",
+        default=MIN_INFLIGHT_DETAILS,
+        type=int,
+    )
+    parser_dl_docs.add_argument(
+        "--max-inflight-details",
+        help="Upper bound of the adaptive number of timeline detail requests awaiting a response",
+        metavar="N",
+        default=MAX_INFLIGHT_DETAILS,
+        type=int,
+    )
+    parser_dl_docs.add_argument(
+        "--incremental",
+        default=False,
+        help="Only fetch the events newer than those in the event database, plus a safety margin of known ones",
+        action=argparse.BooleanOptionalAction,
+    )
+    parser_dl_docs.add_argument(
+        "--incremental-margin",
+        help="Number of known events to fetch again per timeline before an incremental sync stops",
+        metavar="N",
+        default=INCREMENTAL_SAFETY_MARGIN,
+        type=int,
+    )
+    parser_dl_docs.add_argument(
+        "--reuse-details",
+        default=False,
+        help="Take the details of events that have not changed from the event database instead of fetching them again",
+        action=argparse.BooleanOptionalAction,
+    )
     parser_dl_docs.add_argument(
         "--scan-for-duplicates",
         default=False,
@@ -343,7 +427,7 @@ def get_main_parser():
     )
     parser_dl_docs.add_argument(
         "--load-event-database",
-        help="Debug/analysis option: load events from this all_events.json instead of fetching from TR. Implies --dry-run; document URLs in the database may be expired.",
+        help="Debug/analysis option: load events from this all_events.json (or sqlite:PATH or ndjson:PATH database) instead of fetching from TR. Implies --dry-run; document URLs in the database may be expired.",
         metavar="PATH",
         default=None,
         type=Path,
@@ -354,6 +438,23 @@ def get_main_parser():
         help="Create folder structure and empty placeholder files without downloading",
         action="store_true",
     )
+    parser_dl_docs.add_argument(
+        "--accounts",
+        help=(
+            "Sync several accounts concurrently. TOML file with one [[account]] table per account "
+            "(phone_no, pin, optional name and output). Each account is written to PATH/<name> unless it sets output."
+        ),
+        metavar="FILE",
+        default=None,
+        type=Path,
+    )
+    parser_dl_docs.add_argument(
+        "--max-concurrent-accounts",
+        help="Number of accounts synced at the same time with --accounts",
+        metavar="N",
+        default=4,
+        type=int,
+    )
 
     # export_transactions
     info = (
@@ -392,6 +493,53 @@ def get_main_parser():
         help="Write and maintain an event database file (all_events.json)",
         action=argparse.BooleanOptionalAction,
     )
+    parser_export_transactions.add_argument(
+        "--event-database",
+        help="Keep the event database here instead of in all_events.json in the output directory: a JSON file, "
+        "sqlite:PATH for an SQLite database or ndjson:PATH for a log of JSON lines, both only updated where events "
+        "changed",
+        metavar="LOCATION",
+        default=None,
+    )
+    parser_export_transactions.add_argument(
+        "--compact-event-database",
+        default=False,
+        help="Write the event database without indentation, which is smaller and faster to read and write",
+        action=argparse.BooleanOptionalAction,
+    )
+    parser_export_transactions.add_argument(
+        "--min-inflight-details",
+        help="Lower bound of the adaptive number of timeline detail requests awaiting a response",
+        metavar="N",
+        default=MIN_INFLIGHT_DETAILS,
+        type=int,
+    )
+    parser_export_transactions.add_argument(
+        "--max-inflight-details",
+        help="Upper bound of the adaptive number of timeline detail requests awaiting a response",
+        metavar="N",
+        default=MAX_INFLIGHT_DETAILS,
+        type=int,
+    )
+    parser_export_transactions.add_argument(
+        "--incremental",
+        default=False,
+        help="Only fetch the events newer than those in the event database, plus a safety margin of known ones",
+        action=argparse.BooleanOptionalAction,
+    )
+    parser_export_transactions.add_argument(
+        "--incremental-margin",
+        help="Number of known events to fetch again per timeline before an incremental sync stops",
+        metavar="N",
+        default=INCREMENTAL_SAFETY_MARGIN,
+        type=int,
+    )
+    parser_export_transactions.add_argument(
+        "--reuse-details",
+        default=False,
+        help="Take the details of events that have not changed from the event database instead of fetching them again",
+        action=argparse.BooleanOptionalAction,
+    )
     parser_export_transactions.add_argument(
         "--scan-for-duplicates",
         default=False,
@@ -406,7 +554,7 @@ def get_main_parser():
     )
     parser_export_transactions.add_argument(
         "--load-event-database",
-        help="Load events from this all_events.json file instead of fetching from TR (implies no login)",
+        help="Load events from this all_events.json file (or sqlite:PATH or ndjson:PATH database) instead of fetching from TR (implies no login)",
         metavar="PATH",
         type=Path,
         default=None,
@@ -495,6 +643,52 @@ def get_main_parser():
         nargs="?",
     )
 
+    # simulate
+    info = "Run a local stand-in for the Trade Republic servers with a synthetic account, for load tests"
+    parser_simulate = parser_cmd.add_parser(
+        "simulate",
+        formatter_class=formatter,
+        help=info,
+        description=info + ". Point other commands at it with --api-url.",
+    )
+    parser_simulate.add_argument("--host", help="Interface to listen on", default="127.0.0.1")
+    parser_simulate.add_argument("--port", help="Port to listen on", default=8765, type=int)
+    parser_simulate.add_argument(
+        "--events", help="Number of timeline events of the account", metavar="N", default=1000, type=int
+    )
+    parser_simulate.add_argument("--page-size", help="Events per timeline page", metavar="N", default=50, type=int)
+    parser_simulate.add_argument(
+        "--latency", help="Seconds before every answer", metavar="SECONDS", default=0.0, type=float
+    )
+    parser_simulate.add_argument(
+        "--jitter",
+        help="Up to this many seconds added to the latency at random",
+        metavar="SECONDS",
+        default=0.0,
+        type=float,
+    )
+    parser_simulate.add_argument(
+        "--error-rate", help="Share of subscriptions answered with an error", metavar="RATE", default=0.0, type=float
+    )
+    parser_simulate.add_argument(
+        "--tick-interval", help="Seconds between two ticker updates", metavar="SECONDS", default=1.0, type=float
+    )
+    parser_simulate.add_argument("--seed", help="Seed for latency jitter, errors and prices", default=0, type=int)
+
+    # compact_db
+    info = "Rewrite an event database sorted by time and without the space taken by superseded events"
+    parser_compact_db = parser_cmd.add_parser(
+        "compact_db",
+        formatter_class=formatter,
+        help=info,
+        description=info,
+    )
+    parser_compact_db.add_argument(
+        "database",
+        help="The event database: a JSON file, sqlite:PATH or ndjson:PATH",
+        metavar="LOCATION",
+    )
+
     # completion
     info = "Print shell tab completion"
     parser_completion = parser_cmd.add_parser(
@@ -503,7 +697,9 @@ def get_main_parser():
         help=info,
         description=info,
     )
-    shtab.add_argument_to(parser_completion, "shell", parent=parser)
+    parser_completion.add_argument(
+        "shell", help="print shell completion script", choices=COMPLETION_SHELLS, default="bash", nargs="?"
+    )
     return parser
 
 
@@ -534,6 +730,8 @@ def main():
     args = parser.parse_args()
     # print(vars(args))
 
+    from pytr.utils import get_logger
+
     log = get_logger(__name__, args.verbosity, args.debug_logfile, args.debug_log_filter)
     if args.verbosity.upper() == "DEBUG":
         log.debug("logging is set to debug")
@@ -553,23 +751,43 @@ def main():
         else float("inf")
     )
 
+    try:
+        return _run_command(parser, args, not_before, not_after)
+    except Exception as e:
+        # pytr.api is only imported by the commands that log in, and is too heavy to import up front for this
+        from pytr.api import SessionExpiredError
+
+        if not isinstance(e, SessionExpiredError):
+            raise
+        log.error(str(e))
+        return -1
+
+
+def _login_from_args(args):
+    from pytr.account import login
+
+    return login(
+        phone_no=args.phone_no,
+        pin=args.pin,
+        store_credentials=args.store_credentials,
+        waf_token=args.waf_token,
+        v2=args.v2,
+        record_session=args.record_session,
+        replay_session=args.replay_session,
+        replay_realtime=args.replay_realtime,
+        api_url=args.api_url,
+        metrics_file=args.metrics_file,
+    )
+
+
+def _run_command(parser, args, not_before, not_after):
     if args.command == "login":
-        login(
-            phone_no=args.phone_no,
-            pin=args.pin,
-            store_credentials=args.store_credentials,
-            waf_token=args.waf_token,
-            v2=args.v2,
-        )
+        _login_from_args(args)
     elif args.command == "portfolio":
+        from pytr.portfolio import Portfolio
+
         Portfolio(
-            login(
-                phone_no=args.phone_no,
-                pin=args.pin,
-                store_credentials=args.store_credentials,
-                waf_token=args.waf_token,
-                v2=args.v2,
-            ),
+            _login_from_args(args),
             args.include_watchlist,
             instruments_to_ignore=re.split(r"[,;]", args.ignore) if args.ignore else [],
             lang=args.lang,
@@ -579,18 +797,14 @@ def main():
             sort_descending=not args.sort_ascending,
         ).get()
     elif args.command == "rates":
+        from pytr.rates import Rates, parse_isin_input
+
         isins = parse_isin_input(args.input, args.inputfile)
         if not isins:
             print("No valid ISINs found in input.")
             return -1
         Rates(
-            login(
-                phone_no=args.phone_no,
-                pin=args.pin,
-                store_credentials=args.store_credentials,
-                waf_token=args.waf_token,
-                v2=args.v2,
-            ),
+            _login_from_args(args),
             isins,
             output=args.output,
             decimal_localization=args.decimal_localization,
@@ -599,27 +813,63 @@ def main():
             sort_descending=not args.sort_ascending,
         ).get()
     elif args.command == "details":
+        from pytr.details import Details
+
         Details(
-            login(
-                phone_no=args.phone_no,
-                pin=args.pin,
-                store_credentials=args.store_credentials,
-                waf_token=args.waf_token,
-                v2=args.v2,
-            ),
+            _login_from_args(args),
             args.isin,
         ).get()
+    elif args.command == "dl_docs" and args.accounts is not None:
+        from pytr.multi_account import dl_docs_for_accounts, load_accounts
+
+        # Every account logs in to Trade Republic and has a database of its own.
+        for option, value in (
+            ("--load-event-database", args.load_event_database),
+            ("--event-database", args.event_database),
+            ("--record-session", args.record_session),
+            ("--replay-session", args.replay_session),
+            ("--api-url", args.api_url),
+            ("--metrics-file", args.metrics_file),
+        ):
+            if value is not None:
+                print(f"--accounts cannot be combined with {option}.")
+                return -1
+        failed = dl_docs_for_accounts(
+            load_accounts(args.accounts),
+            args.output,
+            max_concurrency=args.max_concurrent_accounts,
+            waf_token=args.waf_token,
+            v2=args.v2,
+            filename_fmt=args.format,
+            not_before=not_before,
+            not_after=not_after,
+            store_event_database=args.store_event_database,
+            scan_for_duplicates=args.scan_for_duplicates,
+            compact_event_database=args.compact_event_database,
+            min_inflight_details=args.min_inflight_details,
+            max_inflight_details=args.max_inflight_details,
+            incremental=args.incremental,
+            incremental_margin=args.incremental_margin,
+            reuse_details=args.reuse_details,
+            dump_raw_data=args.dump_raw_data,
+            export_transactions=args.export_transactions,
+            max_workers=args.workers,
+            universal_filepath=args.universal,
+            lang=args.lang,
+            date_with_time=args.date_with_time,
+            decimal_localization=args.decimal_localization,
+            sort_export=args.sort,
+            format_export=args.export_format,
+            flat=args.flat,
+            dry_run=args.dry_run,
+        )
+        if failed:
+            return -1
     elif args.command == "dl_docs":
+        from pytr.dl import DL
+
         DL(
-            None
-            if args.load_event_database is not None
-            else login(
-                phone_no=args.phone_no,
-                pin=args.pin,
-                store_credentials=args.store_credentials,
-                waf_token=args.waf_token,
-                v2=args.v2,
-            ),
+            None if args.load_event_database is not None else _login_from_args(args),
             args.output,
             args.format,
             not_before,
@@ -638,22 +888,27 @@ def main():
             flat=args.flat,
             load_event_database=args.load_event_database,
             dry_run=args.dry_run,
+            compact_event_database=args.compact_event_database,
+            min_inflight_details=args.min_inflight_details,
+            max_inflight_details=args.max_inflight_details,
+            incremental=args.incremental,
+            incremental_margin=args.incremental_margin,
+            reuse_details=args.reuse_details,
+            event_database=args.event_database,
         ).do_dl()
     elif args.command == "export_transactions":
+        import asyncio
+
+        from pytr.event import Event
+        from pytr.timeline import Timeline
+        from pytr.transactions import TransactionExporter
+
         if args.outputfile is None and args.outputdir is None:
             print("No output argument given.")
             return -1
 
         tl = Timeline(
-            None
-            if not_before == -1 or args.load_event_database is not None
-            else login(
-                phone_no=args.phone_no,
-                pin=args.pin,
-                store_credentials=args.store_credentials,
-                waf_token=args.waf_token,
-                v2=args.v2,
-            ),
+            None if not_before == -1 or args.load_event_database is not None else _login_from_args(args),
             args.outputdir,
             not_before,
             not_after,
@@ -661,6 +916,13 @@ def main():
             args.scan_for_duplicates,
             args.dump_raw_data,
             load_event_database=args.load_event_database,
+            compact_event_database=args.compact_event_database,
+            min_inflight_details=args.min_inflight_details,
+            max_inflight_details=args.max_inflight_details,
+            incremental=args.incremental,
+            incremental_margin=args.incremental_margin,
+            reuse_details=args.reuse_details,
+            event_database=args.event_database,
         )
         asyncio.run(tl.tl_loop())
         events = tl.events
@@ -676,19 +938,16 @@ def main():
                 decimal_localization=args.decimal_localization,
             ).export(
                 f,
-                [Event.from_dict(item) for item in events],
+                (Event.from_dict(item) for item in events),
                 sort=args.sort,
                 format=args.export_format,
             )
     elif args.command == "get_price_alarms":
+        from pytr.alarms import Alarms
+
         try:
             Alarms(
-                login(
-                    phone_no=args.phone_no,
-                    pin=args.pin,
-                    store_credentials=args.store_credentials,
-                    waf_token=args.waf_token,
-                ),
+                _login_from_args(args),
                 args.input,
                 args.outputfile,
             ).get()
@@ -696,14 +955,11 @@ def main():
             print(e)
             return -1
     elif args.command == "set_price_alarms":
+        from pytr.alarms import Alarms
+
         try:
             Alarms(
-                login(
-                    phone_no=args.phone_no,
-                    pin=args.pin,
-                    store_credentials=args.store_credentials,
-                    waf_token=args.waf_token,
-                ),
+                _login_from_args(args),
                 args.input,
                 args.inputfile,
                 args.remove_current_alarms,
@@ -711,20 +967,52 @@ def main():
         except ValueError as e:
             print(e)
             return -1
+    elif args.command == "simulate":
+        import asyncio
+
+        from pytr.simulator import Simulator
+
+        simulator = Simulator(
+            events=args.events,
+            page_size=args.page_size,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            tick_interval=args.tick_interval,
+            seed=args.seed,
+        )
+        try:
+            asyncio.run(simulator.serve_forever(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "compact_db":
+        from pytr.event_database import open_event_database
+
+        database = open_event_database(args.database)
+        if not database.exists():
+            print(f"No event database at {database}.")
+            return -1
+        size = database.path.stat().st_size
+        database.compact()
+        print(f"Compacted {database} from {size} to {database.path.stat().st_size} bytes.")
     elif args.command == "get_savings_plans":
+        from pytr.savings_plans import SavingsPlans
+
         SavingsPlans(
-            login(
-                phone_no=args.phone_no,
-                pin=args.pin,
-                store_credentials=args.store_credentials,
-                waf_token=args.waf_token,
-                v2=args.v2,
-            ),
+            _login_from_args(args),
             args.outputfile,
             decimal_localization=args.decimal_localization,
             lang=args.lang,
         ).get()
+    elif args.command == "completion":
+        import shtab
+
+        print(shtab.complete(parser, args.shell))
     elif args.version:
+        from importlib.metadata import version
+
+        from pytr.utils import check_version
+
         installed_version = version("pytr")
         print(installed_version)
         check_version(installed_version)
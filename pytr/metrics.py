@@ -0,0 +1,107 @@
+"""
+Counters for the websocket traffic of a `TradeRepublicApi`, per subscription type.
+
+They are updated for every frame, so they only count and never format anything. `TradeRepublicApi.metrics` holds
+them; `as_dict()` summarizes them and `dump()` writes that summary as JSON, e.g. at exit with `--metrics-file`.
+"""
+
+from bisect import bisect_left
+from pathlib import Path
+
+from pytr import jsonio
+
+# Upper bounds of the latency histogram buckets in milliseconds. A last bucket takes everything slower.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def as_dict(self):
+        count = sum(self.counts)
+        labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        return {
+            "count": count,
+            "mean_ms": round(self.total / count, 3) if count else None,
+            "max_ms": round(self.max, 3) if count else None,
+            "buckets_ms": {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+
+class SubscriptionMetrics:
+    """The traffic of all subscriptions of one type."""
+
+    def __init__(self):
+        self.subscriptions = 0
+        self.shared = 0
+        self.first_frame_latency = LatencyHistogram()
+        self.frames = 0
+        self.bytes = 0
+        self.full_frames = 0
+        self.delta_frames = 0
+        self.completed = 0
+        self.errors = 0
+
+    def as_dict(self):
+        # A and D frames, the ones a delta_ratio compares; C and E frames carry no data.
+        updates = self.full_frames + self.delta_frames
+        return {
+            "subscriptions": self.subscriptions,
+            "shared": self.shared,
+            "first_frame_latency": self.first_frame_latency.as_dict(),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "full_frames": self.full_frames,
+            "delta_frames": self.delta_frames,
+            "delta_ratio": round(self.delta_frames / updates, 4) if updates else None,
+            "completed": self.completed,
+            "errors": self.errors,
+        }
+
+
+class WebsocketMetrics:
+    def __init__(self):
+        self.types: dict[str, SubscriptionMetrics] = {}
+        self.connects = 0
+        self.reconnects = 0
+        self.dropped_frames = 0
+
+    def __getitem__(self, subscription_type: str) -> SubscriptionMetrics:
+        metrics = self.types.get(subscription_type)
+        if metrics is None:
+            metrics = self.types[subscription_type] = SubscriptionMetrics()
+        return metrics
+
+    def frame(self, subscription_type: str, code: str, size: int) -> None:
+        metrics = self[subscription_type]
+        metrics.frames += 1
+        metrics.bytes += size
+        if code == "A":
+            metrics.full_frames += 1
+        elif code == "D":
+            metrics.delta_frames += 1
+        elif code == "C":
+            metrics.completed += 1
+        elif code == "E":
+            metrics.errors += 1
+
+    def as_dict(self):
+        return {
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "dropped_frames": self.dropped_frames,
+            "types": {name: metrics.as_dict() for name, metrics in sorted(self.types.items())},
+        }
+
+    def dump(self, path: Path) -> None:
+        jsonio.write_file(path, self.as_dict())
@@ -0,0 +1,97 @@
+import asyncio
+import sys
+from pathlib import Path
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib  # type: ignore[import-not-found]  # a dependency on Python < 3.11 only
+
+from .account import weblogin
+from .api import BASE_DIR, TradeRepublicApi
+from .dl import DL
+from .utils import get_logger
+
+
+def load_accounts(path):
+    """
+    Read the accounts to sync from a TOML file.
+
+    Every account is an `[[account]]` table with `phone_no` and `pin`. The optional `name` names its output
+    directory and defaults to the phone number, the optional `output` replaces that directory altogether:
+
+        [[account]]
+        name = "alice"
+        phone_no = "+4912345678"
+        pin = "1234"
+    """
+    with open(path, "rb") as f:
+        accounts = tomllib.load(f).get("account", [])
+    if not accounts:
+        raise ValueError(f"No [[account]] entries found in {path}")
+
+    for i, account in enumerate(accounts, 1):
+        missing = [key for key in ("phone_no", "pin") if not account.get(key)]
+        if missing:
+            raise ValueError(f"Account #{i} in {path} has no {' and no '.join(missing)}")
+        account["phone_no"] = str(account["phone_no"])
+        account["pin"] = str(account["pin"])
+        account.setdefault("name", account["phone_no"])
+
+    names = [account["name"] for account in accounts]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Account names must be unique, found {', '.join(duplicates)} more than once in {path}")
+    return accounts
+
+
+def dl_docs_for_accounts(accounts, output_path, max_concurrency=4, waf_token="default", v2=False, **dl_kwargs):
+    """
+    Log in to every account one after the other, then run `DL` for all of them concurrently in one event loop,
+    at most `max_concurrency` at a time.
+
+    Logins may have to ask for a code, so they are not run concurrently. Cookies are always saved, so that the next
+    run can resume every session without asking again.
+
+    Returns the number of accounts that failed.
+    """
+    log = get_logger(__name__)
+    BASE_DIR.mkdir(parents=True, exist_ok=True)
+
+    dls = {}
+    for account in accounts:
+        log.info(f"Logging in to account {account['name']}...")
+        tr = TradeRepublicApi(
+            phone_no=account["phone_no"],
+            pin=account["pin"],
+            save_cookies=True,
+            waf_token=waf_token,
+            use_v2_login=v2,
+        )
+        weblogin(tr, v2)
+        output = Path(account["output"]).expanduser() if "output" in account else Path(output_path) / account["name"]
+        dls[account["name"]] = DL(tr, output, **dl_kwargs)
+
+    return asyncio.run(_run_all(dls, max_concurrency))
+
+
+async def _run_all(dls, max_concurrency):
+    log = get_logger(__name__)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(name, dl):
+        async with semaphore:
+            log.info(f"Account {name}: fetching timeline...")
+            await dl.tl.tl_loop()
+            # Exporting and waiting for downloads blocks; keep the loop free for the other accounts meanwhile.
+            await asyncio.to_thread(dl.export_and_download)
+            log.info(f"Account {name}: done.")
+
+    results = await asyncio.gather(*(run(name, dl) for name, dl in dls.items()), return_exceptions=True)
+
+    failed = 0
+    for name, result in zip(dls, results):
+        if isinstance(result, BaseException):
+            failed += 1
+            log.error(f"Account {name} failed: {result!r}")
+    return failed
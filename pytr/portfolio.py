@@ -4,6 +4,7 @@ from decimal import ROUND_HALF_UP, Decimal
 from pathlib import Path
 from typing import Optional
 
+from .constants import PORTFOLIO_COLUMNS
 from .tickers import (
     decimal_format,
     fetch_instrument_details,
@@ -12,15 +13,6 @@ from .tickers import (
 )
 from .utils import get_logger, preview
 
-PORTFOLIO_COLUMNS = [
-    "Name",
-    "ISIN",
-    "quantity",
-    "price",
-    "avgCost",
-    "netValue",
-]
-
 
 class Portfolio:
     def __init__(
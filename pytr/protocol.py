@@ -0,0 +1,62 @@
+"""
+Frames of the Trade Republic websocket protocol.
+
+Every frame the server sends is `<subscription id> <code> <payload>`. The code is `A` for a full JSON payload, `D`
+for a delta against the previous payload of the same subscription, `C` when the subscription is completed and `E`
+for an error. A delta is a tab separated list of instructions applied to the previous payload from left to right:
+`=n` keeps the next n characters, `-n` skips them and `+text` inserts URL-encoded text.
+
+These functions run once per received frame, so they avoid repeated scans and allocations.
+"""
+
+import difflib
+from urllib.parse import quote_plus, unquote_plus
+
+
+def parse_frame(frame: str) -> tuple[str, str, str]:
+    """Split a frame into its subscription id, its code and its payload."""
+    subscription_id, _, rest = frame.partition(" ")
+    return subscription_id, rest[:1], rest[1:].lstrip()
+
+
+def apply_delta(previous: str, delta: str) -> str:
+    """Return the payload that results from applying `delta` to `previous`."""
+    result: list[str] = []
+    append = result.append
+    i = 0
+    for diff in delta.split("\t"):
+        sign = diff[:1]
+        if sign == "=":
+            n = int(diff[1:])
+            append(previous[i : i + n])
+            i += n
+        elif sign == "-":
+            i += int(diff[1:])
+        elif sign == "+":
+            text = diff[1:]
+            # Most inserts are plain digits; decoding is only needed if something is actually encoded.
+            if "%" in text or "+" in text:
+                text = unquote_plus(text)
+            append(text.strip())
+    return "".join(result)
+
+
+def encode_delta(previous: str, current: str) -> str:
+    """Return a delta that turns `previous` into `current`, the inverse of `apply_delta`.
+
+    Trade Republic's client and `apply_delta` strip whitespace around inserted text. An insert that starts or ends
+    with whitespace cannot be expressed, so in that case the whole payload is replaced instead.
+    """
+    diffs = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, previous, current).get_opcodes():
+        if tag == "equal":
+            diffs.append(f"={i2 - i1}")
+            continue
+        if i2 > i1:
+            diffs.append(f"-{i2 - i1}")
+        if j2 > j1:
+            text = current[j1:j2]
+            if text != text.strip():
+                return f"-{len(previous)}\t+{quote_plus(current)}"
+            diffs.append(f"+{quote_plus(text)}")
+    return "\t".join(diffs)
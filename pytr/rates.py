@@ -5,6 +5,7 @@ from decimal import Decimal
 from pathlib import Path
 from typing import Optional
 
+from .constants import RATE_COLUMNS
 from .tickers import (
     decimal_format,
     fetch_instrument_details,
@@ -13,13 +14,6 @@ from .tickers import (
 )
 from .utils import get_logger
 
-RATE_COLUMNS = [
-    "Name",
-    "ISIN",
-    "price",
-    "ask",
-]
-
 
 class Rates:
     def __init__(
@@ -0,0 +1,169 @@
+"""
+Record the websocket traffic of a session and replay it later without a network.
+
+A recording is a file with one JSON object per line: `{"t": <seconds since the recording started>, "dir": "out" or
+"in", "frame": <the raw frame>}`. It holds every frame sent and received, including the `D` delta frames, so a replay
+exercises the same code paths with the same traffic shape as the recorded session. Recordings contain account data
+and should be treated like the event database.
+
+On replay, a `sub` is answered with the frames that answered the subscription with the same payload in the recording,
+under the new subscription id, either at once or with their recorded delays. Payloads that were subscribed several
+times are answered with their recorded occurrences in turn. Payloads that were never recorded get an error frame.
+Only the websocket is replayed, REST calls like document downloads still go to Trade Republic.
+"""
+
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from pytr import jsonio
+from pytr.protocol import parse_frame
+
+
+class SessionRecorder:
+    """Appends the frames of every websocket wrapped with `wrap` to a recording file."""
+
+    def __init__(self, path: Path):
+        self._file = open(path, "w", encoding="utf-8", buffering=1)
+        self._start = time.monotonic()
+
+    def record(self, direction: str, frame: str) -> None:
+        t = round(time.monotonic() - self._start, 6)
+        self._file.write(jsonio.dumps({"t": t, "dir": direction, "frame": frame}) + "\n")
+
+    def wrap(self, ws):
+        return _RecordingWebSocket(ws, self)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _RecordingWebSocket:
+    def __init__(self, ws, recorder: SessionRecorder):
+        self._ws = ws
+        self._recorder = recorder
+
+    async def send(self, message):
+        self._recorder.record("out", message)
+        await self._ws.send(message)
+
+    async def recv(self):
+        frame = await self._ws.recv()
+        self._recorder.record("in", frame)
+        return frame
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+
+def _payload_key(payload: str) -> str:
+    return json.dumps(json.loads(payload), sort_keys=True)
+
+
+class Recording:
+    """The frames of a recording, grouped by subscription payload."""
+
+    def __init__(self, path: Path):
+        # Payload -> one list of (delay after the `sub`, frame without its subscription id) per time it was subscribed.
+        self.subscriptions: dict[str, list[list[tuple[float, str]]]] = {}
+        self._taken: dict[str, int] = {}
+
+        # Subscription id -> time of the `sub` and the frames answering it, for the connection being read.
+        open_subscriptions: dict[str, tuple[float, list[tuple[float, str]]]] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = jsonio.loads(line)
+                t, frame = record["t"], record["frame"]
+                if record["dir"] == "out":
+                    command, _, rest = frame.partition(" ")
+                    if command == "connect":
+                        # Subscription ids are only unique per connection.
+                        open_subscriptions = {}
+                    elif command == "sub":
+                        subscription_id, _, payload = rest.partition(" ")
+                        frames: list[tuple[float, str]] = []
+                        self.subscriptions.setdefault(_payload_key(payload), []).append(frames)
+                        open_subscriptions[subscription_id] = (t, frames)
+                    continue
+                subscription_id, code, payload = parse_frame(frame)
+                if subscription_id in open_subscriptions:
+                    subscribed_at, frames = open_subscriptions[subscription_id]
+                    frames.append((t - subscribed_at, f"{code} {payload}" if payload else code))
+
+    def take(self, payload: str) -> list[tuple[float, str]] | None:
+        """The frames answering the next recorded subscription of `payload`, None if it was never recorded."""
+        key = _payload_key(payload)
+        occurrences = self.subscriptions.get(key)
+        if not occurrences:
+            return None
+        i = self._taken.get(key, 0)
+        self._taken[key] = i + 1
+        return occurrences[min(i, len(occurrences) - 1)]
+
+
+class ReplayWebSocket:
+    """Stands in for the websocket connection to Trade Republic, answering from a `Recording`."""
+
+    def __init__(self, recording: Recording, realtime: bool = False):
+        self.close_code = None
+        self._recording = recording
+        self._realtime = realtime
+        self._frames: asyncio.Queue = asyncio.Queue()
+        self._feeds: dict[str, asyncio.Task] = {}
+
+    async def send(self, message):
+        command, _, rest = message.partition(" ")
+        if command == "connect":
+            self._frames.put_nowait("connected")
+        elif command == "sub":
+            subscription_id, _, payload = rest.partition(" ")
+            frames = self._recording.take(payload)
+            if frames is None:
+                error = {"errors": [{"errorCode": "NOT_RECORDED", "errorMessage": f"Not in the recording: {payload}"}]}
+                self._frames.put_nowait(f"{subscription_id} E {json.dumps(error)}")
+            elif self._realtime:
+                self._feeds[subscription_id] = asyncio.create_task(self._feed(subscription_id, frames))
+            else:
+                for _, frame in frames:
+                    self._frames.put_nowait(f"{subscription_id} {frame}")
+        elif command == "unsub":
+            feed = self._feeds.pop(rest, None)
+            if feed is not None:
+                feed.cancel()
+
+    async def _feed(self, subscription_id, frames):
+        start = time.monotonic()
+        for delay, frame in frames:
+            await asyncio.sleep(max(0.0, start + delay - time.monotonic()))
+            self._frames.put_nowait(f"{subscription_id} {frame}")
+
+    async def recv(self):
+        return await self._frames.get()
+
+    async def close(self):
+        for feed in self._feeds.values():
+            feed.cancel()
+        self._feeds = {}
+        self.close_code = 1000
+
+
+def replay_connect(path: Path, realtime: bool = False):
+    """A replacement for `websockets.connect` that connects to a replay of the recording at `path`."""
+    recording = Recording(path)
+
+    async def connect(*args, **kwargs):
+        return ReplayWebSocket(recording, realtime)
+
+    return connect
+
+
+def replay_api(path: Path, realtime: bool = False):
+    """A `TradeRepublicApi` whose websocket replays the recording at `path`, no login needed."""
+    from pytr.api import TradeRepublicApi
+
+    tr = TradeRepublicApi(phone_no="replay", pin="replay", waf_token=None)
+    tr._ws_connect = replay_connect(path, realtime)
+    return tr
@@ -0,0 +1,237 @@
+"""
+A local stand-in for the Trade Republic websocket and document servers, for load tests without a network.
+
+It speaks the `connect`/`sub`/`unsub` protocol that `TradeRepublicApi` uses and answers the subscriptions pytr makes
+for a synthetic account: `timelineTransactions` and `timelineActivityLog` pages, `timelineDetailV2` with a document
+each and `instrument`, each answered with an `A` frame followed by a `C` frame, and `ticker`, which keeps sending `D`
+delta frames until it is unsubscribed and then sends `C`. Other subscriptions get an `E` frame. The documents are
+served over HTTP on the same port.
+
+Start it with `pytr simulate` and point another pytr command at it with `--api-url`, e.g.
+`pytr dl_docs --api-url http://127.0.0.1:8765 out/`.
+"""
+
+import asyncio
+import contextlib
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+from websockets.asyncio.server import serve
+from websockets.datastructures import Headers
+from websockets.http11 import Response
+
+from pytr.protocol import encode_delta
+from pytr.utils import get_logger
+
+_PDF = b"%PDF-1.4\n% pytr simulator\n%%EOF\n"
+
+# Every fourth event of the synthetic account is in the activity log, the others are transactions.
+_ACTIVITY_EVERY = 4
+
+
+class Simulator:
+    """
+    events: number of timeline events of the synthetic account
+    page_size: number of events per timeline page
+    latency: seconds before every answer, plus up to `jitter` seconds at random
+    error_rate: share of subscriptions answered with an `E` frame instead
+    tick_interval: seconds between two ticker deltas
+    """
+
+    def __init__(
+        self,
+        events=1000,
+        page_size=50,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        tick_interval=1.0,
+        seed=0,
+    ):
+        self.events = events
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tick_interval = tick_interval
+        self.base_url = ""
+        self.log = get_logger(__name__)
+        self._random = random.Random(seed)
+        self._start = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+        self._timelines = {
+            "timelineTransactions": [i for i in range(events) if i % _ACTIVITY_EVERY != _ACTIVITY_EVERY - 1],
+            "timelineActivityLog": [i for i in range(events) if i % _ACTIVITY_EVERY == _ACTIVITY_EVERY - 1],
+        }
+
+    def _timestamp(self, i):
+        return (self._start - timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+
+    def event(self, i):
+        """The timeline entry of event number `i`, newest first."""
+        event_id = f"sim-{i:07d}"
+        event = {
+            "id": event_id,
+            "timestamp": self._timestamp(i),
+            "icon": "",
+            "status": "EXECUTED",
+            "action": {"type": "timelineDetail", "payload": event_id},
+        }
+        if i % _ACTIVITY_EVERY == _ACTIVITY_EVERY - 1:
+            event.update(title="Quartalsbericht", subtitle="Dokument", eventType="QUARTERLY_REPORT")
+        elif i % 2:
+            event.update(
+                title="Zinsen",
+                subtitle="Zinszahlung",
+                eventType="INTEREST_PAYOUT",
+                amount={"currency": "EUR", "value": round(1 + i % 97 / 10, 2), "fractionDigits": 2},
+            )
+        else:
+            event.update(
+                title="Einzahlung",
+                subtitle="Fertig",
+                eventType="BANK_TRANSACTION_INCOMING",
+                amount={"currency": "EUR", "value": float(100 + i % 900), "fractionDigits": 2},
+            )
+        return event
+
+    def detail(self, i):
+        """The `timelineDetailV2` answer for event number `i`."""
+        event = self.event(i)
+        return {
+            "id": event["id"],
+            "sections": [
+                {
+                    "title": event["title"],
+                    "data": {"icon": "", "timestamp": event["timestamp"], "status": "executed"},
+                    "type": "header",
+                },
+                {
+                    "title": "Dokumente",
+                    "data": [
+                        {
+                            "title": "Dokument",
+                            "action": {"type": "browserModal", "payload": f"{self.base_url}/documents/{event['id']}"},
+                            "id": f"doc-{i:07d}",
+                            "detail": event["timestamp"][:10],
+                        }
+                    ],
+                    "type": "documents",
+                },
+            ],
+        }
+
+    def _page(self, timeline, after):
+        indices = self._timelines[timeline]
+        start = int(after) if after else 0
+        end = start + self.page_size
+        return {
+            "items": [self.event(i) for i in indices[start:end]],
+            "cursors": {"before": str(start) if start else None, "after": str(end) if end < len(indices) else None},
+        }
+
+    def _instrument(self, isin):
+        return {"isin": isin, "shortName": f"Simulated {isin}", "name": f"Simulated {isin}", "exchangeIds": ["LSX"]}
+
+    def _quote(self, price):
+        price = f"{price:.2f}"
+        return {"bid": {"price": price}, "ask": {"price": price}, "last": {"price": price}, "open": {"price": price}}
+
+    async def _wait(self):
+        delay = self.latency + self._random.random() * self.jitter
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _answer(self, ws, subscription_id, payload):
+        await self._wait()
+
+        def error(code, message):
+            errors = {"errors": [{"errorCode": code, "errorMessage": message, "meta": None}]}
+            return f"{subscription_id} E {json.dumps(errors)}"
+
+        if self._random.random() < self.error_rate:
+            await ws.send(error("SIMULATED_ERROR", "Injected by the simulator"))
+            return
+
+        kind = payload.get("type")
+        if kind in self._timelines:
+            answer = self._page(kind, payload.get("after"))
+        elif kind == "timelineDetailV2":
+            event_id = str(payload.get("id", ""))
+            i = int(event_id[4:]) if event_id.startswith("sim-") and event_id[4:].isdigit() else -1
+            if not 0 <= i < self.events:
+                await ws.send(error("NOT_FOUND", f"No event {event_id!r}"))
+                return
+            answer = self.detail(i)
+        elif kind == "instrument":
+            answer = self._instrument(payload.get("id"))
+        elif kind == "ticker":
+            await self._tick(ws, subscription_id)
+            return
+        else:
+            await ws.send(error("UNSUPPORTED", f"The simulator does not support {kind!r}"))
+            return
+        await ws.send(f"{subscription_id} A {json.dumps(answer)}")
+        # A one-off answer is complete, as with the real server.
+        await ws.send(f"{subscription_id} C")
+
+    async def _tick(self, ws, subscription_id):
+        price = 100.0
+        previous = json.dumps(self._quote(price))
+        await ws.send(f"{subscription_id} A {previous}")
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            price = max(0.01, price + self._random.uniform(-0.5, 0.5))
+            current = json.dumps(self._quote(price))
+            await ws.send(f"{subscription_id} D {encode_delta(previous, current)}")
+            previous = current
+
+    async def _handle(self, ws):
+        message = await ws.recv()
+        if not message.startswith("connect "):
+            await ws.close(1002, "expected connect")
+            return
+        await ws.send("connected")
+
+        answers: dict[str, asyncio.Task] = {}
+        try:
+            async for message in ws:
+                command, _, rest = message.partition(" ")
+                if command == "sub":
+                    subscription_id, _, payload = rest.partition(" ")
+                    answers[subscription_id] = asyncio.create_task(
+                        self._answer(ws, subscription_id, json.loads(payload))
+                    )
+                elif command == "unsub":
+                    answer = answers.pop(rest, None)
+                    if answer is not None and not answer.done():
+                        answer.cancel()
+                        await ws.send(f"{rest} C")
+        finally:
+            for answer in answers.values():
+                answer.cancel()
+
+    async def _process_request(self, connection, request):
+        if request.path.startswith("/documents/"):
+            await self._wait()
+            # The server closes the connection after every plain HTTP response, tell the client not to reuse it.
+            headers = Headers(
+                {"Content-Type": "application/pdf", "Content-Length": str(len(_PDF)), "Connection": "close"}
+            )
+            return Response(200, "OK", headers, _PDF)
+        if "upgrade" not in request.headers.get("Connection", "").lower():
+            return connection.respond(404, "Not found\n")
+        return None
+
+    @contextlib.asynccontextmanager
+    async def running(self, host="127.0.0.1", port=0):
+        """Serve on `host` and `port` (0 picks a free one) while the block runs. `base_url` is the URL to use."""
+        async with serve(self._handle, host, port, process_request=self._process_request) as server:
+            bound_host, bound_port = next(iter(server.sockets)).getsockname()[:2]
+            self.base_url = f"http://{bound_host}:{bound_port}"
+            yield server
+
+    async def serve_forever(self, host="127.0.0.1", port=8765):
+        async with self.running(host, port) as server:
+            self.log.info(f"Simulating an account with {self.events} events on {self.base_url}")
+            await server.serve_forever()
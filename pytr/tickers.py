@@ -6,23 +6,9 @@ from typing import Optional
 
 from babel.numbers import format_decimal
 
+from .constants import SUPPORTED_LANGUAGES
 from .utils import get_logger
 
-SUPPORTED_LANGUAGES = {
-    "cs",
-    "da",
-    "de",
-    "en",
-    "es",
-    "fr",
-    "it",
-    "nl",
-    "pl",
-    "pt",
-    "ru",
-    "zh",
-}
-
 bond_pattern = re.compile(
     r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|January|February|March|April|May|June|July|August|September|October|November|December|Januar|Februar|März|April|Mai|Juni|Juli|August|September|Oktober|November|Dezember)\.?\s+20\d{2}",
     re.IGNORECASE,
@@ -58,20 +44,14 @@ def decimal_format(
 
 async def fetch_instrument_details(tr, positions: list[dict]) -> None:
     """Populate pos['name'] and pos['exchangeIds'] for each position in-place."""
-    subscriptions = {}
-    for pos in positions:
-        sub_id = await tr.instrument_details(pos["instrumentId"])
-        subscriptions[sub_id] = pos
-
-    while subscriptions:
-        sub_id, subscription, response = await tr.recv()
-        if subscription["type"] == "instrument":
-            await tr.unsubscribe(sub_id)
-            pos = subscriptions.pop(sub_id)
-            pos["name"] = response.get("shortName", pos["instrumentId"])
-            pos["exchangeIds"] = response.get("exchangeIds", [])
-        else:
-            _log.debug(f"Unexpected subscription type: {subscription['type']}")
+
+    async def fetch(pos):
+        async with tr.stream({"type": "instrument", "id": pos["instrumentId"]}) as instrument:
+            response = await instrument.get()
+        pos["name"] = response.get("shortName", pos["instrumentId"])
+        pos["exchangeIds"] = response.get("exchangeIds", [])
+
+    await asyncio.gather(*(fetch(pos) for pos in positions))
 
 
 async def fetch_tickers(tr, positions: list[dict], timeout: float = 5.0) -> list[dict]:
@@ -80,30 +60,27 @@ async def fetch_tickers(tr, positions: list[dict], timeout: float = 5.0) -> list
     Populates pos['price'] and pos['ask'] in-place. Bond prices are divided by 100.
     Returns the list of positions for which no price was received.
     """
-    subscriptions = {}
+
+    async def fetch(pos):
+        payload = {"type": "ticker", "id": f"{pos['instrumentId']}.{pos['exchangeIds'][0]}"}
+        async with tr.stream(payload) as ticker:
+            try:
+                response = await asyncio.wait_for(ticker.get(), timeout)
+            except asyncio.TimeoutError:
+                _log.warning(f"Timed out waiting for ticker: {pos}")
+                return
+        pos["price"] = response["last"]["price"]
+        if bond_pattern.search(pos.get("name", "")):
+            pos["price"] = Decimal(pos["price"]) / 100
+        pos["ask"] = response.get("ask", {}).get("price")
+
+    with_exchange = []
     for pos in positions:
         if pos.get("exchangeIds"):
-            sub_id = await tr.ticker(pos["instrumentId"], exchange=pos["exchangeIds"][0])
-            subscriptions[sub_id] = pos
+            with_exchange.append(pos)
         else:
             _log.warning(f"No exchange found for {pos['instrumentId']}, skipping.")
-
-    while subscriptions:
-        try:
-            sub_id, subscription, response = await asyncio.wait_for(tr.recv(), timeout)
-        except asyncio.TimeoutError:
-            _log.warning(f"Timed out waiting for tickers: {list(subscriptions.values())}")
-            break
-
-        if subscription["type"] == "ticker":
-            await tr.unsubscribe(sub_id)
-            pos = subscriptions.pop(sub_id)
-            pos["price"] = response["last"]["price"]
-            if bond_pattern.search(pos.get("name", "")):
-                pos["price"] = Decimal(pos["price"]) / 100
-            pos["ask"] = response.get("ask", {}).get("price")
-        else:
-            _log.debug(f"Unexpected subscription type: {subscription['type']}")
+    await asyncio.gather(*(fetch(pos) for pos in with_exchange))
 
     missing = [pos for pos in positions if "price" not in pos]
     return missing
@@ -1,35 +1,244 @@
 import json
-from datetime import datetime
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime, timedelta, timezone
 
 from .api import TradeRepublicError
+from .constants import INCREMENTAL_SAFETY_MARGIN, MAX_INFLIGHT_DETAILS, MIN_INFLIGHT_DETAILS
+from .event_database import open_event_database
+from .timestamps import event_epoch
 from .utils import get_logger, preview
 
-MAX_EVENT_REQUEST_BATCH = 1000
+
+class DetailRequestWindow:
+    """
+    How many timeline detail requests may be awaiting their response at the same time.
+
+    The window starts with a slow start, growing by one request per response and so doubling every round trip, to
+    find the concurrency the server copes with quickly. It halves when the server answers with errors or when a
+    response takes `slowdown` times longer than the fastest one seen, the sign of requests queueing up on the server.
+    From the first time it halves on, it only grows by about one request per round trip (additive increase,
+    multiplicative decrease). It stays within `minimum` and `maximum`.
+    """
+
+    def __init__(self, minimum=MIN_INFLIGHT_DETAILS, maximum=MAX_INFLIGHT_DETAILS, initial=None, slowdown=4.0):
+        if not 1 <= minimum <= maximum:
+            raise ValueError(f"Invalid window bounds: {minimum}..{maximum}")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slowdown = slowdown
+        self.size = float(min(max(initial if initial is not None else 4 * minimum, minimum), maximum))
+        self._fastest = None
+        self._since_decrease = 0
+        self._slow_start = True
+
+    @property
+    def limit(self):
+        return int(self.size)
+
+    def on_response(self, latency):
+        self._since_decrease += 1
+        if self._fastest is None or latency < self._fastest:
+            self._fastest = latency
+        if latency > self._fastest * self.slowdown:
+            self._decrease()
+        else:
+            self.size = min(self.maximum, self.size + (1 if self._slow_start else 1 / self.size))
+
+    def on_error(self):
+        self._since_decrease += 1
+        self._decrease()
+
+    def _decrease(self):
+        # Responses to requests sent before the last decrease say nothing about the smaller window, so shrink at
+        # most once per window's worth of responses.
+        if not self._slow_start and self._since_decrease < self.size:
+            return
+        self._since_decrease = 0
+        self._slow_start = False
+        self.size = max(self.minimum, self.size / 2)
+
+
+def detail_fingerprint(event):
+    """
+    What of a timeline entry has to stay the same for its details to be reused. Entries that change, like a pending
+    order that gets executed, change at least one of these.
+    """
+    return (
+        event.get("timestamp"),
+        event.get("status"),
+        event.get("title"),
+        event.get("subtitle"),
+        json.dumps(event.get("amount"), sort_keys=True),
+    )
+
+
+# The subtitles of the entries that `is_likely_same_but_newer` takes for copies of each other.
+DUPLICATE_SUBTITLES = frozenset({"Limit-Sell-Order", "Limit-Buy-Order", "Sparplan ausgeführt"})
+
+# How far apart in time the two copies of an entry may be.
+DUPLICATE_WINDOW = timedelta(milliseconds=500)
+
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
 
 
 def is_likely_same_but_newer(event, old_event):
     if event["title"] != old_event["title"]:
         return False
 
-    if (
-        event["subtitle"] != "Limit-Sell-Order"
-        and event["subtitle"] != "Limit-Buy-Order"
-        and event["subtitle"] != "Sparplan ausgeführt"
-    ):
+    if event["subtitle"] not in DUPLICATE_SUBTITLES:
         return False
 
     if event["subtitle"] != old_event["subtitle"]:
         return False
 
     # Check timestamps
-    fmt = "%Y-%m-%dT%H:%M:%S.%f%z"
-    date_new = datetime.strptime(event["timestamp"], fmt)
-    date_old = datetime.strptime(old_event["timestamp"], fmt)
+    date_new = datetime.strptime(event["timestamp"], _TIMESTAMP_FORMAT)
+    date_old = datetime.strptime(old_event["timestamp"], _TIMESTAMP_FORMAT)
 
     if date_new < date_old:
         return False
 
-    return abs((date_new - date_old).total_seconds() * 1000) <= 500
+    return date_new - date_old <= DUPLICATE_WINDOW
+
+
+class DuplicateIndex:
+    """
+    The events of a merge, for finding the ones `is_likely_same_but_newer` takes for an older copy of another event
+    without comparing every pair.
+
+    Only events with one of the `DUPLICATE_SUBTITLES` are indexed, by title and subtitle and in time order, so a
+    lookup only looks at the events of the same kind from the `DUPLICATE_WINDOW` before. Every event also keeps the
+    position it was first added at, the position a dict keeps for a key that is assigned again, so that of several
+    candidates the one a scan of the merged dict finds first is returned.
+    """
+
+    def __init__(self):
+        self._groups = {}  # (title, subtitle) -> [(microseconds since the epoch, position, id)], sorted
+        self._entries = {}  # id -> ((title, subtitle), entry in its group)
+        self._positions = {}  # id -> position
+        self._next_position = 0
+
+    @staticmethod
+    def _key(event):
+        if event["subtitle"] not in DUPLICATE_SUBTITLES:
+            return None
+        try:
+            date = datetime.strptime(event["timestamp"], _TIMESTAMP_FORMAT)
+        except ValueError:
+            # is_likely_same_but_newer fails on these, they never took part in finding duplicates
+            return None
+        return (event["title"], event["subtitle"]), (date - _EPOCH) // _MICROSECOND
+
+    def add(self, event):
+        """Index `event`, in place of the event with the same id if there is one."""
+        event_id = event["id"]
+        self._unindex(event_id)
+        position = self._positions.get(event_id)
+        if position is None:
+            position = self._positions[event_id] = self._next_position
+            self._next_position += 1
+        key = self._key(event)
+        if key is not None:
+            group, microseconds = key
+            entry = (microseconds, position, event_id)
+            insort(self._groups.setdefault(group, []), entry)
+            self._entries[event_id] = (group, entry)
+
+    def remove(self, event_id):
+        self._unindex(event_id)
+        self._positions.pop(event_id, None)
+
+    def _unindex(self, event_id):
+        indexed = self._entries.pop(event_id, None)
+        if indexed is not None:
+            group, entry = indexed
+            entries = self._groups[group]
+            del entries[bisect_left(entries, entry)]
+
+    def find_older(self, event, other_than=None):
+        """
+        The id of the first added event that `event` is likely a newer copy of, None if there is none. The event
+        with the id `other_than` is not considered.
+        """
+        key = self._key(event)
+        if key is None:
+            return None
+        group, microseconds = key
+        entries = self._groups.get(group)
+        if not entries:
+            return None
+        window = DUPLICATE_WINDOW // _MICROSECOND
+        first = bisect_left(entries, (microseconds - window,))
+        last = bisect_left(entries, (microseconds + 1,))
+        found = None
+        for _, position, event_id in entries[first:last]:
+            if event_id != other_than and (found is None or position < found[0]):
+                found = (position, event_id)
+        return found[1] if found is not None else None
+
+
+def merge_events(old_events, new_events, log, scan_for_duplicates=False):
+    """
+    The events of the event database with the new ones, which replace old ones with the same id. With
+    `scan_for_duplicates`, an event also replaces the event it is likely a newer copy of, see
+    `is_likely_same_but_newer`.
+    """
+    cur_events = {}
+    index = DuplicateIndex() if scan_for_duplicates else None
+
+    # drop duplicates in old events
+    if old_events:
+        if scan_for_duplicates:
+            log.info("Adding old events (scanning for duplicates)...")
+            for event in old_events:
+                idtodel = index.find_older(event)
+                if idtodel is not None:
+                    log.warning(
+                        f"Dropping potential duplicate event {idtodel} from {cur_events[idtodel]['timestamp']} due to newer event {event['id']} from {event['timestamp']}."
+                    )
+                    cur_events.pop(idtodel)
+                    index.remove(idtodel)
+                cur_events[event["id"]] = event
+                index.add(event)
+        else:
+            log.info("Adding old events...")
+            for event in old_events:
+                cur_events[event["id"]] = event
+
+    # add new events
+    if new_events:
+        if scan_for_duplicates:
+            log.info("Adding new events (scanning for duplicates)...")
+            for event in new_events:
+                idtodel = index.find_older(event, other_than=event["id"])
+                if idtodel is not None:
+                    log.warning(
+                        f"Dropping existing event {idtodel} from {cur_events[idtodel]['timestamp']} due to newer event {event['id']} from {event['timestamp']}."
+                    )
+                    cur_events.pop(idtodel)
+                    index.remove(idtodel)
+                cur_events[event["id"]] = event
+                index.add(event)
+        else:
+            log.info("Adding new events...")
+            for event in new_events:
+                cur_events[event["id"]] = event
+
+    return list(cur_events.values())
+
+
+class StreamedEvents:
+    """The events of a replayed event database: every iteration streams them from the database again."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __iter__(self):
+        return iter(self._stream())
 
 
 class Timeline:
@@ -44,7 +253,25 @@ class Timeline:
         dump_raw_data=False,
         event_callback=lambda *a, **kw: None,
         load_event_database=None,
+        compact_event_database=False,
+        min_inflight_details=MIN_INFLIGHT_DETAILS,
+        max_inflight_details=MAX_INFLIGHT_DETAILS,
+        incremental=False,
+        incremental_margin=INCREMENTAL_SAFETY_MARGIN,
+        reuse_details=False,
+        event_database=None,
     ):
+        """
+        `event_database` is where the event database is kept, see `open_event_database`, by default all_events.json
+        in `output_path`. `load_event_database` is one to replay instead of fetching from TR.
+
+        With `incremental`, read the event database first and stop paging back through a timeline once its pages
+        held `incremental_margin` events that are in the database unchanged. The events fetched are merged into
+        the database, the older ones in it are kept as they are.
+
+        With `reuse_details`, take the details of events from the event database instead of requesting them again,
+        unless the event has changed since, see `detail_fingerprint`.
+        """
         self.tr = tr
         self.output_path = output_path
         if load_event_database is not None or not_before == -1:
@@ -55,13 +282,17 @@ class Timeline:
         self.load_event_database = load_event_database
         self.not_after = not_after
         self.store_event_database = store_event_database
+        self.compact_event_database = compact_event_database
+        self.event_database = open_event_database(
+            event_database if event_database is not None else output_path / "all_events.json",
+            compact=compact_event_database,
+        )
         self.scan_for_duplicates = scan_for_duplicates
         self.dump_raw_data = dump_raw_data
         self.event_callback = event_callback
         self.log = get_logger(__name__)
         self.dl_done = False
         self.error_counts = {}
-        self.num_timelines = 0
         self.all_detail = 0
         self.requested_detail = 0
         self.received_detail = 0
@@ -71,6 +302,28 @@ class Timeline:
         self.timeline_activities = {}
         self.timeline_details = {}
         self.events = []
+        # Event id -> index in `events` of the events fetched, for an activity log version arriving late.
+        self._event_indices = {}
+        self.detail_window = DetailRequestWindow(min_inflight_details, max_inflight_details)
+        # Ids of the events whose details are yet to be requested, queued as their pages arrive.
+        self._pending_details = deque()
+        self._inflight_details = {}
+        # Both timelines are paged at the same time: the pages received, and the timelines not yet paged through.
+        self._pages = {"timelineTransaction": 0, "timelineActivity": 0}
+        self._listing = {"timelineTransaction", "timelineActivity"}
+        self._requested_all_details = False
+        self.incremental = incremental
+        self.incremental_margin = incremental_margin
+        # Event id -> timestamp of the events in the database, for an incremental sync.
+        self._known_events = {}
+        # Per source: the number of known events seen on its pages, and the timestamp of the oldest event fetched.
+        self._known_seen = {}
+        self._oldest_fetched = {}
+        self._database_events = None
+        self.reuse_details = reuse_details
+        # Event id -> (fingerprint, details) of the events in the database, for `reuse_details`.
+        self._cached_details = {}
+        self.reused_detail = 0
 
         output_path.mkdir(parents=True, exist_ok=True)
 
@@ -79,14 +332,30 @@ class Timeline:
             self.finish_timeline_details()
             return
 
+        if (self.incremental or self.reuse_details) and self.store_event_database:
+            self._database_events = self._read_event_database(self.event_database)
+        if self.incremental and self._database_events:
+            self._known_events = {event["id"]: event["timestamp"] for event in self._database_events}
+            self.log.info(f"Incremental sync: {len(self._known_events)} events known from the event database.")
+        if self.reuse_details and self._database_events:
+            self._cached_details = {
+                event["id"]: (detail_fingerprint(event), event["details"])
+                for event in self._database_events
+                if event.get("details")
+            }
+
         await self.get_next_timeline_transactions(None)
+        await self.get_next_timeline_activity_log(None)
 
         while not self.dl_done:
             try:
-                _, subscription, response = await self.tr.recv()
+                subscription_id, subscription, response = await self.tr.recv()
             except TradeRepublicError as e:
                 self.log.error(f'Error response for subscription "{e.subscription}".')
-                subscriptionid = e.subscription["id"]
+                if e.subscription.get("type") == "timelineDetailV2":
+                    self.detail_window.on_error()
+                # Timeline pages have a cursor instead of an id.
+                subscriptionid = e.subscription.get("id") or json.dumps(e.subscription, sort_keys=True)
                 curct = self.error_counts.get(subscriptionid, 0)
                 self.log.error(f'Errorcount for subscription {subscriptionid} is {curct}".')
                 if curct < 3:
@@ -100,6 +369,10 @@ class Timeline:
                     )
                     subscription = e.subscription
                     response = {}
+            else:
+                # Every page and detail is needed once. Unsubscribing keeps the server from pushing updates for it
+                # and keeps it from being subscribed again when the connection has to be re-established.
+                await self.tr.unsubscribe(subscription_id)
 
             if subscription.get("type", "") == "timelineTransactions":
                 await self.get_next_timeline_transactions(response)
@@ -117,98 +390,114 @@ class Timeline:
         Get timeline transactions and store them in list timeline_transactions
         """
         if response is None:
-            # empty response / first timeline
             self.log.info("Timeline transactions: Subscribing to #1...")
-            self.num_timelines = 0
             await self.tr.timeline_transactions()
-        else:
-            self.num_timelines += 1
-            added_last_event = False
-            for event in response["items"]:
-                event_timestamp = datetime.fromisoformat(event["timestamp"][:19]).timestamp()
-                if event_timestamp > self.not_before:
-                    if event_timestamp < self.not_after:
-                        event["source"] = "timelineTransaction"
-                        self.timeline_transactions[event["id"]] = event
-                    added_last_event = True
-                else:
-                    break
-
-            after = response["cursors"].get("after")
-            if (after is not None) and added_last_event:
-                self.log.info(
-                    f"Timeline transactions: Received #{self.num_timelines}, subscribing to #{self.num_timelines + 1}..."
-                )
-                await self.tr.timeline_transactions(after)
-            else:
-                # last timeline is reached
-                self.log.info(f"Timeline transactions: Received #{self.num_timelines} (last relevant).")
-                if self.dump_raw_data:
-                    with (self.output_path / "timeline_transactions.json").open("w") as f:
-                        json.dump(list(self.timeline_transactions.values()), f, indent=2)
-                await self.get_next_timeline_activity_log(None)
+            return
+        after = await self._process_timeline_page("timelineTransaction", self.timeline_transactions, response)
+        if after is not None:
+            await self.tr.timeline_transactions(after)
 
     async def get_next_timeline_activity_log(self, response):
         """
         Get timeline acvtivity log events and store them in list timeline_activities
         """
         if response is None:
-            # empty response / first timeline
             self.log.info("Timeline activity log: Subscribing to #1...")
-            self.num_timelines = 0
             await self.tr.timeline_activity_log()
-        else:
-            self.num_timelines += 1
-            added_last_event = False
-            for event in response["items"]:
-                event_timestamp = datetime.fromisoformat(event["timestamp"][:19]).timestamp()
-                if event_timestamp > self.not_before:
-                    if event_timestamp < self.not_after:
-                        event["source"] = "timelineActivity"
-                        self.timeline_activities[event["id"]] = event
-                    added_last_event = True
-                else:
-                    break
+            return
+        after = await self._process_timeline_page("timelineActivity", self.timeline_activities, response)
+        if after is not None:
+            await self.tr.timeline_activity_log(after)
 
-            after = response["cursors"].get("after")
-            if (after is not None) and added_last_event:
-                self.log.info(
-                    f"Timeline activity log: Received #{self.num_timelines}, subscribing to #{self.num_timelines + 1}..."
-                )
-                await self.tr.timeline_activity_log(after)
+    async def _process_timeline_page(self, source, events, response):
+        """
+        Store the events of a page of the `source` timeline in `events` and request their details. Return the
+        cursor of the next page, None if this was the last relevant one. A page `tl_loop` gave up on after repeated
+        errors comes as an empty `response` and ends the timeline.
+        """
+        name = "Timeline transactions" if source == "timelineTransaction" else "Timeline activity log"
+        self._pages[source] += 1
+        added_last_event = False
+        for event in response.get("items", []):
+            event_timestamp = event_epoch(event)
+            if event_timestamp > self.not_before:
+                if event_timestamp < self.not_after:
+                    event["source"] = source
+                    events[event["id"]] = event
+                    self._note_fetched(source, event, event_timestamp)
+                    self._add_timeline_detail(event)
+                added_last_event = True
             else:
-                self.log.info(f"Timeline activity log: Received #{self.num_timelines} (last relevant).")
-                if self.dump_raw_data:
-                    with (self.output_path / "timeline_activities.json").open("w") as f:
-                        json.dump(list(self.timeline_activities.values()), f, indent=2)
+                break
+        if self._reached_known_events(source):
+            added_last_event = False
 
-                duplicates = set(self.timeline_transactions) & set(self.timeline_activities)
-                if duplicates:
-                    self.log.warning(f"Received duplicate events: {', '.join(duplicates)}")
+        after = response.get("cursors", {}).get("after")
+        if (after is not None) and added_last_event:
+            self.log.info(f"{name}: Received #{self._pages[source]}, subscribing to #{self._pages[source] + 1}...")
+            await self.request_more_timeline_details()
+            return after
+
+        # last timeline is reached
+        self.log.info(f"{name}: Received #{self._pages[source]} (last relevant).")
+        if self.dump_raw_data:
+            filename = "timeline_transactions.json" if source == "timelineTransaction" else "timeline_activities.json"
+            with (self.output_path / filename).open("w") as f:
+                json.dump(list(events.values()), f, indent=2)
+        self._listing.discard(source)
+        if not self._listing:
+            duplicates = set(self.timeline_transactions) & set(self.timeline_activities)
+            if duplicates:
+                self.log.warning(f"Received duplicate events: {', '.join(duplicates)}")
+        await self.request_more_timeline_details()
+        self.finish_if_done()
+        return None
 
-                self.timeline_details = {**self.timeline_transactions, **self.timeline_activities}
+    def _add_timeline_detail(self, event):
+        # An event in both timelines is requested once, with the activity log's version of it winning as before.
+        known = self.timeline_details.get(event["id"])
+        if known is not None and event["source"] != "timelineActivity":
+            return
+        self.timeline_details[event["id"]] = event
+        if known is None:
+            self.all_detail += 1
+            self.detail_digits = len(str(self.all_detail))
+            self._pending_details.append(event["id"])
+        elif event["id"] in self._event_indices:
+            # The transaction's version is done with already: the activity log's takes its place, with its details.
+            if "details" in known:
+                event["details"] = known["details"]
+            self.events[self._event_indices[event["id"]]] = event
+
+    def _add_event(self, event):
+        self._event_indices[event["id"]] = len(self.events)
+        self.events.append(event)
+
+    def _note_fetched(self, source, event, event_timestamp):
+        if event_timestamp < self._oldest_fetched.get(source, float("inf")):
+            self._oldest_fetched[source] = event_timestamp
+        if self._known_events.get(event["id"]) == event["timestamp"]:
+            self._known_seen[source] = self._known_seen.get(source, 0) + 1
 
-                self.request_timeline_details_generator = self._request_timeline_details()
-                try:
-                    await self.request_timeline_details_generator.__anext__()
-                except StopAsyncIteration:
-                    pass
+    def _reached_known_events(self, source):
+        if not self._known_events or self._known_seen.get(source, 0) < self.incremental_margin:
+            return False
+        self.log.info(f"Incremental sync: reached {self._known_seen[source]} known events, not paging further.")
+        return True
 
-    async def _request_timeline_details(self):
+    async def request_more_timeline_details(self):
         """
-        request timeline details
+        request timeline details until the window of requests awaiting a response is full
         """
-        self.all_detail = len(self.timeline_details.values())
-        self.detail_digits = len(str(self.all_detail))
-
-        for event in self.timeline_details.values():
+        while self._pending_details and len(self._inflight_details) < self.detail_window.limit:
+            event = self.timeline_details[self._pending_details.popleft()]
             self.requested_detail += 1
 
             action = event.get("action")
             action_type = action.get("type") if action is not None else None
             if action_type != "timelineDetail":
                 self.received_detail += 1
-                self.events.append(event)
+                self._add_event(event)
                 self.log.info(
                     f"{self.received_detail + self.skipped_detail:>{self.detail_digits}}/{self.all_detail}: "
                     f"{event['title']} -- {event['subtitle']} - {event['timestamp'][:19]}"
@@ -216,33 +505,29 @@ class Timeline:
                 )
             elif action.get("payload") != event["id"]:
                 self.received_detail += 1
-                self.events.append(event)
+                self._add_event(event)
                 self.log.warning(
                     f"{self.received_detail + self.skipped_detail:>{self.detail_digits}}/{self.all_detail}: "
                     f"{event['title']} -- {event['subtitle']} - {event['timestamp'][:19]}"
                     f" (action payload {action['payload']!r} does not match event id {event['id']!r})"
                 )
                 self.log.debug("payload mismatch: %s", json.dumps(event, indent=2))
+            elif self._cached_details.get(event["id"], (None,))[0] == detail_fingerprint(event):
+                self.received_detail += 1
+                self.reused_detail += 1
+                event["details"] = self._cached_details[event["id"]][1]
+                self.log.info(
+                    f"{self.received_detail + self.skipped_detail:>{self.detail_digits}}/{self.all_detail}: "
+                    f"{event['title']} -- {event['subtitle']} - {event['timestamp'][:19]} (from the event database)"
+                )
+                self._add_event(event)
+                self.event_callback(event)
             else:
+                self._inflight_details[event["id"]] = time.monotonic()
                 await self.tr.timeline_detail_v2(event["id"])
-
-            if self.requested_detail % MAX_EVENT_REQUEST_BATCH == 0 and (
-                (self.received_detail + self.skipped_detail) < self.requested_detail
-            ):
-                self.log.info(f"Requested {self.requested_detail}/{self.all_detail} timeline details.")
-                yield
-
-        self.log.info(f"Requested all timeline details ({self.requested_detail}/{self.all_detail}).")
-        self.finish_if_done()
-
-    async def request_more_timeline_details(self):
-        if self.requested_detail == self.all_detail:
-            return
-        if (self.received_detail + self.skipped_detail) == self.requested_detail:
-            try:
-                await self.request_timeline_details_generator.__anext__()
-            except StopAsyncIteration:
-                pass
+        if not self._listing and not self._pending_details and not self._requested_all_details:
+            self._requested_all_details = True
+            self.log.info(f"Requested all timeline details ({self.requested_detail}/{self.all_detail}).")
 
     async def process_timelineDetail(self, response, subscription_id):
         """
@@ -250,6 +535,9 @@ class Timeline:
         """
 
         event = self.timeline_details.get(subscription_id)
+        requested_at = self._inflight_details.pop(subscription_id, None)
+        if requested_at is not None and response:
+            self.detail_window.on_response(time.monotonic() - requested_at)
 
         if event is None:
             self.log.warning(f"Ignoring unrequested event response {json.dumps(response, indent=2)}")
@@ -264,124 +552,111 @@ class Timeline:
             f"{self.received_detail + self.skipped_detail:>{self.detail_digits}}/{self.all_detail}: "
             + f"{event['title']} -- {event['subtitle']} - {event['timestamp'][:19]}"
         )
-        self.events.append(event)
+        self._add_event(event)
         self.event_callback(event)
 
         await self.request_more_timeline_details()
         self.finish_if_done()
 
     def finish_if_done(self):
-        if self.requested_detail != self.all_detail:
+        if self._listing or self.requested_detail != self.all_detail:
             return
         if (self.received_detail + self.skipped_detail) == self.requested_detail:
             self.finish_timeline_details()
 
-    def finish_timeline_details(self):
-        if self.fetch_from_tr:
-            self.log.info("Received all event details.")
-            if self.skipped_detail > 0:
-                self.log.warning(f"Skipped {self.skipped_detail} unsupported events")
+    def _read_event_database(self, database):
+        """All events in `database`."""
+        if not database.exists():
+            return []
+        self.log.info(f"Loading event database from {database}...")
+        events = []
+        try:
+            events = database.read()
+        except ValueError:
+            self.log.warning(f"Event database file is empty or invalid: {database}")
+        if not events:
+            self.log.warning("No events found in event database.")
+        return events
+
+    def _stream_event_database(self, database):
+        """The events of `database` in the range to replay, in time order, read anew on every call."""
+        if not database.exists():
+            if self.load_event_database is not None:
+                self.log.warning(f"Event database file not found: {database}")
+            return
+        try:
+            yield from database.stream(self.not_before, self.not_after)
+        except ValueError:
+            self.log.warning(f"Event database file is empty or invalid: {database}")
+
+    def _replay_event_database(self):
+        """
+        Hand the events with details in the range to `event_callback`, streamed from the event database, and make
+        `events` stream all events in the range again, so that the events are never all held in memory.
+        """
+        if self.load_event_database is not None:
+            database = open_event_database(self.load_event_database)
+        elif self.store_event_database:
+            database = self.event_database
         else:
+            return
+        self.events = StreamedEvents(lambda: self._stream_event_database(database))
+        self.log.info(f"Replaying events from {database}...")
+        self.all_detail = 0
+        total = 0
+        for event in self.events:
+            total += 1
+            if "details" in event:
+                self.all_detail += 1
+                self.event_callback(event)
+        if not total:
+            self.log.warning("No events found in event database.")
+        self.log.info(f"Replayed {self.all_detail} events from database (out of {total} in the range).")
+
+    def _was_refetched(self, event, ts):
+        """Whether the pages fetched reached back to `event`, so that its absence there means it is gone."""
+        if not self.incremental:
+            return True
+        return ts >= self._oldest_fetched.get(event.get("source"), float("inf"))
+
+    def finish_timeline_details(self):
+        if not self.fetch_from_tr:
             self.log.info("Skip fetching data from TR.")
+            self._replay_event_database()
+            self.dl_done = True
+            return
 
-        if self.store_event_database or self.load_event_database is not None:
-            # read old events from all_events.json (or explicit --load-event-database path)
-            old_events = []
-            all_events_path = (
-                self.load_event_database
-                if self.load_event_database is not None
-                else self.output_path / "all_events.json"
-            )
-            if all_events_path.exists():
-                self.log.info(f"Loading event database from {all_events_path}...")
-                with open(all_events_path, "r", encoding="utf-8") as f:
-                    try:
-                        old_events = json.load(f)
-                    except json.JSONDecodeError:
-                        self.log.warning(f"Event database file is empty or invalid: {all_events_path}")
-                if not old_events:
-                    self.log.warning("No events found in event database.")
-            elif self.load_event_database is not None:
-                self.log.warning(f"Event database file not found: {all_events_path}")
+        self.log.info("Received all event details.")
+        if self.reused_detail > 0:
+            self.log.info(f"Took the details of {self.reused_detail} unchanged events from the event database.")
+        if self.skipped_detail > 0:
+            self.log.warning(f"Skipped {self.skipped_detail} unsupported events")
+
+        if self.store_event_database:
+            # read old events from the event database
+            database = self.event_database
+            if self._database_events is not None:
+                old_events = self._database_events
+            else:
+                old_events = self._read_event_database(database)
 
             # if we have new data from a certain period, throw out old data
-            if self.fetch_from_tr and (self.not_before != 0 or self.not_after != float("inf")):
+            if self.not_before != 0 or self.not_after != float("inf"):
                 self.log.info("Throwing away outdated events...")
                 for i in range(len(old_events) - 1, -1, -1):
-                    ts = datetime.fromisoformat(old_events[i]["timestamp"][:19]).timestamp()
-                    if ts > self.not_before and ts < self.not_after:
+                    ts = event_epoch(old_events[i])
+                    if ts > self.not_before and ts < self.not_after and self._was_refetched(old_events[i], ts):
                         del old_events[i]
 
             # merge new and old events
             if old_events:
-                cur_events = {}
-
-                # drop duplicates in old events
-                if old_events:
-                    if self.scan_for_duplicates:
-                        self.log.info("Adding old events (scanning for duplicates)...")
-                        for event in old_events:
-                            idtodel = None
-                            for id in cur_events:
-                                cur_event = cur_events[id]
-                                if is_likely_same_but_newer(event, cur_event):
-                                    self.log.warning(
-                                        f"Dropping potential duplicate event {id} from {cur_event['timestamp']} due to newer event {event['id']} from {event['timestamp']}."
-                                    )
-                                    idtodel = id
-                                    break
-                            if idtodel is not None:
-                                cur_events.pop(idtodel)
-                            cur_events[event["id"]] = event
-                    else:
-                        self.log.info("Adding old events...")
-                        for event in old_events:
-                            cur_events[event["id"]] = event
-
-                # add new events
-                if self.events:
-                    if self.scan_for_duplicates:
-                        self.log.info("Adding new events (scanning for duplicates)...")
-                        for event in self.events:
-                            idtodel = None
-                            for id in cur_events:
-                                cur_event = cur_events[id]
-                                if event["id"] != id and is_likely_same_but_newer(event, cur_event):
-                                    self.log.warning(
-                                        f"Dropping existing event {id} from {cur_event['timestamp']} due to newer event {event['id']} from {event['timestamp']}."
-                                    )
-                                    idtodel = id
-                                    break
-                            if idtodel is not None:
-                                cur_events.pop(idtodel)
-                            cur_events[event["id"]] = event
-                    else:
-                        self.log.info("Adding new events...")
-                        for event in self.events:
-                            cur_events[event["id"]] = event
-
-                self.events = list(cur_events.values())
+                self.events = merge_events(old_events, self.events, self.log, self.scan_for_duplicates)
 
             self.log.info("Sorting events...")
-            self.events.sort(key=lambda value: datetime.fromisoformat(value["timestamp"][:19]))
-
-            if self.fetch_from_tr and self.store_event_database:
-                self.log.info(f"Writing {all_events_path}...")
-                with open(all_events_path, "w", encoding="utf-8") as f:
-                    json.dump(self.events, f, ensure_ascii=False, indent=2, default=str)
-                self.log.info("Updated event database.")
+            self.events.sort(key=event_epoch)
 
-        if not self.fetch_from_tr:
-            filtered = [
-                e
-                for e in self.events
-                if "details" in e
-                and datetime.fromisoformat(e["timestamp"][:19]).timestamp() >= self.not_before
-                and datetime.fromisoformat(e["timestamp"][:19]).timestamp() <= self.not_after
-            ]
-            self.log.info(f"Replaying {len(filtered)} events from database (out of {len(self.events)} total)...")
-            self.all_detail = len(filtered)
-            for event in filtered:
-                self.event_callback(event)
+            self.log.info(f"Writing {database}...")
+            database.write(self.events)
+            self.log.info("Updated event database.")
 
         self.dl_done = True
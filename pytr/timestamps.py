@@ -0,0 +1,36 @@
+"""
+Parsed timeline timestamps, shared by everything that looks at `event["timestamp"]`.
+
+The same timestamp is looked at many times in a run: when paging the timeline, when throwing away outdated events,
+as the sort key of the event database, when replaying it and when naming documents. Parsing is the expensive part,
+so every timestamp string is parsed once and the results are kept by the string. The event dicts themselves stay as
+the server sent them, they are written to the event database.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+
+# Enough for the event database of a long-standing account, and bounded for processes that run for long.
+_CACHE_SIZE = 2**17
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def epoch(timestamp: str) -> float:
+    """
+    The seconds since the epoch of a timeline timestamp like "2024-05-01T10:00:00.123+0000", of its date and time
+    without fractions and time zone in local time, as pytr has compared them against `--not-before` and
+    `--not-after`.
+    """
+    return datetime.fromisoformat(timestamp[:19]).timestamp()
+
+
+def event_epoch(event) -> float:
+    return epoch(event["timestamp"])
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def parse(timestamp: str) -> datetime:
+    """The aware datetime of a timeline timestamp, whose offset may be written as "+0000" or "+00:00"."""
+    if timestamp[-3] != ":":
+        timestamp = timestamp[:-2] + ":" + timestamp[-2:]
+    return datetime.fromisoformat(timestamp)
@@ -7,25 +7,11 @@ from typing import Any, Iterable, Literal, Optional, TextIO, TypedDict, Union
 
 from babel.numbers import format_decimal
 
+from .constants import SUPPORTED_LANGUAGES
 from .event import ConditionalEventType, Event, PPEventType
 from .translation import setup_translation
 from .utils import get_logger
 
-SUPPORTED_LANGUAGES = {
-    "cs",
-    "da",
-    "de",
-    "en",
-    "es",
-    "fr",
-    "it",
-    "nl",
-    "pl",
-    "pt",
-    "ru",
-    "zh",
-}
-
 CSVCOLUMN_TO_TRANSLATION_KEY = {
     "date": "CSVColumn_Date",
     "type": "CSVColumn_Type",
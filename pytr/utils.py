@@ -4,8 +4,6 @@ import json
 import logging
 
 import coloredlogs  # type: ignore[import-untyped]
-import requests
-from packaging import version
 
 log_level = None
 debug_logfile_handler = None
@@ -97,6 +95,16 @@ def get_logger(name=__name__, verbosity=None, debug_file=None, debug_filter=None
     return logger
 
 
+def debug_enabled(logger):
+    """
+    Whether any handler of `logger` would emit a debug record.
+
+    pytr's loggers are set to DEBUG themselves and leave the filtering to their handlers, so `logger.isEnabledFor`
+    cannot answer this.
+    """
+    return any(handler.level <= logging.DEBUG for handler in logger.handlers)
+
+
 def preview(response, num_lines=5):
     lines = json.dumps(response, indent=2).splitlines()
     head = "\n".join(lines[:num_lines])
@@ -109,6 +117,9 @@ def preview(response, num_lines=5):
 
 
 def check_version(installed_version):
+    import requests
+    from packaging import version
+
     log = get_logger(__name__)
     try:
         r = requests.get("https://api.github.com/repos/pytr-org/pytr/tags", timeout=1)
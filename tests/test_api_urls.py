@@ -1,14 +1,18 @@
 """Pin the web login endpoints, their required headers and the login process state machine."""
 
+import asyncio
 import base64
 import json as jsonlib
 import re
+import threading
+import time
+from http.cookiejar import CookieJar, MozillaCookieJar
 from typing import Any
 
 import pytest
 import requests
 
-from pytr.api import TradeRepublicApi
+from pytr.api import SessionExpiredError, TradeRepublicApi
 
 LOGIN = "https://api.traderepublic.com/api/v2/auth/web/login"
 PROCESS = "https://api.traderepublic.com/api/v2/auth/web/login/processes/pid-1"
@@ -22,6 +26,7 @@ class _Response:
     def __init__(self, url: str, payload: Any = None, status_code: int = 200):
         self.url = url
         self.status_code = status_code
+        self.headers = {"server": "awselb/2.0"} if status_code == 405 else {}
         self._payload = {} if payload is None else payload
 
     def raise_for_status(self) -> None:
@@ -32,6 +37,10 @@ class _Response:
     def json(self) -> Any:
         return self._payload
 
+    @property
+    def text(self) -> str:
+        return jsonlib.dumps(self._payload)
+
 
 class _Session:
     """Records requests instead of sending them. Replies come from a queue."""
@@ -275,3 +284,322 @@ def test_settings_stays_on_v2_account_and_v1_session():
         "https://api.traderepublic.com/api/v1/auth/web/session",
         "https://api.traderepublic.com/api/v2/auth/account",
     ]
+
+
+# --- REST calls ----------------------------------------------------------------------
+
+
+def test_rest_calls_go_through_the_web_session_and_refresh_it_once():
+    tr = _api([{}, {"processId": "pay-1"}, {}, {}])
+    tr._session_expires_at = 0
+
+    assert tr.payout(10) == {"processId": "pay-1"}
+    tr.order_cost("DE0007164600", "LSX", "buy", "market", 1, False)
+    tr.savings_plan_cost("DE0007164600", 25, "monthly")
+    tr._session_refresh_timer.cancel()
+
+    assert _urls(tr) == [
+        "https://api.traderepublic.com/api/v1/auth/web/session",
+        "https://api.traderepublic.com/api/v1/payout",
+        "https://api.traderepublic.com/api/v1/user/costtransparency?instrumentId=DE0007164600&exchangeId=LSX"
+        "&mode=buy&type=market&size=1&sellFractions=False",
+        "https://api.traderepublic.com/api/v1/user/savingsplancosttransparency?instrumentId=DE0007164600"
+        "&amount=25&interval=monthly",
+    ]
+
+
+def test_async_cost_lookups_run_concurrently_on_the_web_session():
+    tr = _api([])
+    tr._session_expires_at = float("inf")
+
+    async def lookup():
+        return await asyncio.gather(*(tr.savings_plan_cost_async(isin, 25, "monthly") for isin in ("A", "B", "C")))
+
+    asyncio.run(lookup())
+
+    assert sorted(_urls(tr)) == [
+        f"https://api.traderepublic.com/api/v1/user/savingsplancosttransparency?instrumentId={isin}"
+        "&amount=25&interval=monthly"
+        for isin in ("A", "B", "C")
+    ]
+
+
+def test_concurrent_requests_on_an_expired_session_refresh_it_once():
+    tr = _api([])
+    tr._session_expires_at = 0
+    session_get = tr._websession.get
+
+    def slow_get(url, headers=None):
+        time.sleep(0.05)
+        return session_get(url, headers)
+
+    tr._websession.get = slow_get
+
+    async def lookup():
+        return await asyncio.gather(*(tr.savings_plan_cost_async(isin, 25, "monthly") for isin in ("A", "B", "C")))
+
+    asyncio.run(lookup())
+    tr._session_refresh_timer.cancel()
+
+    assert _urls(tr).count("https://api.traderepublic.com/api/v1/auth/web/session") == 1
+    assert len(_urls(tr)) == 4
+
+
+def test_background_refresh_only_keeps_a_used_session_alive():
+    tr = _api([{}, {}])
+    tr._session_expires_at = 0
+    tr.settings()
+    tr._session_refresh_timer.cancel()
+
+    tr._refresh_websession_in_background()
+    tr._session_refresh_timer.cancel()
+    tr._last_web_request = 0
+    tr._refresh_websession_in_background()
+
+    assert _urls(tr) == [
+        "https://api.traderepublic.com/api/v1/auth/web/session",
+        "https://api.traderepublic.com/api/v2/auth/account",
+        "https://api.traderepublic.com/api/v1/auth/web/session",
+    ]
+    assert tr._session_refresh_timer is None
+
+
+# --- WAF token cache ---------------------------------------------------------------
+
+
+def _waf_api(tmp_path, replies, tokens):
+    tr = TradeRepublicApi(
+        phone_no="+490000000000",
+        pin="0000",
+        save_cookies=True,
+        cookies_file=tmp_path / "cookies.txt",
+        waf_token="awswaf",
+        use_v2_login=True,
+    )
+    tr._websession = _Session(replies)
+    tr._websession.cookies = CookieJar()
+    fetched = iter(tokens)
+    tr._fetch_waf_token_awswaf = lambda: next(fetched)
+    return tr
+
+
+def test_a_cached_waf_token_is_reused_by_the_next_login(tmp_path):
+    _waf_api(tmp_path, [{"processId": "pid-1"}, {}], ["token-1"]).initiate_weblogin()
+
+    tr = _waf_api(tmp_path, [{"processId": "pid-2"}, {}], [])
+    tr.initiate_weblogin()
+
+    assert tr._waf_token == "token-1"
+    assert [cookie.value for cookie in tr._websession.cookies] == ["token-1"]
+    assert (tmp_path / "waf_tokens.json").stat().st_mode & 0o777 == 0o600
+
+
+def test_an_expiring_waf_token_is_fetched_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(TradeRepublicApi, "_waf_token_ttl", 30)
+    _waf_api(tmp_path, [{"processId": "pid-1"}, {}], ["token-1"]).initiate_weblogin()
+
+    tr = _waf_api(tmp_path, [{"processId": "pid-1"}, {}], ["token-2"])
+    tr.initiate_weblogin()
+
+    assert tr._waf_token == "token-2"
+
+
+def test_a_rejected_cached_waf_token_is_replaced(tmp_path):
+    _waf_api(tmp_path, [{"processId": "pid-1"}, {}], ["token-1"]).initiate_weblogin()
+
+    tr = _waf_api(tmp_path, [(405, {}), {"processId": "pid-2"}, {}], ["token-2"])
+    tr.initiate_weblogin()
+
+    assert _urls(tr)[:2] == [LOGIN, LOGIN]
+    assert tr._process_id == "pid-2"
+    assert tr._cached_waf_token("awswaf") == "token-2"
+
+
+def test_waf_tokens_stored_at_the_same_time_are_all_kept(tmp_path):
+    accounts = [
+        TradeRepublicApi(
+            phone_no=f"+49{i}", pin="0000", save_cookies=True, cookies_file=tmp_path / "cookies.txt", waf_token=None
+        )
+        for i in range(8)
+    ]
+
+    def store(tr):
+        for n in range(20):
+            tr._store_waf_token("awswaf", f"token-{n}")
+
+    threads = [threading.Thread(target=store, args=(tr,)) for tr in accounts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [tr._cached_waf_token("awswaf") for tr in accounts] == ["token-19"] * len(accounts)
+
+
+def test_waf_tokens_are_not_cached_without_saved_cookies(tmp_path):
+    tr = _waf_api(tmp_path, [{"processId": "pid-1"}, {}], ["token-1"])
+    tr._save_cookies = False
+    tr.initiate_weblogin()
+
+    assert not (tmp_path / "waf_tokens.json").exists()
+
+
+def _racing_api(awswaf, playwright, hedge_delay=0.05):
+    tr = TradeRepublicApi(phone_no="+490000000000", pin="0000", waf_token="race", use_v2_login=True)
+    tr._waf_race_hedge_delay = hedge_delay
+    tr._fetch_waf_token_awswaf = awswaf
+    tr._fetch_waf_token_playwright = playwright
+    return tr
+
+
+def test_race_takes_a_quick_awswaf_token_without_starting_playwright():
+    started = []
+
+    def playwright(stop):
+        started.append("playwright")
+        return "browser-token"
+
+    tr = _racing_api(lambda stop: "awswaf-token", playwright, hedge_delay=5)
+
+    assert tr._fetch_waf_token_race() == "awswaf-token"
+    assert started == []
+
+
+def test_race_hedges_a_slow_awswaf_with_playwright_and_stops_the_loser():
+    stopped = threading.Event()
+
+    def awswaf(stop):
+        if stop.wait(5):
+            stopped.set()
+        return None
+
+    tr = _racing_api(awswaf, lambda stop: "browser-token")
+
+    assert tr._fetch_waf_token_race() == "browser-token"
+    assert stopped.wait(5)
+
+
+def test_race_falls_back_to_playwright_when_awswaf_fails():
+    def awswaf(stop):
+        raise ValueError("challenge changed")
+
+    tr = _racing_api(awswaf, lambda stop: "browser-token", hedge_delay=5)
+
+    assert tr._fetch_waf_token_race() == "browser-token"
+
+
+def test_race_without_any_token_returns_none():
+    tr = _racing_api(lambda stop: None, lambda stop: None)
+
+    assert tr._fetch_waf_token_race() is None
+
+
+# --- validated sessions ---------------------------------------------------------------
+
+SESSION = "https://api.traderepublic.com/api/v1/auth/web/session"
+ACCOUNT = "https://api.traderepublic.com/api/v2/auth/account"
+
+
+def _saved_session_api(tmp_path, replies):
+    tr = TradeRepublicApi(
+        phone_no="+490000000000", pin="0000", save_cookies=True, cookies_file=tmp_path / "cookies.txt", waf_token=None
+    )
+    tr._websession = _Session(replies)
+    tr._websession.cookies = MozillaCookieJar(tmp_path / "cookies.txt")
+    tr._websession.cookies.save()
+    return tr
+
+
+def test_a_recently_validated_session_resumes_without_requests(tmp_path):
+    first = _saved_session_api(tmp_path, [{}, {}])
+    assert first.resume_websession()
+    first._session_refresh_timer.cancel()
+
+    tr = _saved_session_api(tmp_path, [])
+
+    assert tr.resume_websession()
+    assert _urls(first) == [SESSION, ACCOUNT]
+    assert _urls(tr) == []
+
+
+def test_instances_storing_validations_at_the_same_time_keep_each_others(tmp_path):
+    accounts = [
+        TradeRepublicApi(
+            phone_no=f"+49{i}", pin="0000", save_cookies=True, cookies_file=tmp_path / "cookies.txt", waf_token=None
+        )
+        for i in range(8)
+    ]
+
+    def store(tr):
+        for _ in range(20):
+            tr._store_session_validation(time.time())
+
+    threads = [threading.Thread(target=store, args=(tr,)) for tr in accounts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    sessions = jsonlib.loads((tmp_path / "sessions.json").read_text())
+    assert sorted(sessions) == sorted(tr.phone_no for tr in accounts)
+    assert [path.name for path in tmp_path.iterdir()] == ["sessions.json"]
+
+
+def test_an_expiring_validation_is_checked_again(tmp_path):
+    first = _saved_session_api(tmp_path, [{}, {}])
+    first.resume_websession()
+    first._session_refresh_timer.cancel()
+    sessions = jsonlib.loads((tmp_path / "sessions.json").read_text())
+    sessions["+490000000000"]["expires"] = time.time() + 10
+    (tmp_path / "sessions.json").write_text(jsonlib.dumps(sessions))
+
+    tr = _saved_session_api(tmp_path, [{}, {}])
+    tr.resume_websession()
+    tr._session_refresh_timer.cancel()
+
+    assert _urls(tr) == [SESSION, ACCOUNT]
+
+
+def test_an_auth_error_on_an_unchecked_session_refreshes_it_and_retries(tmp_path):
+    first = _saved_session_api(tmp_path, [{}, {}])
+    first.resume_websession()
+    first._session_refresh_timer.cancel()
+
+    tr = _saved_session_api(tmp_path, [(401, {}), {}, {"securitiesAccountNumber": "1"}])
+    tr.resume_websession()
+    settings = tr.settings()
+    tr._session_refresh_timer.cancel()
+
+    assert _urls(tr) == [ACCOUNT, SESSION, ACCOUNT]
+    assert settings == {"securitiesAccountNumber": "1"}
+
+
+def test_an_unchecked_session_that_cannot_be_refreshed_logs_in_again(tmp_path):
+    first = _saved_session_api(tmp_path, [{}, {}])
+    first.resume_websession()
+    first._session_refresh_timer.cancel()
+
+    tr = _saved_session_api(tmp_path, [(401, {}), (401, {}), {}])
+    relogins = []
+    tr._relogin = lambda: relogins.append(True)
+    tr.resume_websession()
+    tr.settings()
+
+    assert relogins == [True]
+    assert _urls(tr) == [ACCOUNT, SESSION, ACCOUNT]
+
+
+def test_an_unchecked_session_that_cannot_be_refreshed_off_the_main_thread_raises(tmp_path):
+    first = _saved_session_api(tmp_path, [{}, {}])
+    first.resume_websession()
+    first._session_refresh_timer.cancel()
+
+    tr = _saved_session_api(tmp_path, [(401, {}), (401, {})])
+    relogins = []
+    tr._relogin = lambda: relogins.append(True)
+    tr.resume_websession()
+
+    with pytest.raises(SessionExpiredError):
+        asyncio.run(asyncio.to_thread(tr.settings))
+    assert relogins == []
+    assert not list(tr._websession.cookies)
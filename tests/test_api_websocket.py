@@ -0,0 +1,349 @@
+"""Drive TradeRepublicApi's websocket layer against an in-memory stand-in for the Trade Republic server."""
+
+import asyncio
+import json
+
+import pytest
+import websockets
+
+import pytr.api
+from pytr.api import TradeRepublicApi, TradeRepublicError
+
+_DROP = object()
+
+
+class _FakeWebSocket:
+    """Answers `sub` frames with whatever `respond` returns for their payload."""
+
+    def __init__(self, respond):
+        self.sent: list[str] = []
+        self.close_code = None
+        self._respond = respond
+        self._frames: asyncio.Queue = asyncio.Queue()
+        self._frames.put_nowait("connected")
+
+    async def send(self, message):
+        self.sent.append(message)
+        if message.startswith("sub "):
+            _, subscription_id, payload = message.split(" ", 2)
+            for frame in self._respond(json.loads(payload)):
+                self.push(f"{subscription_id} {frame}")
+
+    def push(self, frame):
+        self._frames.put_nowait(frame)
+
+    def drop(self):
+        """Make the connection fail once the frames pushed so far are read."""
+        self._frames.put_nowait(_DROP)
+
+    async def recv(self):
+        frame = await self._frames.get()
+        if frame is _DROP:
+            self.close_code = 1006
+            raise websockets.ConnectionClosedError(None, None)
+        return frame
+
+    async def close(self):
+        self.close_code = 1000
+
+
+def _api(monkeypatch, respond):
+    sockets: list[_FakeWebSocket] = []
+
+    async def connect(*args, **kwargs):
+        sockets.append(_FakeWebSocket(respond))
+        return sockets[-1]
+
+    monkeypatch.setattr(pytr.api.websockets, "connect", connect)
+    tr = TradeRepublicApi(phone_no="+490000000000", pin="0000", waf_token=None)
+    return tr, sockets
+
+
+def _echo(payload):
+    return [f"A {json.dumps({'echo': payload['id']})}"]
+
+
+def test_recv_returns_frames_of_plain_subscriptions(monkeypatch):
+    tr, _ = _api(monkeypatch, _echo)
+
+    async def run():
+        subscription_id = await tr.subscribe({"type": "instrument", "id": "X"})
+        result = await tr.recv()
+        await tr.close()
+        return subscription_id, result
+
+    subscription_id, (received_id, subscription, payload) = asyncio.run(run())
+
+    assert received_id == subscription_id
+    assert subscription == {"type": "instrument", "id": "X"}
+    assert payload == {"echo": "X"}
+
+
+def test_streams_only_see_their_own_frames(monkeypatch):
+    tr, _ = _api(monkeypatch, _echo)
+
+    async def consume(isin):
+        async with tr.stream({"type": "instrument", "id": isin}) as instrument:
+            return await instrument.get()
+
+    async def run():
+        results = await asyncio.gather(*(consume(isin) for isin in ("A", "B", "C")))
+        await tr.close()
+        return results
+
+    assert asyncio.run(run()) == [{"echo": "A"}, {"echo": "B"}, {"echo": "C"}]
+
+
+def test_stream_frames_do_not_reach_recv(monkeypatch):
+    tr, _ = _api(monkeypatch, _echo)
+
+    async def run():
+        async with tr.stream({"type": "instrument", "id": "S"}) as instrument:
+            await tr.subscribe({"type": "instrument", "id": "R"})
+            _, _, from_recv = await tr.recv()
+            from_stream = await instrument.get()
+        await tr.close()
+        return from_recv, from_stream
+
+    assert asyncio.run(run()) == ({"echo": "R"}, {"echo": "S"})
+
+
+def test_stream_iteration_applies_deltas_and_ends_on_complete(monkeypatch):
+    frames = ['A {"price":"10"}', "D =10\t+11\t-2\t=2", "C"]
+    tr, _ = _api(monkeypatch, lambda payload: frames)
+
+    async def run():
+        async with tr.stream({"type": "ticker", "id": "X.LSX"}) as ticker:
+            received = [response async for response in ticker]
+        await tr.close()
+        return received
+
+    assert asyncio.run(run()) == [{"price": "10"}, {"price": "11"}]
+
+
+def test_stream_raises_error_frames(monkeypatch):
+    tr, sockets = _api(monkeypatch, lambda payload: ['E {"errors":[{"errorCode":"NOT_FOUND"}]}'])
+
+    async def run():
+        async with tr.stream({"type": "instrument", "id": "X"}) as instrument:
+            with pytest.raises(TradeRepublicError) as excinfo:
+                await instrument.get()
+        await tr.close()
+        return excinfo.value
+
+    error = asyncio.run(run())
+
+    assert error.error == {"errors": [{"errorCode": "NOT_FOUND"}]}
+    assert sockets[0].sent[-1] == f"unsub {error.subscription_id}"
+
+
+def test_leaving_a_stream_unsubscribes(monkeypatch):
+    tr, sockets = _api(monkeypatch, _echo)
+
+    async def run():
+        async with tr.stream({"type": "instrument", "id": "X"}) as instrument:
+            await instrument.get()
+        await tr.close()
+        return instrument.id
+
+    subscription_id = asyncio.run(run())
+
+    assert sockets[0].sent[-1] == f"unsub {subscription_id}"
+    assert subscription_id not in tr.subscriptions
+
+
+def test_instances_do_not_share_connection_state(monkeypatch):
+    first, _ = _api(monkeypatch, _echo)
+    second = TradeRepublicApi(phone_no="+490000000001", pin="0000", waf_token=None)
+
+    async def run():
+        await first.subscribe({"type": "instrument", "id": "X"})
+        await first.recv()
+        await first.close()
+
+    asyncio.run(run())
+
+    assert first.subscriptions
+    assert first._previous_responses
+    assert second.subscriptions == {}
+    assert second._previous_responses == {}
+    assert second._subscription_id_counter == 1
+
+
+def test_dropped_connection_is_replaced_and_open_subscriptions_resent(monkeypatch):
+    answers = iter([[f"A {json.dumps({'n': 1})}"], [], [f"A {json.dumps({'n': 2})}"]])
+    tr, sockets = _api(monkeypatch, lambda payload: next(answers))
+    tr._reconnect_backoff = 0
+
+    async def run():
+        done = await tr.subscribe({"type": "timelineDetailV2", "id": "1"})
+        await tr.recv()
+        await tr.unsubscribe(done)
+        pending = await tr.subscribe({"type": "timelineDetailV2", "id": "2"})
+        # A baseline from the old connection must not survive into the new one.
+        tr._previous_responses[pending] = "stale"
+        sockets[0].drop()
+        result = await tr.recv()
+        await tr.close()
+        return pending, result
+
+    pending, (received_id, _, payload) = asyncio.run(run())
+
+    assert len(sockets) == 2
+    assert sockets[1].sent[1:] == [f'sub {pending} {{"type": "timelineDetailV2", "id": "2"}}']
+    assert received_id == pending
+    assert payload == {"n": 2}
+    assert tr._previous_responses == {pending: '{"n": 2}'}
+
+
+def test_connection_error_reaches_recv_once_reconnecting_gives_up(monkeypatch):
+    tr, sockets = _api(monkeypatch, lambda payload: [])
+    tr._reconnect_attempts = 0
+
+    async def run():
+        await tr.subscribe({"type": "ticker", "id": "X.LSX"})
+        sockets[0].drop()
+        with pytest.raises(websockets.ConnectionClosed):
+            await tr.recv()
+
+    asyncio.run(run())
+
+
+def test_identical_payloads_share_one_server_subscription(monkeypatch):
+    frames = ['A {"price":"10"}', "D =10\t+11\t-2\t=2"]
+    tr, sockets = _api(monkeypatch, lambda payload: frames)
+    payload = {"type": "ticker", "id": "X.LSX"}
+
+    async def run():
+        async with tr.stream(payload) as first:
+            received = [await first.get(), await first.get()]
+            async with tr.stream(dict(payload)) as second:
+                # Joining late starts from the state the subscription has reached.
+                received.append(await second.get())
+            sent_while_first_listens = list(sockets[0].sent)
+        await tr.close()
+        return received, sent_while_first_listens, first.id, second.id
+
+    received, sent, first_id, second_id = asyncio.run(run())
+
+    assert received == [{"price": "10"}, {"price": "11"}, {"price": "11"}]
+    assert first_id != second_id
+    assert sent[1:] == [f'sub {first_id} {{"type": "ticker", "id": "X.LSX"}}']
+    assert sockets[0].sent[-1] == f"unsub {first_id}"
+    assert tr.subscriptions == {}
+
+
+def test_recv_listeners_of_a_shared_subscription_each_get_their_frames(monkeypatch):
+    tr, sockets = _api(monkeypatch, _echo)
+
+    async def run():
+        first = await tr.subscribe({"type": "instrument", "id": "X"})
+        second = await tr.subscribe({"type": "instrument", "id": "X"})
+        received = [await tr.recv(), await tr.recv()]
+        await tr.unsubscribe(first)
+        await tr.unsubscribe(second)
+        await tr.close()
+        return first, second, received
+
+    first, second, received = asyncio.run(run())
+
+    assert sorted(subscription_id for subscription_id, _, _ in received) == sorted([first, second])
+    assert all(payload == {"echo": "X"} for _, _, payload in received)
+    assert [message for message in sockets[0].sent if message.startswith(("sub ", "unsub "))] == [
+        f'sub {first} {{"type": "instrument", "id": "X"}}',
+        f"unsub {first}",
+    ]
+
+
+def test_identical_actions_each_reach_the_server(monkeypatch):
+    tr, sockets = _api(monkeypatch, lambda payload: [])
+    payload = {"type": "cancelPriceAlarm", "id": "alarm-1"}
+
+    async def run():
+        first = await tr.subscribe(payload)
+        # The first one is still waiting for its answer.
+        second = await tr.subscribe(dict(payload))
+        await tr.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert [message for message in sockets[0].sent if message.startswith("sub ")] == [
+        f'sub {first} {{"type": "cancelPriceAlarm", "id": "alarm-1"}}',
+        f'sub {second} {{"type": "cancelPriceAlarm", "id": "alarm-1"}}',
+    ]
+
+
+def test_blocking_calls_share_one_connection_on_a_background_loop(monkeypatch):
+    tr, sockets = _api(monkeypatch, _echo)
+
+    first = tr.blocking_instrument_details("A")
+    second = tr.blocking_instrument_details("B")
+    tr.close_blocking()
+
+    assert (first, second) == ({"echo": "A"}, {"echo": "B"})
+    assert len(sockets) == 1
+    assert sockets[0].close_code == 1000
+
+
+def test_blocking_gather_returns_every_response_in_order(monkeypatch):
+    tr, sockets = _api(monkeypatch, lambda payload: [] if payload["id"] == "missing" else _echo(payload))
+
+    results = tr.blocking_gather(
+        [tr.instrument_details(isin) for isin in ("A", "missing", "C")], timeout=0.2, return_exceptions=True
+    )
+    tr.close_blocking()
+
+    assert results[0] == {"echo": "A"}
+    assert isinstance(results[1], asyncio.TimeoutError)
+    assert results[2] == {"echo": "C"}
+    assert sum(message.startswith("unsub ") for message in sockets[0].sent) == 3
+
+
+def test_metrics_count_frames_per_subscription_type(monkeypatch):
+    frames = ['A {"price":"10"}', "D =10\t+11\t-2\t=2", "C"]
+    error = 'E {"errors":[{"errorMessage":"Ungültiges Instrument"}]}'
+    tr, _ = _api(monkeypatch, lambda payload: frames if payload["type"] == "ticker" else [error])
+
+    async def run():
+        async with tr.stream({"type": "ticker", "id": "X.LSX"}) as ticker:
+            _ = [response async for response in ticker]
+        async with tr.stream({"type": "instrument", "id": "X"}) as instrument:
+            with pytest.raises(TradeRepublicError):
+                await instrument.get()
+        await tr.close()
+
+    asyncio.run(run())
+    metrics = tr.metrics.as_dict()
+
+    assert metrics["connects"] == 1
+    ticker = metrics["types"]["ticker"]
+    assert ticker["subscriptions"] == 1
+    assert ticker["first_frame_latency"]["count"] == 1
+    assert (ticker["frames"], ticker["full_frames"], ticker["delta_frames"], ticker["completed"]) == (3, 1, 1, 1)
+    assert ticker["bytes"] == sum(len(f"1 {frame}") for frame in frames)
+    assert metrics["types"]["instrument"]["errors"] == 1
+    # bytes, not characters
+    assert metrics["types"]["instrument"]["bytes"] == len(f"2 {error}") + 1
+
+
+def test_an_auth_error_on_an_unchecked_session_reconnects_with_refreshed_cookies(monkeypatch):
+    auth_error = json.dumps({"errors": [{"errorCode": "AUTHENTICATION_ERROR"}]})
+    sockets_before_refresh = []
+
+    def respond(payload):
+        return [f"E {auth_error}"] if not sockets_before_refresh else _echo(payload)
+
+    tr, sockets = _api(monkeypatch, respond)
+    tr._session_unverified = True
+    monkeypatch.setattr(tr, "_revalidate_session", lambda: sockets_before_refresh.append(len(sockets)))
+
+    async def run():
+        async with tr.stream({"type": "instrument", "id": "X"}) as instrument:
+            payload = await instrument.get()
+        await tr.close()
+        return payload
+
+    assert asyncio.run(run()) == {"echo": "X"}
+    assert sockets_before_refresh == [1]
+    assert len(sockets) == 2 and sockets[0].close_code == 1000
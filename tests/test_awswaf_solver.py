@@ -0,0 +1,47 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+from pytr.awswaf import solver
+from pytr.awswaf.verify import compute_scrypt_nonce, hash_pow
+
+
+def _leading_zero_bits(digest: bytes) -> int:
+    return len(digest) * 8 - int.from_bytes(digest, "big").bit_length()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_hash_pow_finds_a_valid_nonce(workers, monkeypatch):
+    # Small enough to run quickly, but above the inline threshold so that two workers start processes.
+    monkeypatch.setitem(solver._INLINE_WORK, "sha256", 2**4)
+    nonce = hash_pow("challenge", "salt", 12, workers=workers)
+
+    assert _leading_zero_bits(hashlib.sha256(f"challengesalt{nonce}".encode()).digest()) >= 12
+
+
+def test_scrypt_nonce_is_valid():
+    nonce = compute_scrypt_nonce("challenge", "salt", 4)
+
+    digest = hashlib.scrypt(password=f"challengesalt{nonce}".encode(), salt=b"salt", n=128, r=8, p=1, dklen=16)
+    assert _leading_zero_bits(digest) >= 4
+
+
+def test_unsolvable_difficulties_give_up():
+    assert hash_pow("challenge", "salt", 257) is None
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_the_search_stops_at_the_deadline(workers):
+    start = time.monotonic()
+
+    assert solver.solve("sha256", "challengesalt", "salt", 200, 0.2, workers=workers) is None
+    assert time.monotonic() - start < 10
+
+
+def test_the_search_stops_when_told_to():
+    stop = threading.Event()
+    stop.set()
+
+    assert hash_pow("challenge", "salt", 200, workers=1, stop=stop) is None
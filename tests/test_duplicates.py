@@ -0,0 +1,70 @@
+import logging
+import random
+
+import pytest
+
+from pytr.timeline import DuplicateIndex, is_likely_same_but_newer, merge_events
+
+LOG = logging.getLogger(__name__)
+
+
+def _event(event_id, timestamp, title="Apple", subtitle="Sparplan ausgeführt"):
+    return {"id": event_id, "timestamp": timestamp, "title": title, "subtitle": subtitle}
+
+
+def _merge_by_scan(old_events, new_events):
+    # Every event against every merged one, as the merge did before DuplicateIndex.
+    cur_events = {}
+    for events, other_ids_only in ((old_events, False), (new_events, True)):
+        for event in events:
+            for id, cur_event in cur_events.items():
+                if (not other_ids_only or event["id"] != id) and is_likely_same_but_newer(event, cur_event):
+                    del cur_events[id]
+                    break
+            cur_events[event["id"]] = event
+    return list(cur_events.values())
+
+
+def test_index_finds_only_older_events_of_the_same_kind_within_500_ms():
+    index = DuplicateIndex()
+    for event in [
+        _event("a", "2024-05-01T10:00:00.000+0000"),
+        _event("b", "2024-05-01T09:59:59.400+0000"),
+        _event("c", "2024-05-01T10:00:00.200+0000", title="SAP"),
+        _event("d", "2024-05-01T10:00:00.200+0000", subtitle="Zinszahlung"),
+    ]:
+        index.add(event)
+
+    assert index.find_older(_event("x", "2024-05-01T10:00:00.500+0000")) == "a"
+    assert index.find_older(_event("x", "2024-05-01T10:00:00.501+0000")) is None
+    assert index.find_older(_event("x", "2024-05-01T09:59:59.900+0000")) == "b"
+    assert index.find_older(_event("x", "2024-05-01T09:59:59.300+0000")) is None
+    assert index.find_older(_event("x", "2024-05-01T10:00:00.300+0000", subtitle="Zinszahlung")) is None
+
+    # "e" is the same instant as "c" in another time zone, but is added after "a"
+    index.add(_event("e", "2024-05-01T12:00:00.200+0200"))
+    assert index.find_older(_event("x", "2024-05-01T10:00:00.300+0000")) == "a"
+    assert index.find_older(_event("a", "2024-05-01T10:00:00.300+0000"), other_than="a") == "e"
+
+    index.remove("a")
+    assert index.find_older(_event("x", "2024-05-01T10:00:00.300+0000")) == "e"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_merge_drops_the_same_duplicates_as_a_scan_of_every_pair(seed):
+    rng = random.Random(seed)
+
+    def events(count, id_offset):
+        return [
+            _event(
+                f"id-{rng.randrange(id_offset, id_offset + count)}",
+                f"2024-05-01T10:00:{rng.randrange(3):02d}.{rng.randrange(0, 1000, 100):03d}+0000",
+                title=rng.choice(["Apple", "SAP"]),
+                subtitle=rng.choice(["Sparplan ausgeführt", "Limit-Buy-Order", "Fertig"]),
+            )
+            for _ in range(count)
+        ]
+
+    old_events, new_events = events(200, 0), events(50, 150)
+
+    assert merge_events(old_events, new_events, LOG, scan_for_duplicates=True) == _merge_by_scan(old_events, new_events)
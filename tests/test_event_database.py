@@ -0,0 +1,229 @@
+import asyncio
+import copy
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from pytr import jsonio, timestamps
+from pytr.event_database import JsonEventDatabase, NdjsonEventDatabase, SqliteEventDatabase, open_event_database
+from pytr.timeline import Timeline
+
+ALL_EVENTS_FILE = Path(__file__).parent / "all_events_test.json"
+
+
+@pytest.fixture(params=["json", "sqlite", "ndjson"])
+def database(request, tmp_path):
+    if request.param == "json":
+        return open_event_database(tmp_path / "all_events.json")
+    return open_event_database(f"{request.param}:{tmp_path / 'events'}")
+
+
+def _rowids(path):
+    with sqlite3.connect(path) as connection:
+        return dict(connection.execute("SELECT id, rowid FROM events"))
+
+
+def test_open_event_database_picks_the_backend_by_location(tmp_path):
+    assert isinstance(open_event_database(tmp_path / "all_events.json"), JsonEventDatabase)
+    sqlite = open_event_database(f"sqlite:{tmp_path / 'events.db'}")
+    assert isinstance(sqlite, SqliteEventDatabase)
+    assert sqlite.path == tmp_path / "events.db"
+    assert isinstance(open_event_database(f"ndjson:{tmp_path / 'events.ndjson'}"), NdjsonEventDatabase)
+
+
+def test_database_reads_back_what_was_written_and_streams_ranges_of_it(database):
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    assert not database.exists()
+
+    database.write(events)
+
+    assert sorted(database.read(), key=lambda event: event["id"]) == sorted(events, key=lambda event: event["id"])
+    not_before = timestamps.epoch("2024-06-01T00:00:00")
+    not_after = timestamps.epoch("2025-01-01T00:00:00")
+    assert {event["id"] for event in database.stream(not_before, not_after)} == {
+        "deposit-001",
+        "e230be28-286a-31b6-879f-5c97f8a9d85a",
+    }
+
+
+def test_database_streams_events_in_time_order_even_if_written_out_of_order(database):
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    assert sorted(events, key=timestamps.event_epoch) != events
+
+    database.write(events)
+
+    assert list(database.stream()) == sorted(events, key=timestamps.event_epoch)
+
+
+def test_replaying_streams_the_events_again_instead_of_keeping_them(database, tmp_path):
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    database.write(events)
+    replayed = []
+
+    tl = Timeline(
+        tr=None,
+        output_path=tmp_path / "out",
+        store_event_database=False,
+        load_event_database=str(database),
+        event_callback=replayed.append,
+    )
+    asyncio.run(tl.tl_loop())
+
+    assert not isinstance(tl.events, list)
+    assert replayed == sorted(events, key=timestamps.event_epoch)
+    assert list(tl.events) == list(tl.events) == replayed
+
+
+def test_sqlite_write_only_touches_changed_and_removed_events(tmp_path):
+    path = tmp_path / "events.db"
+    SqliteEventDatabase(path).write(jsonio.read_file(ALL_EVENTS_FILE))
+    rowids = _rowids(path)
+
+    database = SqliteEventDatabase(path)
+    events = database.read()
+    changed = dict(events[0], status="CANCELED")
+    database.write([changed] + events[2:])
+
+    after = _rowids(path)
+    assert set(after) == set(rowids) - {events[1]["id"]}
+    assert after[changed["id"]] != rowids[changed["id"]]
+    assert all(after[event["id"]] == rowids[event["id"]] for event in events[2:])
+    assert {event["id"]: event for event in SqliteEventDatabase(path).read()}[changed["id"]]["status"] == "CANCELED"
+
+
+def test_writing_equal_copies_of_the_events_read_writes_nothing(tmp_path):
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    sqlite_path, ndjson_path = tmp_path / "events.db", tmp_path / "events.ndjson"
+    for database in (SqliteEventDatabase(sqlite_path), NdjsonEventDatabase(ndjson_path)):
+        database.write(events)
+    rowids = _rowids(sqlite_path)
+    log = ndjson_path.read_bytes()
+
+    # as in a sync that fetched every event again
+    for database in (SqliteEventDatabase(sqlite_path), NdjsonEventDatabase(ndjson_path)):
+        database.write(copy.deepcopy(database.read()))
+
+    assert _rowids(sqlite_path) == rowids
+    assert ndjson_path.read_bytes() == log
+
+
+def test_timeline_replays_an_sqlite_event_database(tmp_path):
+    location = f"sqlite:{tmp_path / 'events.db'}"
+    open_event_database(location).write(jsonio.read_file(ALL_EVENTS_FILE))
+    replayed = []
+
+    tl = Timeline(
+        tr=None,
+        output_path=tmp_path / "out",
+        store_event_database=False,
+        load_event_database=location,
+        not_before=timestamps.epoch("2025-01-01T00:00:00"),
+        event_callback=replayed.append,
+    )
+    asyncio.run(tl.tl_loop())
+
+    assert [event["id"] for event in tl.events] == [
+        "5b0f491f-7bad-40b1-8cd1-56d83729afd4",
+        "88008da6-da94-3e0e-8ea5-e3878643f5ab",
+    ]
+    assert replayed == list(tl.events)
+
+
+def test_ndjson_write_appends_changed_and_removed_events_and_the_last_record_wins(tmp_path):
+    path = tmp_path / "events.ndjson"
+    NdjsonEventDatabase(path).write(jsonio.read_file(ALL_EVENTS_FILE))
+
+    database = NdjsonEventDatabase(path)
+    events = database.read()
+    changed = dict(events[0], status="CANCELED")
+    database.write([changed] + events[2:])
+
+    records = [jsonio.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [record["seq"] for record in records] == list(range(7))
+    assert records[5:] == [
+        {"seq": 5, "id": changed["id"], "event": changed},
+        {"seq": 6, "id": events[1]["id"], "deleted": True},
+    ]
+    assert sorted(NdjsonEventDatabase(path).read(), key=lambda event: event["id"]) == sorted(
+        [changed] + events[2:], key=lambda event: event["id"]
+    )
+
+
+def test_ndjson_ignores_and_overwrites_a_record_cut_off_while_appending(tmp_path):
+    path = tmp_path / "events.ndjson"
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    NdjsonEventDatabase(path).write(events)
+    with path.open("ab") as f:
+        f.write(b'{"seq": 5, "id": "new", "ev')
+
+    database = NdjsonEventDatabase(path)
+    assert len(database.read()) == 5
+    database.write(database.read() + [dict(events[0], id="new")])
+
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 6
+    assert len(NdjsonEventDatabase(path).read()) == 6
+
+
+def test_ndjson_ignores_and_overwrites_a_record_cut_off_before_its_newline(tmp_path):
+    path = tmp_path / "events.ndjson"
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    NdjsonEventDatabase(path).write(events)
+    path.write_bytes(path.read_bytes()[:-1])
+
+    database = NdjsonEventDatabase(path)
+    read = database.read()
+    assert len(read) == 4
+    database.write(read + [events[-1]])
+
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 5
+    assert len(NdjsonEventDatabase(path).read()) == 5
+
+
+def test_ndjson_compacts_once_most_records_are_superseded(tmp_path):
+    path = tmp_path / "events.ndjson"
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    database = NdjsonEventDatabase(path)
+    database.write(events)
+
+    database.write([dict(event, status="CANCELED") for event in events[:2]] + events[2:])
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 7
+    database.write([dict(event, status="SETTLED") for event in events[:4]] + events[4:])
+
+    records = [jsonio.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert len(records) == 5
+    assert [record["id"] for record in records] == [event["id"] for event in sorted(events, key=timestamps.event_epoch)]
+    assert max(record["seq"] for record in records) == 10
+    assert not (tmp_path / "events.ndjson.compacting").exists()
+
+
+def test_compact_db_command_rewrites_the_event_database(database):
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    database.write(events)
+    database.write([dict(events[0], status="CANCELED")] + events[1:])
+
+    result = subprocess.run([sys.executable, "-m", "pytr", "compact_db", str(database)], capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    compacted = open_event_database(str(database))
+    assert [event["id"] for event in compacted.stream()] == [
+        event["id"] for event in sorted(events, key=timestamps.event_epoch)
+    ]
+    if isinstance(compacted, NdjsonEventDatabase):
+        assert len(compacted.path.read_text(encoding="utf-8").splitlines()) == 5
+
+
+def test_ndjson_stream_returns_the_last_record_of_every_event(tmp_path):
+    path = tmp_path / "events.ndjson"
+    events = jsonio.read_file(ALL_EVENTS_FILE)
+    database = NdjsonEventDatabase(path)
+    database.write(events)
+    changed = dict(events[3], status="CANCELED")
+    database.write(events[:2] + [changed])
+
+    streamed = NdjsonEventDatabase(path).stream()
+    assert sorted(streamed, key=lambda event: event["id"]) == sorted(
+        events[:2] + [changed], key=lambda event: event["id"]
+    )
@@ -6,6 +6,7 @@ Uses tests/all_events_test.json with 5 events: buy, sell, dividend, deposit, spl
 import asyncio
 import csv
 import io
+import json
 import subprocess
 import sys
 from datetime import datetime
@@ -27,7 +28,7 @@ def load_events(output_dir):
         load_event_database=ALL_EVENTS_FILE,
     )
     asyncio.run(tl.tl_loop())
-    return tl.events
+    return list(tl.events)
 
 
 def export_csv(events):
@@ -164,3 +165,14 @@ def test_cli_golden(tmp_path):
     actual = out_file.read_text(encoding="utf-8")
     expected = GOLDEN_CSV.read_text(encoding="utf-8")
     assert actual == expected
+
+
+def test_json_export_matches_the_stdlib(tmp_path):
+    """The JSON export writes a line per transaction as json.dumps does, whatever JSON backend is installed."""
+    parsed = [Event.from_dict(e) for e in load_events(tmp_path)]
+    buf = io.StringIO()
+    TransactionExporter(lang="de").export(buf, parsed, sort=True, format="json")
+
+    lines = buf.getvalue().splitlines()
+    assert len(lines) >= 5
+    assert lines == [json.dumps(json.loads(line)) for line in lines]
@@ -0,0 +1,65 @@
+import json
+from decimal import Decimal
+
+import pytest
+
+from pytr import jsonio
+
+EVENTS = [{"id": "1", "title": "Müller AG", "amount": {"value": 12.5}, "details": None}]
+
+
+@pytest.fixture(autouse=True, params=sorted({jsonio.BACKEND, "json"}))
+def backend(request, monkeypatch):
+    """Run every test with the installed backend and with the standard library it falls back to."""
+    if request.param == "json":
+        monkeypatch.setattr(jsonio, "_loads", json.loads)
+        monkeypatch.setattr(jsonio, "_dumps", jsonio._stdlib_dumps)
+    return request.param
+
+
+def test_dumps_round_trips_without_escaping_non_ascii():
+    encoded = jsonio.dumps(EVENTS)
+
+    assert "Müller" in encoded
+    assert jsonio.loads(encoded) == EVENTS
+    assert jsonio.loads(encoded.encode()) == EVENTS
+
+
+def test_values_without_a_json_type_are_written_as_strings():
+    assert jsonio.loads(jsonio.dumps({"value": Decimal("1.10")})) == {"value": "1.10"}
+
+
+def test_invalid_input_raises_the_stdlib_decode_error():
+    with pytest.raises(json.JSONDecodeError):
+        jsonio.loads("")
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_write_file_matches_the_stdlib(tmp_path, compact):
+    path = tmp_path / "all_events.json"
+
+    jsonio.write_file(path, EVENTS, compact=compact)
+
+    written = path.read_text(encoding="utf-8")
+    assert json.loads(written) == EVENTS
+    assert written == jsonio._stdlib_dumps(EVENTS, not compact).decode()
+    assert jsonio.read_file(path) == EVENTS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 20])
+@pytest.mark.parametrize("compact", [False, True])
+def test_iter_array_parses_elements_across_chunk_boundaries(tmp_path, chunk_size, compact):
+    path = tmp_path / "all_events.json"
+    elements = EVENTS * 3 + [[], 123456789, 1.5e10, "a ], b", None]
+    jsonio.write_file(path, elements, compact=compact)
+
+    assert list(jsonio.iter_array(path, chunk_size)) == elements
+
+
+@pytest.mark.parametrize("document", ["", "{}", "[1, 2", "[1 2]", "[1,]", "[1.]"])
+def test_iter_array_rejects_anything_but_an_array(tmp_path, document):
+    path = tmp_path / "all_events.json"
+    path.write_text(document, encoding="utf-8")
+
+    with pytest.raises(json.JSONDecodeError):
+        list(jsonio.iter_array(path, 2))
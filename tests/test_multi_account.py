@@ -0,0 +1,80 @@
+"""Tests for reading the accounts file of `dl_docs --accounts` and the concurrency cap of the runner."""
+
+import asyncio
+
+import pytest
+
+from pytr.main import _run_command, get_main_parser
+from pytr.multi_account import _run_all, load_accounts
+
+
+def test_load_accounts_defaults_the_name_to_the_phone_number(tmp_path):
+    path = tmp_path / "accounts.toml"
+    path.write_text(
+        '[[account]]\nphone_no = "+491"\npin = 1234\n\n[[account]]\nname = "bob"\nphone_no = "+492"\npin = "5678"\n'
+    )
+
+    accounts = load_accounts(path)
+
+    assert [a["name"] for a in accounts] == ["+491", "bob"]
+    assert accounts[0]["pin"] == "1234"
+
+
+def test_load_accounts_requires_phone_no_and_pin(tmp_path):
+    path = tmp_path / "accounts.toml"
+    path.write_text('[[account]]\nphone_no = "+491"\n')
+
+    with pytest.raises(ValueError, match="no pin"):
+        load_accounts(path)
+
+
+def test_load_accounts_rejects_duplicate_names(tmp_path):
+    path = tmp_path / "accounts.toml"
+    path.write_text('[[account]]\nphone_no = "+491"\npin = "1"\n\n[[account]]\nphone_no = "+491"\npin = "2"\n')
+
+    with pytest.raises(ValueError, match="unique"):
+        load_accounts(path)
+
+
+class _FakeTimeline:
+    def __init__(self, tracker, fail):
+        self.tracker = tracker
+        self.fail = fail
+
+    async def tl_loop(self):
+        self.tracker["running"] += 1
+        self.tracker["peak"] = max(self.tracker["peak"], self.tracker["running"])
+        await asyncio.sleep(0.01)
+        self.tracker["running"] -= 1
+        if self.fail:
+            raise ConnectionError("boom")
+
+
+class _FakeDL:
+    def __init__(self, tracker, fail=False):
+        self.tl = _FakeTimeline(tracker, fail)
+        self.exported = False
+
+    def export_and_download(self):
+        self.exported = True
+
+
+def test_run_all_caps_concurrency_and_counts_failures():
+    tracker = {"running": 0, "peak": 0}
+    dls = {f"account{i}": _FakeDL(tracker, fail=i == 3) for i in range(6)}
+
+    failed = asyncio.run(_run_all(dls, max_concurrency=2))
+
+    assert failed == 1
+    assert tracker["peak"] == 2
+    assert [dl.exported for dl in dls.values()] == [True, True, True, False, True, True]
+
+
+@pytest.mark.parametrize(
+    "option", [["--api-url", "http://localhost:8765"], ["--metrics-file", "metrics.json"], ["--replay-session", "x"]]
+)
+def test_dl_docs_rejects_options_that_accounts_would_ignore(tmp_path, option):
+    parser = get_main_parser()
+    args = parser.parse_args(["dl_docs", str(tmp_path), "--accounts", str(tmp_path / "accounts.toml"), *option])
+
+    assert _run_command(parser, args, 0, float("inf")) == -1
@@ -0,0 +1,61 @@
+"""Tests for the websocket frame codec: frame splitting and the delta format, checked against real event payloads."""
+
+import json
+import urllib.parse
+from pathlib import Path
+
+import pytest
+
+from pytr.protocol import apply_delta, encode_delta, parse_frame
+
+EVENTS_DIR = Path(__file__).parent / "events"
+
+
+def _legacy_apply_delta(previous, delta):
+    """The delta applier TradeRepublicApi used before pytr.protocol, kept as the reference behaviour."""
+    i, result = 0, []
+    for diff in delta.split("\t"):
+        sign = diff[0]
+        if sign == "+":
+            result.append(urllib.parse.unquote_plus(diff).strip())
+        elif sign == "-" or sign == "=":
+            if sign == "=":
+                result.append(previous[i : i + int(diff[1:])])
+            i += int(diff[1:])
+    return "".join(result)
+
+
+@pytest.mark.parametrize(
+    "frame, expected",
+    [
+        ('12 A {"a":1}', ("12", "A", '{"a":1}')),
+        ("12 D =5\t+6", ("12", "D", "=5\t+6")),
+        ("7 C", ("7", "C", "")),
+        ('3 E  {"errors":[]}', ("3", "E", '{"errors":[]}')),
+    ],
+)
+def test_parse_frame(frame, expected):
+    assert parse_frame(frame) == expected
+
+
+def test_apply_delta_decodes_inserts():
+    assert apply_delta('{"name":"old"}', "=9\t-3\t+new%C3%A4+x\t=2") == '{"name":"newä x"}'
+
+
+def _payload_pairs():
+    payloads = [json.dumps(json.loads(p.read_text(encoding="utf-8"))) for p in sorted(EVENTS_DIR.glob("*.json"))]
+    return list(zip(payloads, payloads[1:]))[:40]
+
+
+@pytest.mark.parametrize("previous, current", _payload_pairs())
+def test_encode_delta_round_trips_and_matches_the_legacy_applier(previous, current):
+    delta = encode_delta(previous, current)
+
+    assert apply_delta(previous, delta) == current
+    assert _legacy_apply_delta(previous, delta) == current
+
+
+def test_encode_delta_replaces_everything_when_an_insert_has_outer_whitespace():
+    delta = encode_delta('{"a":"x"}', '{"a":"x y"}')
+
+    assert apply_delta('{"a":"x"}', delta) == '{"a":"x y"}'
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+import pytr.api
+from pytr import jsonio
+from pytr.api import TradeRepublicApi, TradeRepublicError
+from pytr.replay import replay_api
+
+TICKER = {"type": "ticker", "id": "X.LSX"}
+FRAMES = ['A {"price":"10"}', "D =10\t+11\t-2\t=2", "D =10\t+12\t-2\t=2"]
+
+
+class _Server:
+    """Answers every `sub` with FRAMES."""
+
+    def __init__(self):
+        self.close_code = None
+        self._frames: asyncio.Queue = asyncio.Queue()
+        self._frames.put_nowait("connected")
+
+    async def send(self, message):
+        if message.startswith("sub "):
+            subscription_id = message.split(" ")[1]
+            for frame in FRAMES:
+                self._frames.put_nowait(f"{subscription_id} {frame}")
+
+    async def recv(self):
+        return await self._frames.get()
+
+    async def close(self):
+        self.close_code = 1000
+
+
+async def _three_prices(tr):
+    async with tr.stream(TICKER) as ticker:
+        prices = [(await ticker.get())["price"] for _ in range(3)]
+    await tr.close()
+    return prices
+
+
+@pytest.fixture
+def recording(monkeypatch, tmp_path):
+    async def connect(*args, **kwargs):
+        return _Server()
+
+    monkeypatch.setattr(pytr.api.websockets, "connect", connect)
+    path = tmp_path / "session.ndjson"
+    tr = TradeRepublicApi(phone_no="+490000000000", pin="0000", waf_token=None, record_session=path)
+    assert asyncio.run(_three_prices(tr)) == ["10", "11", "12"]
+    tr._session_recorder.close()
+    return path
+
+
+def test_recording_holds_every_frame_in_both_directions(recording):
+    records = [jsonio.loads(line) for line in recording.read_text(encoding="utf-8").splitlines()]
+
+    assert [record["dir"] for record in records] == ["out", "in", "out", "in", "in", "in", "out"]
+    assert records[2]["frame"] == f"sub 1 {json.dumps(TICKER)}"
+    assert [record["frame"] for record in records[3:6]] == [f"1 {frame}" for frame in FRAMES]
+    assert all(later["t"] >= earlier["t"] for earlier, later in zip(records, records[1:]))
+
+
+@pytest.mark.parametrize("realtime", [False, True])
+def test_replay_answers_recorded_subscriptions_including_deltas(recording, realtime):
+    tr = replay_api(recording, realtime=realtime)
+
+    assert asyncio.run(_three_prices(tr)) == ["10", "11", "12"]
+
+
+def test_replay_answers_unrecorded_subscriptions_with_an_error(recording):
+    tr = replay_api(recording)
+
+    async def run():
+        async with tr.stream({"type": "instrument", "id": "X"}) as instrument:
+            with pytest.raises(TradeRepublicError) as excinfo:
+                await instrument.get()
+        await tr.close()
+        return excinfo.value
+
+    assert asyncio.run(run()).error["errors"][0]["errorCode"] == "NOT_RECORDED"
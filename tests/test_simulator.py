@@ -0,0 +1,188 @@
+import asyncio
+import threading
+
+import pytest
+from websockets.asyncio.client import connect
+
+from pytr import jsonio
+from pytr.account import login
+from pytr.api import TradeRepublicError
+from pytr.dl import DL
+from pytr.event_database import open_event_database
+from pytr.simulator import Simulator
+from pytr.timeline import Timeline
+
+
+@pytest.fixture
+def simulator(request):
+    """
+    A simulator serving on a free port from a loop of its own, as `pytr simulate` would. Tests can pass other
+    arguments with `@pytest.mark.parametrize("simulator", [{...}], indirect=True)`.
+    """
+    simulator = Simulator(**{"events": 30, "page_size": 7, "tick_interval": 0.01, **getattr(request, "param", {})})
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    stop = asyncio.Event()
+
+    async def serve():
+        async with simulator.running():
+            started.set()
+            await stop.wait()
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True)
+    thread.start()
+    started.wait(5)
+    yield simulator
+    loop.call_soon_threadsafe(stop.set)
+    thread.join(5)
+
+
+def test_dl_docs_downloads_every_document_of_the_simulated_account(simulator, tmp_path):
+    tr = login(api_url=simulator.base_url)
+
+    DL(tr, tmp_path, "{iso_date} {title} ({id})").do_dl()
+
+    documents = sorted(tmp_path.rglob("*.pdf"))
+    assert len(documents) == 30
+    assert all(document.read_bytes().startswith(b"%PDF") for document in documents)
+    assert len((tmp_path / "account_transactions.csv").read_text(encoding="utf-8").splitlines()) > 1
+
+
+def test_ticker_sends_deltas_and_unknown_subscriptions_fail(simulator):
+    tr = login(api_url=simulator.base_url)
+
+    async def run():
+        async with tr.stream({"type": "ticker", "id": "DE0007164600.LSX"}) as ticker:
+            quotes = [await ticker.get() for _ in range(3)]
+        async with tr.stream({"type": "neonCards"}) as cards:
+            with pytest.raises(TradeRepublicError):
+                await cards.get()
+        await tr.close()
+        return quotes
+
+    quotes = asyncio.run(run())
+
+    assert quotes[0]["last"]["price"] == "100.00"
+    assert all(set(quote) == {"bid", "ask", "last", "open"} for quote in quotes)
+
+
+# A not_before other than 0 makes the sync replace the database events in its range, the ones it did not reach
+# again have to stay.
+@pytest.mark.parametrize("not_before", [0.0, 1.0])
+def test_incremental_dl_docs_stops_paging_at_known_events(simulator, tmp_path, not_before):
+    DL(login(api_url=simulator.base_url), tmp_path, "{iso_date} {title} ({id})").do_dl()
+    database = tmp_path / "all_events.json"
+    full_sync = database.read_text(encoding="utf-8")
+
+    tr = login(api_url=simulator.base_url)
+    DL(tr, tmp_path, "{iso_date} {title} ({id})", not_before, incremental=True, incremental_margin=5).do_dl()
+
+    # 23 transactions and 7 activities in pages of 7: the first page of each holds enough known events.
+    assert tr.metrics["timelineTransactions"].subscriptions == 1
+    assert tr.metrics["timelineActivityLog"].subscriptions == 1
+    assert tr.metrics["timelineDetailV2"].subscriptions == 14
+    assert len(jsonio.loads(database.read_text(encoding="utf-8"))) == len(jsonio.loads(full_sync)) == 30
+
+
+def test_reuse_details_only_requests_changed_events(simulator, tmp_path):
+    DL(login(api_url=simulator.base_url), tmp_path, "{iso_date} {title} ({id})").do_dl()
+    database = tmp_path / "all_events.json"
+    events = jsonio.loads(database.read_text(encoding="utf-8"))
+    events[0]["status"] = "PENDING"
+    database.write_text(jsonio.dumps(events), encoding="utf-8")
+
+    tr = login(api_url=simulator.base_url)
+    dl = DL(tr, tmp_path, "{iso_date} {title} ({id})", reuse_details=True)
+    dl.do_dl()
+
+    assert tr.metrics["timelineDetailV2"].subscriptions == 1
+    assert dl.tl.reused_detail == 29
+    assert all(event["details"] for event in jsonio.loads(database.read_text(encoding="utf-8")))
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "ndjson"])
+def test_dl_docs_keeps_the_event_database_in_sqlite_or_ndjson(simulator, tmp_path, backend):
+    location = f"{backend}:{tmp_path / 'events'}"
+    DL(login(api_url=simulator.base_url), tmp_path, "{iso_date} {title} ({id})", event_database=location).do_dl()
+
+    tr = login(api_url=simulator.base_url)
+    dl = DL(
+        tr,
+        tmp_path,
+        "{iso_date} {title} ({id})",
+        event_database=location,
+        incremental=True,
+        incremental_margin=5,
+        reuse_details=True,
+    )
+    dl.do_dl()
+
+    assert not (tmp_path / "all_events.json").exists()
+    assert tr.metrics["timelineDetailV2"].subscriptions == 0
+    assert dl.tl.reused_detail == 14
+    assert len(open_event_database(location).read()) == 30
+
+
+def test_one_off_answers_and_unsubscribed_tickers_are_completed(simulator):
+    async def run():
+        async with connect(simulator.base_url.replace("http", "ws")) as ws:
+            await ws.send("connect 31 {}")
+            assert await ws.recv() == "connected"
+            await ws.send('sub 1 {"type": "instrument", "id": "X"}')
+            frames = [await ws.recv(), await ws.recv()]
+            await ws.send('sub 2 {"type": "ticker", "id": "X.LSX"}')
+            frames.append(await ws.recv())
+            await ws.send("unsub 2")
+            while not frames[-1].startswith("2 C"):
+                frames.append(await ws.recv())
+            return frames
+
+    frames = asyncio.run(run())
+
+    assert [frame.split(" ")[:2] for frame in frames[:3]] == [["1", "A"], ["1", "C"], ["2", "A"]]
+    assert frames[-1] == "2 C"
+
+
+def test_completed_subscriptions_are_counted(simulator):
+    tr = login(api_url=simulator.base_url)
+
+    async def run():
+        async with tr.stream({"type": "instrument", "id": "X"}) as instrument:
+            await instrument.get()
+            with pytest.raises(EOFError):
+                await instrument.get()
+        await tr.close()
+
+    asyncio.run(run())
+
+    assert tr.metrics["instrument"].completed == 1
+
+
+# No delta arrives before the unsubscribe, so every frame is accounted for.
+@pytest.mark.parametrize("simulator", [{"tick_interval": 60}], indirect=True)
+def test_the_completion_of_an_unsubscribed_ticker_is_not_counted_as_dropped(simulator):
+    tr = login(api_url=simulator.base_url)
+
+    async def run():
+        async with tr.stream({"type": "ticker", "id": "X.LSX"}) as ticker:
+            await ticker.get()
+        # gives the C frame of the unsubscribe time to arrive
+        await asyncio.sleep(0.2)
+        await tr.close()
+
+    asyncio.run(run())
+
+    assert tr.metrics.dropped_frames == 0
+    assert tr.metrics["ticker"].as_dict()["delta_ratio"] == 0.0
+
+
+@pytest.mark.parametrize("simulator", [{"error_rate": 1.0, "page_size": 5}], indirect=True)
+def test_a_timeline_page_that_keeps_failing_ends_that_timeline(simulator, tmp_path):
+    tr = login(api_url=simulator.base_url)
+    tl = Timeline(tr, tmp_path, store_event_database=False)
+
+    asyncio.run(tl.tl_loop())
+
+    assert tl.dl_done
+    assert tl.events == []
+    assert sorted(tl.error_counts.values()) == [3, 3]
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import shtab
+
+from pytr.constants import COMPLETION_SHELLS
+
+# Modules that only the commands themselves need. None of them may be loaded to build the parser.
+HEAVY_MODULES = {
+    "asyncio",
+    "babel",
+    "certifi",
+    "curl_cffi",
+    "pathvalidate",
+    "pygments",
+    "pytr.account",
+    "pytr.api",
+    "pytr.dl",
+    "pytr.event",
+    "requests",
+    "requests_futures",
+    "shtab",
+    "websockets",
+}
+
+
+def _importtime(code):
+    """The modules imported by running `code` in a fresh interpreter, with their cumulative import time in µs."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_building_the_parser_does_not_import_the_commands():
+    # Some environments import modules like certifi at interpreter startup already, those do not count.
+    preloaded = _importtime("pass")
+    modules = _importtime("import pytr.main; pytr.main.get_main_parser()")
+
+    imported = HEAVY_MODULES & (set(modules) - set(preloaded))
+    assert not imported, f"pytr.main took {modules['pytr.main'] / 1000:.1f} ms"
+
+
+def test_completion_offers_only_shells_shtab_supports():
+    assert set(COMPLETION_SHELLS) <= set(shtab.SUPPORTED_SHELLS)
@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+
+from pytr.timeline import DetailRequestWindow, Timeline
+
+
+def test_window_doubles_per_round_trip_until_it_first_halves_then_grows_by_about_one():
+    window = DetailRequestWindow(minimum=10, maximum=1000, initial=10)
+
+    for _ in range(10):
+        window.on_response(0.1)
+    assert window.limit == 20
+    for _ in range(20):
+        window.on_response(0.1)
+    assert window.limit == 40
+
+    window.on_error()
+    assert window.limit == 20
+    for _ in range(20):
+        window.on_response(0.1)
+    assert window.size == pytest.approx(21, abs=0.1)
+
+
+def test_window_halves_once_per_window_on_errors_and_respects_the_minimum():
+    window = DetailRequestWindow(minimum=10, maximum=100, initial=40)
+    for _ in range(40):
+        window.on_response(0.1)
+    size = window.size
+
+    window.on_error()
+    window.on_error()
+
+    assert window.size == size / 2
+    for _ in range(200):
+        window.on_error()
+    assert window.limit == 10
+
+
+def test_window_shrinks_when_responses_slow_down_and_stops_at_the_maximum():
+    window = DetailRequestWindow(minimum=1, maximum=20, initial=20)
+    for _ in range(100):
+        window.on_response(0.1)
+    assert window.limit == 20
+
+    for _ in range(10):
+        window.on_response(1.0)
+    assert window.limit == 10
+
+
+def test_window_rejects_invalid_bounds():
+    with pytest.raises(ValueError):
+        DetailRequestWindow(minimum=10, maximum=5)
+
+
+class _FakeTR:
+    """Answers every timeline request in order and tracks how many detail requests are unanswered."""
+
+    def __init__(self, events):
+        self._events = events
+        self._responses = asyncio.Queue()
+        self.inflight = 0
+        self.max_inflight = 0
+
+    async def timeline_transactions(self, after=None):
+        self._responses.put_nowait(("1", {"type": "timelineTransactions"}, {"items": self._events, "cursors": {}}))
+
+    async def timeline_activity_log(self, after=None):
+        self._responses.put_nowait(("2", {"type": "timelineActivityLog"}, {"items": [], "cursors": {}}))
+
+    async def timeline_detail_v2(self, timeline_id):
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        subscription = {"type": "timelineDetailV2", "id": timeline_id}
+        self._responses.put_nowait((timeline_id, subscription, {"id": timeline_id, "sections": []}))
+
+    async def recv(self):
+        response = await self._responses.get()
+        if response[1]["type"] == "timelineDetailV2":
+            self.inflight -= 1
+        return response
+
+    async def unsubscribe(self, subscription_id):
+        pass
+
+    async def close(self):
+        pass
+
+
+def test_timeline_keeps_detail_requests_within_the_window(tmp_path):
+    events = [
+        {
+            "id": f"event-{i}",
+            "title": "Title",
+            "subtitle": "Subtitle",
+            "timestamp": f"2024-01-01T00:00:{i:02d}.000+0000",
+            "action": {"type": "timelineDetail", "payload": f"event-{i}"},
+        }
+        for i in range(50, 0, -1)
+    ]
+    tr = _FakeTR(events)
+    tl = Timeline(tr, tmp_path, store_event_database=False, min_inflight_details=2, max_inflight_details=5)
+
+    asyncio.run(tl.tl_loop())
+
+    assert 2 <= tr.max_inflight <= 5
+    assert len(tl.events) == 50
+    assert all(event["details"]["id"] == event["id"] for event in tl.events)
+
+
+class _PagedTR(_FakeTR):
+    """Serves the transactions in two pages and logs every request."""
+
+    def __init__(self, events):
+        super().__init__(events)
+        self.requests = []
+
+    async def timeline_transactions(self, after=None):
+        self.requests.append(("timelineTransactions", after))
+        half = len(self._events) // 2
+        page = self._events[half:] if after else self._events[:half]
+        cursors = {} if after else {"after": "page-2"}
+        self._responses.put_nowait(("1", {"type": "timelineTransactions"}, {"items": page, "cursors": cursors}))
+
+    async def timeline_activity_log(self, after=None):
+        self.requests.append(("timelineActivityLog", after))
+        await super().timeline_activity_log(after)
+
+    async def timeline_detail_v2(self, timeline_id):
+        self.requests.append(("timelineDetailV2", timeline_id))
+        await super().timeline_detail_v2(timeline_id)
+
+
+def test_timelines_are_paged_concurrently_and_details_requested_per_page(tmp_path):
+    events = [
+        {
+            "id": f"event-{i}",
+            "title": "Title",
+            "subtitle": "Subtitle",
+            "timestamp": f"2024-01-01T00:00:{i:02d}.000+0000",
+            "action": {"type": "timelineDetail", "payload": f"event-{i}"},
+        }
+        for i in range(10, 0, -1)
+    ]
+    tr = _PagedTR(events)
+    tl = Timeline(tr, tmp_path, store_event_database=False)
+
+    asyncio.run(tl.tl_loop())
+
+    assert tr.requests[:2] == [("timelineTransactions", None), ("timelineActivityLog", None)]
+    second_page = tr.requests.index(("timelineTransactions", "page-2"))
+    assert ("timelineDetailV2", "event-10") in tr.requests[:second_page]
+    assert len(tl.events) == 10
+
+
+class _LateActivityTR(_FakeTR):
+    """Sends the activity log page, with the activity log's version of the events, only after the details."""
+
+    def __init__(self, events, activities):
+        super().__init__(events)
+        self._activities = activities
+        self._activity_page = None
+
+    async def timeline_activity_log(self, after=None):
+        self._activity_page = ("2", {"type": "timelineActivityLog"}, {"items": self._activities, "cursors": {}})
+        if not any(event.get("action") for event in self._events):
+            self._responses.put_nowait(self._activity_page)
+
+    async def recv(self):
+        response = await super().recv()
+        if response[1]["type"] == "timelineDetailV2":
+            self._responses.put_nowait(self._activity_page)
+        return response
+
+
+@pytest.mark.parametrize("action", [{"type": "timelineDetail", "payload": "event-1"}, None])
+def test_the_activity_log_version_of_an_event_wins_when_it_arrives_last(tmp_path, action):
+    transaction = {
+        "id": "event-1",
+        "title": "Transaction",
+        "subtitle": "Subtitle",
+        "timestamp": "2024-01-01T00:00:01.000+0000",
+        "action": action,
+    }
+    tr = _LateActivityTR([transaction], [dict(transaction, title="Activity")])
+    tl = Timeline(tr, tmp_path, store_event_database=False)
+
+    asyncio.run(tl.tl_loop())
+
+    assert [event["title"] for event in tl.events] == ["Activity"]
+    if action is not None:
+        assert tl.events[0]["details"] == {"id": "event-1", "sections": []}
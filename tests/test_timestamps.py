@@ -0,0 +1,17 @@
+from datetime import datetime, timedelta, timezone
+
+from pytr import timestamps
+
+
+def test_parse_accepts_offsets_with_and_without_colon():
+    expected = datetime(2024, 5, 1, 10, 0, 0, 123000, tzinfo=timezone(timedelta(hours=2)))
+
+    assert timestamps.parse("2024-05-01T10:00:00.123+0200") == expected
+    assert timestamps.parse("2024-05-01T10:00:00.123+02:00") == expected
+
+
+def test_epoch_is_the_local_time_of_the_date_and_time():
+    event = {"timestamp": "2024-05-01T10:00:00.999+0200"}
+
+    assert timestamps.event_epoch(event) == datetime(2024, 5, 1, 10).timestamp()
+    assert timestamps.event_epoch(event) is timestamps.event_epoch(dict(event))